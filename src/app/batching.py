@@ -0,0 +1,94 @@
+'''
+Server-side micro-batching: concurrent single document requests are coalesced into one call of the model.
+'''
+import asyncio
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Callable, List
+
+from metrics import Counter, Gauge
+
+BATCHES = Counter( "classifier_batches_total", "Number of batched model calls made by the micro-batcher." )
+BATCHED_DOCUMENTS = Counter( "classifier_batched_documents_total", "Number of documents classified through the micro-batcher." )
+QUEUE_DEPTH = Gauge( "classifier_batch_queue_depth", "Number of documents waiting to be batched." )
+WINDOW_MS = Gauge( "classifier_batch_window_ms", "Maximum time (ms) a document waits for other documents before its batch is run." )
+MAX_BATCH_SIZE = Gauge( "classifier_batch_max_size", "Maximum number of documents in one micro-batch." )
+
+class MicroBatcher:
+    '''
+    Gathers documents submitted concurrently for up to `max_wait_ms` milliseconds or `max_batch_size` documents,
+    runs `predict_fn` once on the whole batch in `executor` (so the event loop is not blocked),
+    and resolves every waiting request with its own result.
+    '''
+    def __init__(self, predict_fn: Callable[ [List[Any]], List[Any] ], executor: Executor, max_batch_size: int=32, max_wait_ms: float=5.0 ):
+        self.predict_fn = predict_fn
+        self.executor = executor
+        self.max_batch_size = max( 1, max_batch_size )
+        self.max_wait_ms = max_wait_ms
+        self._pending = deque()
+        self._task = None
+        WINDOW_MS.set( max_wait_ms )
+        MAX_BATCH_SIZE.set( self.max_batch_size )
+
+    def start(self):
+        #events are bound to the running loop, so they are created at startup
+        self._not_empty = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = asyncio.ensure_future( self._run() )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, item ):
+        '''
+        Queues one document and waits until the batch it ends up in has been classified.
+        '''
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append( ( item, future ) )
+        QUEUE_DEPTH.inc()
+        self._not_empty.set()
+        if len( self._pending ) >= self.max_batch_size:
+            self._full.set()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._not_empty.wait()
+            if len( self._pending ) < self.max_batch_size:
+                try:
+                    await asyncio.wait_for( self._full.wait(), self.max_wait_ms / 1000 )
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = [ self._pending.popleft() for _ in range( min( len( self._pending ), self.max_batch_size ) ) ]
+            if not self._pending:
+                self._not_empty.clear()
+            if len( self._pending ) < self.max_batch_size:
+                self._full.clear()
+            QUEUE_DEPTH.dec( len( batch ) )
+
+            #do not wait for the model: the next batch can be gathered while this one runs
+            asyncio.ensure_future( self._process( batch ) )
+
+    async def _process(self, batch ):
+        BATCHES.inc()
+        BATCHED_DOCUMENTS.inc( len( batch ) )
+        loop = asyncio.get_event_loop()
+        try:
+            results = await loop.run_in_executor( self.executor, self.predict_fn, [ item for item, _ in batch ] )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception( e )
+            return
+
+        for ( _, future ), result in zip( batch, results ):
+            #the request may have been cancelled (client disconnected) in the meantime
+            if not future.done():
+                future.set_result( result )
@@ -1,3 +1,4 @@
 docker build \
 --no-cache \
--t docker.crosslang.com/ctlg-manager/docclas .
\ No newline at end of file
+-f Dockerfile \
+-t docker.crosslang.com/ctlg-manager/docclas ..
\ No newline at end of file
@@ -0,0 +1,145 @@
+'''
+Latency and throughput instrumentation of the classifier API: per stage timing histograms (decode, normalize, cache
+lookup, tf-idf transform, feature selection, calibrated classification), request and batch sizes and document lengths,
+exposed on /metrics and optionally logged as one json line per request (or batch).
+
+With INSTRUMENTATION=0 nothing is timed or observed, and the model is called with a single predict_proba.
+'''
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import List
+
+from metrics import Gauge, Histogram
+
+ENABLED = os.environ.get( "INSTRUMENTATION", "1" ) != "0"
+LOG_JSON = os.environ.get( "LOG_JSON", "0" ) == "1"
+
+STAGES = ( 'decode', 'normalize', 'cache', 'vectorize', 'feature_selection', 'classify' )
+
+#stage of the steps of the pipelines of train.py and streaming_train.py
+STEP_STAGES = { 'normalizer': 'normalize', 'vectorizer': 'vectorize', 'tfidf': 'vectorize', 'feature_selection': 'feature_selection', 'classification': 'classify' }
+
+LATENCY_BUCKETS = ( 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0 )
+SIZE_BUCKETS = ( 1, 2, 4, 8, 16, 32, 64, 128, 256, 512 )
+LENGTH_BUCKETS = ( 100, 1000, 5000, 10000, 50000, 100000, 500000, 1000000, 5000000 )
+
+STAGE_SECONDS = { stage: Histogram( "classifier_stage_seconds", "Time (s) spent per stage, per request (decode, normalize, cache) or per model call (the other stages).",
+                                    LATENCY_BUCKETS, labels={ 'stage': stage } ) for stage in STAGES }
+REQUEST_SECONDS = { endpoint: Histogram( "classifier_request_seconds", "Time (s) to handle a classification request.", LATENCY_BUCKETS, labels={ 'endpoint': endpoint } )
+                    for endpoint in ( '/classify_doc', '/classify_docs', '/classify_doc_stream' ) }
+REQUEST_DOCUMENTS = Histogram( "classifier_request_documents", "Number of documents per /classify_docs request.", SIZE_BUCKETS )
+BATCH_DOCUMENTS = Histogram( "classifier_model_call_documents", "Number of documents per call of the model.", SIZE_BUCKETS )
+DOCUMENT_CHARACTERS = Histogram( "classifier_document_characters", "Length (characters) of the decoded documents.", LENGTH_BUCKETS )
+MODEL_LOAD_SECONDS = Gauge( "classifier_model_load_seconds", "Time (s) to load, warm up and validate the served model." )
+
+logger = logging.getLogger( "classifier" )
+if LOG_JSON:
+    handler = logging.StreamHandler( sys.stderr )
+    handler.setFormatter( logging.Formatter( "%(message)s" ) )
+    logger.addHandler( handler )
+    logger.setLevel( logging.INFO )
+    logger.propagate = False
+
+class Timings:
+    '''
+    Time spent per stage while handling one request (or model call), see stage().
+    '''
+    __slots__ = ( 'start', 'stages' )
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str ):
+        if not ENABLED:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add( name, time.perf_counter() - start )
+
+    def add(self, name: str, seconds: float ):
+        self.stages[ name ] = self.stages.get( name, 0.0 ) + seconds
+
+    def observe(self, event: str, **fields ):
+        '''
+        Observes the stage timings in the histograms, and logs them with the fields if LOG_JSON is set.
+        '''
+        if not ENABLED:
+            return
+        for name, seconds in self.stages.items():
+            STAGE_SECONDS[ name ].observe( seconds )
+        total = time.perf_counter() - self.start
+        if event in REQUEST_SECONDS:
+            REQUEST_SECONDS[ event ].observe( total )
+        if LOG_JSON:
+            logger.info( json.dumps( dict( event=event, seconds=total, stages=self.stages, **fields ) ) )
+
+def observe_request_documents( n_documents: int ):
+    if ENABLED:
+        REQUEST_DOCUMENTS.observe( n_documents )
+
+def observe_documents( documents: List[str] ):
+    if ENABLED:
+        for document in documents:
+            DOCUMENT_CHARACTERS.observe( len( document ) )
+
+def observe_document_characters( n_characters: int ):
+    if ENABLED:
+        DOCUMENT_CHARACTERS.observe( n_characters )
+
+def staged_predict_proba( model, documents: List[str] ):
+    '''
+    predict_proba of a pipeline or compiled model, with the time spent in each of its stages observed.
+    '''
+    if not ENABLED:
+        return model.predict_proba( documents )
+
+    timings = Timings()
+    steps = getattr( model, 'steps', None )
+    if steps is not None:
+        #the steps of Pipeline.predict_proba, one by one
+        X = documents
+        for name, step in steps[:-1]:
+            with timings.stage( STEP_STAGES.get( name, 'vectorize' ) ):
+                X = step.transform( X )
+        with timings.stage( 'classify' ):
+            probabilities = steps[-1][1].predict_proba( X )
+    elif hasattr( model, 'predict_proba_transformed' ):
+        #compiled model: normalization, tf-idf and feature selection are done in one transform
+        with timings.stage( 'vectorize' ):
+            X = model.transform( documents )
+        with timings.stage( 'classify' ):
+            probabilities = model.predict_proba_transformed( X )
+    else:
+        with timings.stage( 'classify' ):
+            probabilities = model.predict_proba( documents )
+
+    BATCH_DOCUMENTS.observe( len( documents ) )
+    timings.observe( 'model_call', n_documents=len( documents ) )
+    return probabilities
+
+def staged_predict_proba_counts( model, documents_counts: List[Counter] ):
+    '''
+    predict_proba of a compiled model for documents given as token counts, with the time spent in each of its stages observed.
+    '''
+    if not ENABLED:
+        return model.predict_proba_transformed( model.transform_counts( documents_counts ) )
+
+    timings = Timings()
+    with timings.stage( 'vectorize' ):
+        X = model.transform_counts( documents_counts )
+    with timings.stage( 'classify' ):
+        probabilities = model.predict_proba_transformed( X )
+
+    BATCH_DOCUMENTS.observe( len( documents_counts ) )
+    timings.observe( 'model_call', n_documents=len( documents_counts ) )
+    return probabilities
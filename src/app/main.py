@@ -1,36 +1,288 @@
-import base64
-import pickle
+import asyncio
 import binascii
-from os.path import join
-from typing import Optional
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 
-import string
+import metrics
+from instrumentation import Timings, observe_document_characters, observe_documents, observe_request_documents, staged_predict_proba, staged_predict_proba_counts
+from batching import MicroBatcher
+from model_registry import ModelRegistry
+from prediction_cache import PredictionCache, cache_key
+from preprocessing import Normalizer, StreamDecoder, decode_and_normalize, decode_for, model_normalizer, normalize_for
 
-path_model = "/models/model.p"
+#model compiled with classifier/model_export.py (directory, memory-mapped and shared between workers) or pickled model
+path_model = os.environ.get( "MODEL_PATH", "/models/model" if os.path.isdir( "/models/model" ) else "/models/model.p" )
 
-model = pickle.load( open( path_model, "rb"))
+#maximum number of documents accepted by /classify_docs in one call
+MAX_BATCH_SIZE = int( os.environ.get( "MAX_BATCH_SIZE", 256 ) )
+
+#maximum size (bytes) of the body of a request, and of the base64 encoded documents in it; larger requests are refused with status 413
+MAX_REQUEST_BYTES = int( os.environ.get( "MAX_REQUEST_BYTES", 50 * 1024 * 1024 ) )
+
+#micro-batching of concurrent /classify_doc requests: wait at most BATCH_WINDOW_MS for at most BATCH_MAX_SIZE documents
+BATCH_WINDOW_MS = float( os.environ.get( "BATCH_WINDOW_MS", 5 ) )
+BATCH_MAX_SIZE = int( os.environ.get( "BATCH_MAX_SIZE", 32 ) )
+
+#number of threads running the model, so that inference does not block the event loop
+INFERENCE_THREADS = int( os.environ.get( "INFERENCE_THREADS", 1 ) )
+
+#cache of predicted probabilities: at most PREDICTION_CACHE_SIZE documents (0 disables the cache) for PREDICTION_CACHE_TTL seconds,
+#optionally shared between workers in the SQLite database PREDICTION_CACHE_SQLITE
+PREDICTION_CACHE_SIZE = int( os.environ.get( "PREDICTION_CACHE_SIZE", 10000 ) )
+PREDICTION_CACHE_TTL = float( os.environ.get( "PREDICTION_CACHE_TTL", 86400 ) )
+PREDICTION_CACHE_SQLITE = os.environ.get( "PREDICTION_CACHE_SQLITE", "" )
+
+#hot reload of the model: the model path is checked for a new model every MODEL_POLL_INTERVAL seconds (0 disables it),
+#a new model is validated on the documents of CANARY_PATH (file with at each line a base64 encoded document) before it is served,
+#and may label at most a fraction MAX_CANARY_DISAGREEMENT of them differently than the served model.
+#/admin/reload reloads the model immediately, it requires the header X-Admin-Token if ADMIN_TOKEN is set
+MODEL_POLL_INTERVAL = float( os.environ.get( "MODEL_POLL_INTERVAL", 30 ) )
+CANARY_PATH = os.environ.get( "CANARY_PATH", "" )
+MAX_CANARY_DISAGREEMENT = float( os.environ.get( "MAX_CANARY_DISAGREEMENT", 1.0 ) )
+ADMIN_TOKEN = os.environ.get( "ADMIN_TOKEN", "" )
+
+canary_documents = decode_and_normalize( open( CANARY_PATH ).read().split() ) if CANARY_PATH else None
+registry = ModelRegistry( path_model, canary_documents, max_canary_disagreement=MAX_CANARY_DISAGREEMENT )
+
+cache = PredictionCache( PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL, PREDICTION_CACHE_SQLITE ) if PREDICTION_CACHE_SIZE > 0 else None
 
 class Document(BaseModel):
     content: str
 
+class Documents(BaseModel):
+    contents: List[str]
+
 app = FastAPI()
 
+executor = ThreadPoolExecutor( max_workers=INFERENCE_THREADS )
+
+@app.middleware("http")
+async def limit_request_size( request: Request, call_next ):
+    '''
+    Refuses requests that announce a body larger than MAX_REQUEST_BYTES, before the body is read.
+    '''
+    content_length = request.headers.get( 'content-length' )
+    if content_length is not None and content_length.isdigit() and int( content_length ) > MAX_REQUEST_BYTES:
+        return JSONResponse( status_code=413, content={ 'detail': f"the request is too large, the maximum size is {MAX_REQUEST_BYTES} bytes." } )
+    return await call_next( request )
+
+def check_request_size( n_bytes: int ):
+    '''
+    Refuses requests with more than MAX_REQUEST_BYTES of documents (e.g. sent with chunked transfer encoding, without Content-Length).
+    '''
+    if n_bytes > MAX_REQUEST_BYTES:
+        raise HTTPException(status_code=413, detail=f"the documents are too large, the maximum size is {MAX_REQUEST_BYTES} bytes.")
+
+def predict_proba( items: List[ Tuple[ Tuple[ object, str ], str ] ] ):
+    '''
+    Returns for every ( ( model, version ), decoded document ) the ( probabilities, version of the model ).
+    The documents are predicted by the model they were decoded for, also if a new model was swapped in meanwhile.
+    '''
+    predictions = [ None ] * len( items )
+    groups = {}
+    for i, ( current, _ ) in enumerate( items ):
+        groups.setdefault( current[1], ( current, [] ) )[1].append( i )
+    for current, indices in groups.values():
+        for i, prediction in zip( indices, registry.predict_proba( [ items[i][1] for i in indices ], current ) ):
+            predictions[i] = prediction
+    return predictions
+
+batcher = MicroBatcher( predict_proba, executor, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_WINDOW_MS )
+
+@app.on_event("startup")
+async def startup():
+    batcher.start()
+    registry.start( MODEL_POLL_INTERVAL )
+
+@app.on_event("shutdown")
+async def shutdown():
+    await batcher.stop()
+    await registry.stop()
+    executor.shutdown( wait=False )
+
+def decode_document( content: str, model, timings: Timings ) -> str:
+    '''
+    Decodes a base64 encoded document and removes punctuation and numbers (as done at training time), unless the model does so itself.
+    Only the part of the document that the length policy of the model keeps is decoded.
+    Raises binascii.Error or UnicodeDecodeError if the content can not be decoded.
+    '''
+    with timings.stage( 'decode' ):
+        decoded_content = [ decode_for( model, content ) ]
+    observe_documents( decoded_content )
+    with timings.stage( 'normalize' ):
+        return normalize_for( model, decoded_content )[0]
+
+def decode_documents( contents: List[str], model, timings: Timings ) -> List[ Optional[str] ]:
+    '''
+    Decodes and normalizes (see decode_document) a list of base64 encoded documents, None for the documents that can not be decoded.
+    '''
+    decoded_contents = []
+    for content in contents:
+        try:
+            decoded_contents.append( decode_document( content, model, timings ) )
+        except ( binascii.Error, UnicodeDecodeError ):
+            decoded_contents.append( None )
+    return decoded_contents
+
+def cached_probabilities( decoded_content: str, version: str ):
+    '''
+    Returns the cached ( probabilities, version of the model ) of a decoded document, or None if they are not cached.
+    '''
+    if cache is None:
+        return None
+    probabilities = cache.get( cache_key( decoded_content, version ) )
+    return ( probabilities, version ) if probabilities is not None else None
+
+def cache_probabilities( decoded_content: str, prediction ):
+    if cache is not None:
+        probabilities, version = prediction
+        cache.put( cache_key( decoded_content, version ), probabilities )
+
+def to_output_json( prediction ) -> dict:
+    probabilities, version = prediction
+    output_json = {}
+    output_json['rejected_probability']=float( probabilities[0] )
+    output_json['accepted_probability']=float( probabilities[1] )
+    output_json['model_version']=version
+    return output_json
+
 @app.post("/classify_doc")
 async def classify(document: Document):
+    check_request_size( len( document.content ) )
+    timings = Timings()
+    #the same model for the whole request, also if a new model is swapped in meanwhile
+    current = registry.current
     try:
-        decoded_content =  base64.b64decode(document.content).decode( 'utf-8' )
-        #remove punctuation and numbers before doing predictions
-        decoded_content=decoded_content.translate(str.maketrans('', '', string.punctuation+'0123456789'  ))
-                
-    except binascii.Error:
+        #decoded in the executor, so that a large document does not block the event loop (and the micro-batches gathered on it)
+        decoded_content = await asyncio.get_event_loop().run_in_executor( executor, decode_document, document.content, current[0], timings )
+    except ( binascii.Error, UnicodeDecodeError ):
         raise HTTPException(status_code=400, detail="could not decode the 'content' field. Make sure it is in valid base64 encoding.")
-    probabilities=list( model.predict_proba( [ decoded_content])[0])
+    with timings.stage( 'cache' ):
+        prediction = cached_probabilities( decoded_content, current[1] )
+    cached = prediction is not None
+    if not cached:
+        prediction=await batcher.submit( ( current, decoded_content ) )
+        cache_probabilities( decoded_content, prediction )
 
-    output_json = {}
-    output_json['rejected_probability']=probabilities[0]
-    output_json['accepted_probability']=probabilities[1]
-    
-    return output_json
+    timings.observe( '/classify_doc', n_documents=1, characters=len( decoded_content ), cached=cached )
+    return to_output_json( prediction )
+
+@app.post("/classify_docs")
+async def classify_batch(documents: Documents):
+    '''
+    Classifies a list of base64 encoded documents with a single call to the model.
+    The output is a list (in the order of the input) with for each document either the probabilities,
+    or an 'error' field if the document could not be decoded.
+    '''
+    if len( documents.contents ) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"too many documents in one request, the maximum batch size is {MAX_BATCH_SIZE}." )
+    check_request_size( sum( len( content ) for content in documents.contents ) )
+
+    timings = Timings()
+    #the same model for the whole request, also if a new model is swapped in meanwhile
+    current = registry.current
+    observe_request_documents( len( documents.contents ) )
+    decoded_contents = []
+    output = []
+    #decoded in the executor, so that large documents do not block the event loop
+    for decoded_content in await asyncio.get_event_loop().run_in_executor( executor, decode_documents, documents.contents, current[0], timings ):
+        if decoded_content is None:
+            output.append( { 'error': "could not decode the 'content' field. Make sure it is in valid base64 encoding." } )
+            continue
+        with timings.stage( 'cache' ):
+            prediction = cached_probabilities( decoded_content, current[1] )
+        if prediction is not None:
+            output.append( to_output_json( prediction ) )
+        else:
+            decoded_contents.append( decoded_content )
+            output.append( None )
+
+    if decoded_contents:
+        #vectorize all valid documents that are not cached as one sparse matrix
+        predictions = await asyncio.get_event_loop().run_in_executor( executor, registry.predict_proba, decoded_contents, current )
+        for decoded_content, prediction in zip( decoded_contents, predictions ):
+            cache_probabilities( decoded_content, prediction )
+        predictions = iter( predictions )
+        output = [ item if item is not None else to_output_json( next( predictions ) ) for item in output ]
+
+    timings.observe( '/classify_docs', n_documents=len( documents.contents ), predicted=len( decoded_contents ) )
+    return output
+
+def predict_proba_stream( model, document ):
+    '''
+    Probabilities of one streamed document: token counts (compiled models) or normalized text (other models).
+    '''
+    if isinstance( document, str ):
+        return staged_predict_proba( model, [ document ] )[0]
+    return staged_predict_proba_counts( model, [ document ] )[0]
+
+@app.post("/classify_doc_stream")
+async def classify_stream(request: Request):
+    '''
+    Classifies one document sent as the raw body of the request (utf-8 text, gzip compressed if the header
+    Content-Encoding is gzip). The body is decoded, normalized and tokenized while it is received, so only about one
+    chunk of it is in memory; the length policy of the model is applied, and the rest of the body is not read.
+    Streamed documents are not cached.
+    '''
+    timings = Timings()
+    #the same model for the whole request, also if a new model is swapped in meanwhile
+    model, version = registry.current
+    #models saved without normalization step get their documents normalized as normalize_for does
+    normalizer = model_normalizer( model ) or Normalizer()
+    decoder = StreamDecoder( normalizer.remove_punctuation_numbers, normalizer.max_length, normalizer.length_policy,
+                             gzip=request.headers.get( 'content-encoding', '' ).lower() == 'gzip' )
+    #compiled models take the token counts, other models the normalized text
+    counter = model.token_counter() if hasattr( model, 'token_counter' ) else None
+    pieces = []
+
+    def add( piece: str ):
+        check_request_size( decoder.n_bytes )
+        if counter is not None:
+            counter.feed( piece )
+        else:
+            pieces.append( piece )
+
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len( chunk )
+            check_request_size( received )
+            with timings.stage( 'decode' ):
+                for piece in decoder.feed( chunk ):
+                    add( piece )
+            if decoder.done:
+                break
+        with timings.stage( 'decode' ):
+            add( decoder.close() )
+    except ( zlib.error, UnicodeDecodeError ):
+        raise HTTPException(status_code=400, detail="could not decode the body. Make sure it is utf-8 encoded text, gzip compressed if the header Content-Encoding is gzip.")
+    observe_document_characters( decoder.n_characters )
+
+    document = counter.close() if counter is not None else ''.join( pieces )
+    probabilities = await asyncio.get_event_loop().run_in_executor( executor, predict_proba_stream, model, document )
+
+    timings.observe( '/classify_doc_stream', n_documents=1, characters=decoder.n_characters, bytes=received )
+    return to_output_json( ( probabilities, version ) )
+
+@app.post("/admin/reload")
+async def reload_model( x_admin_token: Optional[str] = Header( None ) ):
+    '''
+    Loads, validates and swaps in the model at the model path, also if it did not change.
+    '''
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="invalid admin token.")
+    try:
+        await asyncio.get_event_loop().run_in_executor( None, registry.reload, True )
+    except Exception as e:
+        raise HTTPException(status_code=409, detail=f"the new model was not loaded, the served model is unchanged: {e!r}")
+    return { 'model_version': registry.current[1] }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return metrics.render()
@@ -0,0 +1,92 @@
+'''
+Minimal metrics registry for the classifier API, rendered in the Prometheus text format on /metrics.
+'''
+import bisect
+import threading
+from typing import Dict, Iterable, Optional
+
+_REGISTRY = []
+
+class Counter:
+    '''Monotonically increasing value.'''
+    type_ = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        self._lock = threading.Lock()
+        _REGISTRY.append( self )
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name, self.value
+
+class Gauge(Counter):
+    '''Value that can go up and down.'''
+    type_ = 'gauge'
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def dec(self, amount=1):
+        self.inc( -amount )
+
+class Histogram:
+    '''
+    Distribution of observed values over cumulative buckets (upper bounds). Histograms with the same name and different
+    labels (e.g. one per stage) are rendered as one metric.
+    '''
+    type_ = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float], labels: Optional[ Dict[ str, str ] ]=None ):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = sorted( buckets )
+        self._labels = "".join( f'{key}="{value}",' for key, value in ( labels or {} ).items() )
+        self._counts = [ 0 ] * ( len( self.buckets ) + 1 )
+        self._sum = 0.0
+        self._lock = threading.Lock()
+        _REGISTRY.append( self )
+
+    def observe(self, value: float ):
+        #first bucket with an upper bound >= value
+        index = bisect.bisect_left( self.buckets, value )
+        with self._lock:
+            self._counts[ index ] += 1
+            self._sum += value
+
+    def samples(self):
+        with self._lock:
+            counts = list( self._counts )
+            total = self._sum
+        cumulative = 0
+        for bound, count in zip( self.buckets, counts ):
+            cumulative += count
+            yield f'{self.name}_bucket{{{self._labels}le="{bound}"}}', cumulative
+        cumulative += counts[-1]
+        yield f'{self.name}_bucket{{{self._labels}le="+Inf"}}', cumulative
+        labels = f"{{{self._labels.rstrip( ',' )}}}" if self._labels else ""
+        yield f'{self.name}_sum{labels}', total
+        yield f'{self.name}_count{labels}', cumulative
+
+def render() -> str:
+    '''
+    Returns all registered metrics in the Prometheus text exposition format.
+    '''
+    lines = []
+    #metrics with the same name are rendered together, in the order of their first registration
+    families = {}
+    for metric in _REGISTRY:
+        families.setdefault( metric.name, [] ).append( metric )
+    for name, family in families.items():
+        lines.append( f"# HELP {name} {family[0].documentation}" )
+        lines.append( f"# TYPE {name} {family[0].type_}" )
+        for metric in family:
+            for sample, value in metric.samples():
+                lines.append( f"{sample} {value}" )
+    return "\n".join( lines ) + "\n"
@@ -0,0 +1,163 @@
+'''
+Registry of the served model, so that a retrained model can be deployed without restarting the service.
+
+The registry watches the model path (pickled model or directory of a compiled model). When it changes, or when a
+reload is requested on /admin/reload, the new model is loaded in the background, warmed up and validated on a set of
+canary documents, and only then swapped in. Requests that already got the old model finish with it.
+'''
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from instrumentation import MODEL_LOAD_SECONDS, staged_predict_proba
+from metrics import Counter, Gauge
+from model_export import load_model, model_version
+
+logger = logging.getLogger( "classifier.model_registry" )
+
+RELOADS = Counter( "classifier_model_reloads_total", "Number of times a new model was swapped in." )
+RELOAD_FAILURES = Counter( "classifier_model_reload_failures_total", "Number of new models that could not be loaded or failed the canary validation." )
+LOADED_AT = Gauge( "classifier_model_loaded_timestamp_seconds", "Unix time at which the served model was loaded." )
+
+#canary documents used if no canary file is given
+DEFAULT_CANARY_DOCUMENTS = [
+    "",
+    "Commission Delegated Regulation supplementing Regulation on prudential requirements for credit institutions and investment firms",
+    "Council Decision on the conclusion of the Agreement on fisheries between the European Union and the Republic",
+]
+
+class ModelValidationError( Exception ):
+    pass
+
+def _signature( path: str ):
+    '''
+    Modification times and sizes of the model file or of the files of a compiled model, to detect changes cheaply.
+    '''
+    if os.path.isdir( path ):
+        files = [ os.path.join( path, name ) for name in sorted( os.listdir( path ) ) ]
+    else:
+        files = [ path ]
+    return tuple( ( file, os.stat( file ).st_mtime_ns, os.stat( file ).st_size ) for file in files )
+
+class ModelRegistry:
+    '''
+    Holds the served model and its version, see the module docstring.
+
+    :param path: path to the model (pickled model or directory of a compiled model)
+    :type path: str
+    :param canary_documents: (normalized) documents on which a new model is warmed up and validated
+    :type canary_documents: List[str]
+    :param max_canary_disagreement: maximum fraction of canary documents that the new model may label differently than the served model
+    :type max_canary_disagreement: float
+    '''
+    def __init__(self, path: str, canary_documents: Optional[ List[str] ]=None, max_canary_disagreement: float=1.0 ):
+        self.path = path
+        self.canary_documents = canary_documents if canary_documents else DEFAULT_CANARY_DOCUMENTS
+        self.max_canary_disagreement = max_canary_disagreement
+        self._reload_lock = threading.Lock()
+        self._failed_signature = None
+        self._task = None
+
+        signature = _signature( path )
+        start = time.perf_counter()
+        model = load_model( path )
+        self._validate( model, None )
+        MODEL_LOAD_SECONDS.set( time.perf_counter() - start )
+        #model and version are swapped together, as one tuple
+        self._current = ( model, model_version( path ) )
+        self._signature = signature
+        LOADED_AT.set( time.time() )
+
+    @property
+    def current(self) -> Tuple[ object, str ]:
+        '''
+        The served ( model, version ). Callers should use the same tuple for the whole request.
+        '''
+        return self._current
+
+    def predict_proba(self, documents: List[str], current: Optional[ Tuple[ object, str ] ]=None ) -> List[ Tuple[ np.ndarray, str ] ]:
+        '''
+        Probabilities of every document, each with the version of the model that predicted them.
+        current is the ( model, version ) the documents were decoded for (default: the served model).
+        '''
+        model, version = current if current is not None else self._current
+        return [ ( probabilities, version ) for probabilities in staged_predict_proba( model, documents ) ]
+
+    def _validate(self, model, served_model ):
+        '''
+        Warms up the model on the canary documents and checks its probabilities (and their agreement with the served model).
+        '''
+        probabilities = np.asarray( model.predict_proba( self.canary_documents ) )
+        if probabilities.shape != ( len( self.canary_documents ), 2 ):
+            raise ModelValidationError( f"the model predicts probabilities of shape {probabilities.shape}, expected ( {len( self.canary_documents )}, 2 )" )
+        if not np.all( np.isfinite( probabilities ) ) or np.any( probabilities < 0 ) or np.any( probabilities > 1 ) \
+                or not np.allclose( probabilities.sum( axis=1 ), 1.0 ):
+            raise ModelValidationError( "the model does not predict valid probabilities" )
+        if served_model is not None:
+            served_probabilities = np.asarray( served_model.predict_proba( self.canary_documents ) )
+            disagreement = np.mean( probabilities.argmax( axis=1 ) != served_probabilities.argmax( axis=1 ) )
+            if disagreement > self.max_canary_disagreement:
+                raise ModelValidationError( f"the model labels {disagreement:.0%} of the canary documents differently than the served model" )
+
+    def reload(self, force: bool=False ) -> bool:
+        '''
+        Loads, validates and swaps in the model at path if it changed (or always if force). Returns whether the model was swapped.
+        Raises an exception (and keeps serving the old model) if the new model can not be loaded or is not valid.
+        '''
+        with self._reload_lock:
+            signature = _signature( self.path )
+            if not force and ( signature == self._signature or signature == self._failed_signature ):
+                return False
+            try:
+                version = model_version( self.path )
+                if not force and version == self._current[1]:
+                    self._signature = signature
+                    return False
+                start = time.perf_counter()
+                model = load_model( self.path )
+                self._validate( model, self._current[0] )
+                load_seconds = time.perf_counter() - start
+            except Exception:
+                RELOAD_FAILURES.inc()
+                #do not try the same files again, until they change
+                self._failed_signature = signature
+                raise
+            self._current = ( model, version )
+            self._signature = signature
+            self._failed_signature = None
+            RELOADS.inc()
+            LOADED_AT.set( time.time() )
+            MODEL_LOAD_SECONDS.set( load_seconds )
+            return True
+
+    def start(self, poll_interval: float ):
+        '''
+        Checks the model path for changes every poll_interval seconds (0 disables the watching).
+        '''
+        if poll_interval > 0:
+            self._task = asyncio.ensure_future( self._watch( poll_interval ) )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self, poll_interval: float ):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep( poll_interval )
+            try:
+                #load in the default executor, so that neither the event loop nor the inference threads are blocked
+                if await loop.run_in_executor( None, self.reload ):
+                    logger.info( "model %s reloaded, version %s", self.path, self._current[1] )
+            except Exception:
+                logger.exception( "could not reload model %s", self.path )
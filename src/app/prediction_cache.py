@@ -0,0 +1,83 @@
+'''
+Cache of predicted probabilities, keyed on a hash of the (decoded) document and the version of the model, so that
+documents that are submitted again (re-crawls, consolidated versions) are not vectorized and classified again.
+
+Entries are kept in an in-process LRU cache with a maximum size and a time to live. Optionally, they are also stored in
+a SQLite database, which is shared by all (uvicorn) worker processes that use the same database file.
+'''
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from metrics import Counter, Gauge
+
+HITS = Counter( "classifier_cache_hits_total", "Number of documents whose probabilities were found in the prediction cache." )
+MISSES = Counter( "classifier_cache_misses_total", "Number of documents whose probabilities were not in the prediction cache." )
+SIZE = Gauge( "classifier_cache_size", "Number of documents in the in-process prediction cache." )
+
+#number of writes to SQLite after which expired entries are deleted
+SQLITE_PURGE_INTERVAL = 1000
+
+def cache_key( document: str, model_version: str ) -> str:
+    return hashlib.sha256( model_version.encode( 'utf-8' ) + b'\0' + document.encode( 'utf-8' ) ).hexdigest()
+
+class PredictionCache:
+    '''
+    LRU cache of ( rejected, accepted ) probabilities with at most max_size entries that expire after ttl seconds,
+    optionally backed by a SQLite database (sqlite_path).
+    '''
+    def __init__(self, max_size: int=10000, ttl: float=86400.0, sqlite_path: Optional[str]=None ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+        if sqlite_path:
+            self._db = sqlite3.connect( sqlite_path, check_same_thread=False, isolation_level=None )
+            #write ahead logging, so that readers of other processes are not blocked by a writer
+            self._db.execute( "PRAGMA journal_mode=WAL" )
+            self._db.execute( "CREATE TABLE IF NOT EXISTS predictions ( key TEXT PRIMARY KEY, rejected REAL, accepted REAL, expires REAL )" )
+
+    def get(self, key: str ) -> Optional[ Tuple[ float, float ] ]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get( key )
+            if entry is not None:
+                probabilities, expires = entry
+                if expires > now:
+                    self._entries.move_to_end( key )
+                    HITS.inc()
+                    return probabilities
+                del self._entries[ key ]
+                SIZE.set( len( self._entries ) )
+
+            if self._db is not None:
+                row = self._db.execute( "SELECT rejected, accepted, expires FROM predictions WHERE key = ?", ( key, ) ).fetchone()
+                if row is not None and row[2] > now:
+                    self._store( key, ( row[0], row[1] ), row[2] )
+                    HITS.inc()
+                    return row[0], row[1]
+        MISSES.inc()
+        return None
+
+    def put(self, key: str, probabilities ):
+        probabilities = ( float( probabilities[0] ), float( probabilities[1] ) )
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._store( key, probabilities, expires )
+            if self._db is not None:
+                self._db.execute( "INSERT OR REPLACE INTO predictions VALUES ( ?, ?, ?, ? )", ( key, ) + probabilities + ( expires, ) )
+                self._writes += 1
+                if self._writes % SQLITE_PURGE_INTERVAL == 0:
+                    self._db.execute( "DELETE FROM predictions WHERE expires <= ?", ( time.time(), ) )
+
+    def _store(self, key: str, probabilities: Tuple[ float, float ], expires: float ):
+        self._entries[ key ] = ( probabilities, expires )
+        self._entries.move_to_end( key )
+        while len( self._entries ) > self.max_size:
+            self._entries.popitem( last=False )
+        SIZE.set( len( self._entries ) )
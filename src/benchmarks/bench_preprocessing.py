@@ -0,0 +1,56 @@
+'''
+Benchmark of the decoding and normalization of the documents: documents/sec of the shared preprocessing module
+(classifier/preprocessing.py) versus the original per document b64decode + str.maketrans + str.translate, on
+synthetic base64 encoded documents.
+'''
+import argparse
+import json
+import os
+import random
+import string
+import sys
+from base64 import b64decode, b64encode
+
+sys.path.append( os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'classifier' ) )
+from preprocessing import decode, decode_and_normalize, normalize
+
+from synthetic import WORDS, docs_per_second
+
+#tokens with punctuation, numbers and non ascii characters, as found in eurlex documents
+EXTRA_TOKENS = [ 'Article 3(1),', '2020/1234', '(EU)', 'No 575/2013;', '€ 1.000.000', 'règlement', 'Öffentlichkeit', '«see»', '—', 'p. 12.' ]
+
+def synthetic_documents( n_documents: int, seed: int=0, words: int=1000 ):
+    rng = random.Random( seed )
+    vocabulary = WORDS + EXTRA_TOKENS
+    return [ b64encode( ' '.join( rng.choice( vocabulary ) for _ in range( rng.randint( words // 10, words ) ) ).encode( 'utf-8' ) ).decode()
+             for _ in range( n_documents ) ]
+
+def reference_decode_and_normalize( encoded_documents ):
+    '''
+    Original preprocessing of train.py, test.py, predict.py and app/main.py.
+    '''
+    return [ b64decode( doc ).decode().translate( str.maketrans( '', '', string.punctuation + '0123456789' ) ) for doc in encoded_documents ]
+
+def bench_preprocessing( n_documents: int=10000, repeats: int=3, seed: int=0 ) -> dict:
+    documents = synthetic_documents( n_documents, seed=seed )
+    assert reference_decode_and_normalize( documents ) == decode_and_normalize( documents ), "the preprocessing module does not reproduce the original preprocessing"
+
+    decoded = decode( documents )
+    reference = docs_per_second( reference_decode_and_normalize, documents, repeats )
+    batched = docs_per_second( decode_and_normalize, documents, repeats )
+    return {
+        'n_documents': n_documents,
+        'reference_docs_per_sec': reference,
+        'preprocessing_docs_per_sec': batched,
+        'decode_docs_per_sec': docs_per_second( decode, documents, repeats ),
+        'normalize_docs_per_sec': docs_per_second( normalize, decoded, repeats ),
+        'speedup': batched / reference,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_documents", dest="n_documents", type=int, default=10000, help="number of synthetic documents")
+    parser.add_argument("--repeats", dest="repeats", type=int, default=3, help="number of timed runs (the fastest run is reported)")
+    args = parser.parse_args()
+
+    print( json.dumps( bench_preprocessing( args.n_documents, args.repeats ), indent=2 ) )
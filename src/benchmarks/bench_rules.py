@@ -0,0 +1,72 @@
+'''
+Benchmark of the business rules: documents/sec of the compiled rule engine (rule_engine.py) versus the original
+implementation of classify(), on a synthetic export.
+'''
+import argparse
+import json
+import os
+import sys
+
+sys.path.append( os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'businessrules' ) )
+import conf
+from business_rules import EurlexDocument
+from rule_engine import RuleEngine
+
+from synthetic import docs_per_second, synthetic_records
+
+ACCEPTED_EUROVOC_NUMBERS=set( [conf.accepted_eurovoc_terms_descriptors[ key ] for key in conf.accepted_eurovoc_terms_descriptors] )
+REJECTED_EUROVOC_NUMBERS=set( [conf.rejected_eurovoc_terms_descriptors[ key ] for key in conf.rejected_eurovoc_terms_descriptors] )
+
+def reference_classify( eurlex_doc ):
+    '''
+    Original implementation of business_rules.classify(), returns the acceptance state.
+    '''
+    if set( eurlex_doc.misc_author ).intersection( set( conf.accepted_authors ) ):
+        return 'accepted'
+    if set( eurlex_doc.misc_department_responsable ).intersection( set( conf.accepted_dep_responsible ) ):
+        return 'accepted'
+    if 'summary codes' in eurlex_doc.classifications:
+        if set( conf.accepted_summary_codes ).intersection( set( eurlex_doc.classifications['summary codes'] ) ):
+            return 'accepted'
+    if 'directory code' in eurlex_doc.classifications:
+        if set( conf.accepted_directory_codes ).intersection( set( eurlex_doc.classifications['directory code'] )  ):
+            return 'accepted'
+    if 'directory code' in eurlex_doc.classifications:
+        if set( conf.rejected_directory_codes ).intersection( set( eurlex_doc.classifications['directory code'] )  ):
+            return 'rejected'
+    if 'directory code' in eurlex_doc.classifications:
+        if set( conf.accepted_directory_codes_under_eurovoc_condition ).intersection( set( eurlex_doc.classifications['directory code'] )  ):
+            if 'eurovoc descriptor' in eurlex_doc.classifications:
+                if len( list( ACCEPTED_EUROVOC_NUMBERS.intersection( set( eurlex_doc.classifications[ 'eurovoc descriptor' ] )))) >= 2:
+                    if not REJECTED_EUROVOC_NUMBERS.intersection( set( eurlex_doc.classifications[ 'eurovoc descriptor' ] )):
+                        return 'accepted'
+    if 'eurovoc descriptor' in eurlex_doc.classifications:
+        if REJECTED_EUROVOC_NUMBERS.intersection( set( eurlex_doc.classifications[ 'eurovoc descriptor' ] )):
+            return 'rejected'
+    if 'eurovoc descriptor' in eurlex_doc.classifications:
+        if len( list( ACCEPTED_EUROVOC_NUMBERS.intersection( set( eurlex_doc.classifications[ 'eurovoc descriptor' ] )))) >= 2:
+            if not REJECTED_EUROVOC_NUMBERS.intersection( set( eurlex_doc.classifications[ 'eurovoc descriptor' ] )):
+                return 'accepted'
+    return None
+
+def bench_rules( n_documents: int=100000, repeats: int=3, seed: int=0 ) -> dict:
+    documents = [ EurlexDocument( record ) for record in synthetic_records( n_documents, seed=seed, content_words=10 ) ]
+
+    #that the rule engine reproduces reference_classify is tested in tests/test_business_rules.py
+    engine = RuleEngine( conf )
+    reference = docs_per_second( lambda docs: [ reference_classify( doc ) for doc in docs ], documents, repeats )
+    compiled = docs_per_second( engine.label_batch, documents, repeats )
+    return {
+        'n_documents': n_documents,
+        'reference_docs_per_sec': reference,
+        'rule_engine_docs_per_sec': compiled,
+        'speedup': compiled / reference,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_documents", dest="n_documents", type=int, default=100000, help="number of synthetic documents")
+    parser.add_argument("--repeats", dest="repeats", type=int, default=3, help="number of timed runs (the fastest run is reported)")
+    args = parser.parse_args()
+
+    print( json.dumps( bench_rules( args.n_documents, args.repeats ), indent=2 ) )
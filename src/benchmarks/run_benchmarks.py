@@ -0,0 +1,246 @@
+'''
+Benchmark suite of the bootstrap, training and inference, on synthetic data of configurable size:
+
+- bootstrap: documents/sec and peak memory of business_rules.bootstrap on a synthetic solr export,
+- train: fit time per grid point (from cross_validation_scores.json) and peak memory of train.py on a synthetic corpus,
+- predict: documents/sec of the batch prediction of predict.py / test.py (batch_predict.py) with the trained model,
+- api: latency (p50/p99) of single and concurrent /classify_doc requests, and of /classify_docs requests, against a local uvicorn instance.
+
+Every benchmark runs in a separate process, so that its peak memory is measured on its own. The results are written
+as json, together with the git commit and the versions of python and the libraries, to compare them across commits.
+'''
+import argparse
+import configparser
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname( os.path.abspath( __file__ ) )
+SRC_DIR = os.path.join( BENCHMARKS_DIR, '..' )
+CLASSIFIER_DIR = os.path.join( SRC_DIR, 'classifier' )
+APP_DIR = os.path.join( SRC_DIR, 'app' )
+
+sys.path.append( os.path.join( SRC_DIR, 'businessrules' ) )
+sys.path.append( CLASSIFIER_DIR )
+
+from synthetic import synthetic_records, write_corpus, write_export
+
+BENCHMARKS = [ 'bootstrap', 'train', 'predict', 'api' ]
+
+def peak_memory_mb() -> float:
+    '''
+    Peak resident memory (MB) of this process and of its (finished) child processes.
+    '''
+    usage = max( resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss, resource.getrusage( resource.RUSAGE_CHILDREN ).ru_maxrss )
+    #kilobytes on linux, bytes on macos
+    return usage / ( 1024 * 1024 if sys.platform == 'darwin' else 1024 )
+
+def _run_child( connection, function, args ):
+    result = function( *args )
+    result[ 'peak_memory_mb' ] = peak_memory_mb()
+    connection.send( result )
+    connection.close()
+
+def in_process( function, *args ) -> dict:
+    '''
+    Runs function( *args ) (returning a dict) in a new process, and adds the peak memory of that process to the result.
+    '''
+    context = multiprocessing.get_context( 'spawn' )
+    receiver, sender = context.Pipe( duplex=False )
+    process = context.Process( target=_run_child, args=( sender, function, args ) )
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+def percentiles( latencies ) -> dict:
+    latencies = np.array( latencies ) * 1000
+    return { 'p50_ms': float( np.percentile( latencies, 50 ) ), 'p99_ms': float( np.percentile( latencies, 99 ) ), 'mean_ms': float( latencies.mean() ) }
+
+def bench_bootstrap( work_dir: str, n_files: int, records_per_file: int, workers: int ) -> dict:
+    from business_rules import bootstrap
+
+    export_dir = os.path.join( work_dir, 'export' )
+    output_dir = os.path.join( work_dir, 'bootstrap' )
+    write_export( export_dir, n_files, records_per_file )
+    start = time.perf_counter()
+    bootstrap( export_dir, output_dir, workers=workers )
+    seconds = time.perf_counter() - start
+    with open( os.path.join( output_dir, 'train_data.tsv' ) ) as fp:
+        n_labeled = sum( 1 for _ in fp )
+    return {
+        'n_records': n_files * records_per_file,
+        'n_labeled': n_labeled,
+        'seconds': seconds,
+        'docs_per_sec': n_files * records_per_file / seconds,
+    }
+
+def bench_train( corpus: str, model_dir: str, config_overrides: dict ) -> dict:
+    os.chdir( CLASSIFIER_DIR )
+    from train import train
+
+    config = configparser.ConfigParser()
+    config.read( os.path.join( CLASSIFIER_DIR, 'train.config' ) )
+    config[ 'INPUT/OUTPUT' ][ 'INPUT_FILE' ] = corpus
+    config[ 'INPUT/OUTPUT' ][ 'OUTPUT_DIR' ] = model_dir
+    config[ 'INPUT/OUTPUT' ][ 'CACHE_DIR' ] = ''
+    for section, options in config_overrides.items():
+        if not config.has_section( section ):
+            config.add_section( section )
+        config[ section ].update( options )
+
+    start = time.perf_counter()
+    train( config )
+    seconds = time.perf_counter() - start
+    result = { 'seconds': seconds }
+    scores_path = os.path.join( model_dir, 'cross_validation_scores.json' )
+    if os.path.isfile( scores_path ):
+        with open( scores_path ) as fp:
+            scores = json.load( fp )
+        result[ 'mean_test_f1' ] = scores[ 'mean_test_f1' ]
+        result[ 'grid_points' ] = [ { 'params': { key: str( value ) for key, value in candidate[ 'params' ].items() },
+                                      'mean_fit_time': candidate[ 'mean_fit_time' ] } for candidate in scores[ 'candidates' ] ]
+    return result
+
+def bench_predict( corpus: str, model_path: str, workers: int, chunk_size: int ) -> dict:
+    from batch_predict import predict_chunks
+    from training_data import iter_training_data
+
+    start = time.perf_counter()
+    n_documents = 0
+    for labels, _ in predict_chunks( ( chunk[ 'text' ].tolist() for chunk in iter_training_data( corpus, chunk_size=chunk_size ) ), model_path, workers=workers ):
+        n_documents += len( labels )
+    seconds = time.perf_counter() - start
+    return { 'workers': workers, 'n_documents': n_documents, 'seconds': seconds, 'docs_per_sec': n_documents / seconds }
+
+def _post( url: str, payload: dict ) -> float:
+    request = urllib.request.Request( url, data=json.dumps( payload ).encode( 'utf-8' ), headers={ 'Content-Type': 'application/json' } )
+    start = time.perf_counter()
+    with urllib.request.urlopen( request ) as response:
+        response.read()
+    return time.perf_counter() - start
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind( ( '127.0.0.1', 0 ) )
+        return sock.getsockname()[1]
+
+def bench_api( model_path: str, n_requests: int, concurrency: int, batch_size: int ) -> dict:
+    port = _free_port()
+    env = dict( os.environ, MODEL_PATH=model_path, PYTHONPATH=CLASSIFIER_DIR, PREDICTION_CACHE_SIZE='0', MODEL_POLL_INTERVAL='0' )
+    server = subprocess.Popen( [ sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str( port ) ],
+                               cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range( 600 ):
+            try:
+                urllib.request.urlopen( base_url + '/metrics' ).read()
+                break
+            except OSError:
+                if server.poll() is not None:
+                    raise RuntimeError( "uvicorn exited before it was ready" )
+                time.sleep( 0.1 )
+        else:
+            raise RuntimeError( "uvicorn did not start" )
+
+        #distinct documents, as the prediction cache is disabled anyway
+        documents = [ b64encode( record[ 'content' ][0].encode( 'utf-8' ) ).decode() for record in synthetic_records( n_requests, seed=1, content_words=500 ) ]
+        for document in documents[ :10 ]:
+            _post( base_url + '/classify_doc', { 'content': document } )
+
+        single = [ _post( base_url + '/classify_doc', { 'content': document } ) for document in documents ]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor( max_workers=concurrency ) as executor:
+            concurrent = list( executor.map( lambda document: _post( base_url + '/classify_doc', { 'content': document } ), documents ) )
+        concurrent_seconds = time.perf_counter() - start
+
+        batches = [ documents[ i:i + batch_size ] for i in range( 0, len( documents ), batch_size ) ]
+        batched = [ _post( base_url + '/classify_docs', { 'contents': batch } ) for batch in batches ]
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'n_requests': n_requests,
+        'single': percentiles( single ),
+        'concurrent': dict( percentiles( concurrent ), concurrency=concurrency, requests_per_sec=n_requests / concurrent_seconds ),
+        'batch': dict( percentiles( batched ), batch_size=batch_size, docs_per_sec=n_requests / sum( batched ) ),
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output( [ 'git', 'rev-parse', 'HEAD' ], cwd=BENCHMARKS_DIR, stderr=subprocess.DEVNULL ).decode().strip()
+    except ( OSError, subprocess.CalledProcessError ):
+        return None
+
+def versions() -> dict:
+    import scipy
+    import sklearn
+    return { 'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__, 'scikit-learn': sklearn.__version__ }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output_file", dest="output_file", default="benchmark_results.json",
+                        help="json file the results are written to")
+    parser.add_argument("--work_dir", dest="work_dir", default=None,
+                        help="directory for the synthetic data and the trained model (default: a temporary directory)")
+    parser.add_argument("--benchmarks", dest="benchmarks", default=",".join( BENCHMARKS ),
+                        help=f"comma separated benchmarks to run, of {','.join( BENCHMARKS )} (predict and api use the model trained by train)")
+    parser.add_argument("--n_files", dest="n_files", type=int, default=4, help="number of files of the synthetic solr export")
+    parser.add_argument("--records_per_file", dest="records_per_file", type=int, default=2500, help="number of records per file of the synthetic solr export")
+    parser.add_argument("--n_documents", dest="n_documents", type=int, default=5000, help="number of documents of the synthetic training corpus")
+    parser.add_argument("--workers", dest="workers", type=int, default=None, help="number of worker processes of bootstrap and batch prediction (default: number of cpu's)")
+    parser.add_argument("--chunk_size", dest="chunk_size", type=int, default=1000, help="number of documents per chunk of the batch prediction")
+    parser.add_argument("--search_method", dest="search_method", default="grid", help="search method of train.py (grid or halving)")
+    parser.add_argument("--n_requests", dest="n_requests", type=int, default=500, help="number of requests per api benchmark")
+    parser.add_argument("--concurrency", dest="concurrency", type=int, default=8, help="number of concurrent clients of the api benchmark")
+    parser.add_argument("--batch_size", dest="batch_size", type=int, default=32, help="number of documents per /classify_docs request")
+    args = parser.parse_args()
+
+    benchmarks = [ name for name in args.benchmarks.split( ',' ) if name ]
+    work_dir = args.work_dir or tempfile.mkdtemp( prefix='benchmarks_' )
+    os.makedirs( work_dir, exist_ok=True )
+    corpus = os.path.join( work_dir, 'corpus.tsv' )
+    model_dir = os.path.join( work_dir, 'model' )
+    model_path = os.path.join( model_dir, 'model.p' )
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime( '%Y-%m-%dT%H:%M:%S%z' ),
+        'versions': versions(),
+        'cpu_count': os.cpu_count(),
+        'settings': vars( args ),
+        'results': {},
+    }
+
+    if 'bootstrap' in benchmarks:
+        print( "benchmarking bootstrap" )
+        results[ 'results' ][ 'bootstrap' ] = in_process( bench_bootstrap, work_dir, args.n_files, args.records_per_file, args.workers )
+    if ( 'train' in benchmarks or 'predict' in benchmarks ) and not os.path.isfile( corpus ):
+        write_corpus( corpus, args.n_documents )
+    if 'train' in benchmarks:
+        print( "benchmarking train" )
+        results[ 'results' ][ 'train' ] = in_process( bench_train, corpus, model_dir, { 'SEARCH': { 'METHOD': args.search_method } } )
+    if 'predict' in benchmarks:
+        print( "benchmarking batch prediction" )
+        results[ 'results' ][ 'predict' ] = [ in_process( bench_predict, corpus, model_path, workers, args.chunk_size ) for workers in sorted( { 1, args.workers or os.cpu_count() } ) ]
+    if 'api' in benchmarks:
+        print( "benchmarking the api" )
+        results[ 'results' ][ 'api' ] = in_process( bench_api, model_path, args.n_requests, args.concurrency, args.batch_size )
+
+    with open( args.output_file, 'w' ) as fp:
+        json.dump( results, fp, indent=2 )
+    print( json.dumps( results[ 'results' ], indent=2 ) )
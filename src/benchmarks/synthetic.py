@@ -0,0 +1,93 @@
+'''
+Synthetic solr exports (shaped like eurlex_reference.json) and training corpora (.tsv, as written by bootstrap) for the
+benchmarks, and the timing of the throughput benchmarks (docs_per_second).
+'''
+import copy
+import json
+import os
+import random
+import sys
+import time
+from base64 import b64encode
+
+sys.path.append( os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'businessrules' ) )
+import conf
+
+REFERENCE_DOCUMENT = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', '..', 'eurlex_reference.json' )
+
+WORDS = [ 'financial', 'market', 'bank', 'credit', 'institution', 'capital', 'insurance', 'securities', 'tax', 'state', 'aid',
+          'veterinary', 'fisheries', 'agriculture', 'customs', 'import', 'export', 'regulation', 'directive', 'commission',
+          'council', 'member', 'states', 'article', 'annex', 'shall', 'provisions', 'application', 'amending', 'decision' ]
+
+def synthetic_records( n_records: int, seed: int=0, content_words: int=2000, eurlex_fraction: float=0.9 ):
+    '''
+    Yields n_records solr records with random content and random classifications drawn from the business rules (conf.py),
+    so that the records are accepted, rejected or left unvalidated by the rules.
+    '''
+    rng = random.Random( seed )
+    with open( REFERENCE_DOCUMENT ) as fp:
+        template = json.load( fp )
+
+    directory_codes = conf.accepted_directory_codes + conf.rejected_directory_codes + conf.accepted_directory_codes_under_eurovoc_condition + [ '03', '0350' ]
+    eurovoc_codes = list( conf.accepted_eurovoc_terms_descriptors.values() ) + list( conf.rejected_eurovoc_terms_descriptors.values() ) + [ '1445', '1504', '192', '2560' ]
+
+    for i in range( n_records ):
+        record = copy.copy( template )
+        record[ 'id' ] = f"synthetic-{seed}-{i}"
+        record[ 'celex' ] = [ f"3{seed:03d}{i:08d}" ]
+        record[ 'website' ] = [ 'eurlex' ] if rng.random() < eurlex_fraction else [ 'other' ]
+        record[ 'content' ] = [ ' '.join( rng.choice( WORDS ) for _ in range( rng.randint( content_words // 10, content_words ) ) ) ]
+        record[ 'misc_author' ] = [ rng.choice( conf.accepted_authors ) if rng.random() < 0.1 else 'Council of the European Union' ]
+        record[ 'misc_department_responsible' ] = [ rng.choice( conf.accepted_dep_responsible ) if rng.random() < 0.05 else 'DG06/B/II/2' ]
+
+        types, codes = [], []
+        for _ in range( rng.randint( 0, 2 ) ):
+            types.append( 'directory code' )
+            codes.append( rng.choice( directory_codes ) )
+        for _ in range( rng.randint( 0, 6 ) ):
+            types.append( 'eurovoc descriptor' )
+            codes.append( rng.choice( eurovoc_codes ) )
+        if rng.random() < 0.05:
+            types.append( 'summary codes' )
+            codes.append( rng.choice( conf.accepted_summary_codes ) )
+        record[ 'classifications_type' ] = types
+        record[ 'classifications_code' ] = codes
+        record[ 'classifications_label' ] = [ 'label' ] * len( types )
+        yield record
+
+def write_export( output_dir: str, n_files: int, records_per_file: int, seed: int=0, **kwargs ):
+    '''
+    Writes a synthetic solr export of n_files .jsonl files to output_dir.
+    '''
+    os.makedirs( output_dir, exist_ok=True )
+    for i in range( n_files ):
+        with open( os.path.join( output_dir, f"export_{i:05d}.jsonl" ), 'w' ) as fp:
+            for record in synthetic_records( records_per_file, seed=seed + i, **kwargs ):
+                fp.write( json.dumps( record ) + "\n" )
+
+def write_corpus( path: str, n_documents: int, seed: int=0, content_words: int=500 ):
+    '''
+    Writes a synthetic training corpus in the .tsv format of bootstrap ( base64 document, label, label_nr, celex id ).
+    Accepted documents use the first half of WORDS more often, so that the classifier has something to learn.
+    '''
+    rng = random.Random( seed )
+    half = len( WORDS ) // 2
+    with open( path, 'w' ) as fp:
+        for i in range( n_documents ):
+            accepted = rng.random() < 0.5
+            preferred, other = ( WORDS[ :half ], WORDS[ half: ] ) if accepted else ( WORDS[ half: ], WORDS[ :half ] )
+            words = [ rng.choice( preferred if rng.random() < 0.6 else other ) for _ in range( rng.randint( content_words // 10, content_words ) ) ]
+            document = b64encode( ' '.join( words ).encode( 'utf-8' ) ).decode()
+            label, label_nr = ( 'accepted', 1 ) if accepted else ( 'rejected', 0 )
+            fp.write( f"{document}\t{label}\t{label_nr}\t3{seed:03d}{i:08d}\n" )
+
+def docs_per_second( function, documents, repeats ):
+    '''
+    Throughput of function( documents ), in documents per second, of the fastest of repeats runs.
+    '''
+    best = float( 'inf' )
+    for _ in range( repeats ):
+        start = time.perf_counter()
+        function( documents )
+        best = min( best, time.perf_counter() - start )
+    return len( documents ) / best
@@ -0,0 +1,241 @@
+'''
+Active learning stage after bootstrap(): the documents of the solr export that the business rules do not decide
+(unvalidated) are scored in bulk with a trained classifier (see src/classifier), to prepare the next training round:
+
+- review_uncertain.tsv: the n_uncertain documents with the smallest margin | accepted_probability - 0.5 |, to be
+  labeled by hand,
+- pseudo_labeled.tsv (or .parquet): for each class, the n_confident documents with the highest probability of that
+  class (at least min_confidence, larger than 0.5), labeled with that class, in the format of the training data (see
+  output_writers.py),
+- review_confident.tsv: the same confident documents, to spot-check the pseudo labels,
+- active_learning.json: the number of scored documents, a histogram of their accepted probabilities and the settings.
+
+The review queues have at each line: base64_encoded_document \t predicted label description \t accepted_probability \t celex_id.
+
+The byte ranges of the .jsonl files are processed in parallel as in bootstrap(); every worker loads the classifier
+once, scores the unvalidated documents in batches of batch_size documents with one call of predict_proba, and keeps
+only its best documents in bounded heaps, so memory use does not grow with the size of the export.
+'''
+import argparse
+import heapq
+import json
+import os
+import sys
+from functools import partial
+from multiprocessing import Pool
+from typing import List, Tuple
+
+import numpy as np
+
+from business_rules import CHUNK_SIZE, file_chunks, parse_jsonlines, tsv_line
+from output_writers import OUTPUT_FORMATS, WRITERS, open_writer
+
+sys.path.append( os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'classifier' ) )
+from model_export import load_model, model_version
+from preprocessing import normalize_for
+
+#number of documents scored with one call of the model
+BATCH_SIZE = 1000
+
+#bins of the histogram of the accepted probabilities
+HISTOGRAM_BINS = np.linspace( 0.0, 1.0, 11 )
+
+LABEL_NAMES = { 0: 'rejected', 1: 'accepted' }
+
+class TopK:
+    '''
+    The k documents with the largest keys pushed so far, in a bounded heap of ( key, celex id, accepted probability, document ).
+    A celex id is kept only once, so that duplicates in the export do not take the place of other documents.
+    '''
+    def __init__(self, k: int ):
+        self.k = k
+        self.heap = []
+        self._celex_ids = set()
+
+    @property
+    def threshold(self) -> float:
+        '''
+        Key that a document needs to exceed to be kept.
+        '''
+        return self.heap[0][0] if len( self.heap ) >= self.k else -np.inf
+
+    def push(self, entry: Tuple[ float, str, float, str ] ):
+        celex_id = entry[1]
+        if celex_id and celex_id in self._celex_ids:
+            return
+        if len( self.heap ) < self.k:
+            heapq.heappush( self.heap, entry )
+        elif entry > self.heap[0]:
+            self._celex_ids.discard( heapq.heapreplace( self.heap, entry )[1] )
+        else:
+            return
+        if celex_id:
+            self._celex_ids.add( celex_id )
+
+    def push_batch(self, keys: np.ndarray, accepted_probabilities: np.ndarray, celex_ids: List[str], documents: List[str] ):
+        #only the documents that can enter the heap are pushed
+        for i in np.flatnonzero( keys > self.threshold ):
+            self.push( ( float( keys[i] ), celex_ids[i], float( accepted_probabilities[i] ), documents[i] ) )
+
+    def sorted(self) -> List[ Tuple[ float, str, float, str ] ]:
+        '''
+        The entries, largest key first.
+        '''
+        return sorted( self.heap, reverse=True )
+
+#classifier of the worker process, loaded by _init_worker
+_model = None
+
+def _init_worker( model_path: str ):
+    global _model
+    _model = load_model( model_path )
+
+def score_chunk( chunk, n_uncertain: int, n_confident: int, min_confidence: float, batch_size: int=BATCH_SIZE ):
+    '''
+    Scores the unvalidated eurlex documents of a byte range of a .jsonl file.
+    Returns the heap of the uncertain documents, the heaps of the confident documents of each class, the histogram of
+    the accepted probabilities and the size of the byte range.
+    '''
+    file, start, end = chunk
+    accepted_column = int( np.flatnonzero( np.asarray( _model.classes_ ) == 1 )[0] )
+    uncertain = TopK( n_uncertain )
+    confident = { label: TopK( n_confident ) for label in LABEL_NAMES }
+    histogram = np.zeros( len( HISTOGRAM_BINS ) - 1, dtype=np.int64 )
+
+    def score( celex_ids: List[str], documents: List[str] ):
+        accepted_probabilities = _model.predict_proba( normalize_for( _model, documents ) )[ :, accepted_column ]
+        histogram[:] += np.histogram( accepted_probabilities, bins=HISTOGRAM_BINS )[0]
+        #minus the margin, so that the documents with the smallest margin are kept
+        uncertain.push_batch( -np.abs( accepted_probabilities - 0.5 ), accepted_probabilities, celex_ids, documents )
+        for label, probabilities in ( ( 1, accepted_probabilities ), ( 0, 1.0 - accepted_probabilities ) ):
+            keys = np.where( probabilities >= min_confidence, probabilities, -np.inf )
+            confident[ label ].push_batch( keys, accepted_probabilities, celex_ids, documents )
+
+    celex_ids = []
+    documents = []
+    for eurlex_doc in parse_jsonlines( file, start, end ):
+        if eurlex_doc.acceptance_state != 'unvalidated':
+            continue
+        celex_ids.append( eurlex_doc.celex_id )
+        documents.append( eurlex_doc.get_text() )
+        if len( documents ) >= batch_size:
+            score( celex_ids, documents )
+            celex_ids, documents = [], []
+    if documents:
+        score( celex_ids, documents )
+    return uncertain.heap, { label: heap.heap for label, heap in confident.items() }, histogram, end - start
+
+def _predicted_label( entry: Tuple[ float, str, float, str ] ) -> int:
+    return int( entry[2] >= 0.5 )
+
+def _confident_entries( confident: dict ) -> List[ Tuple[ int, Tuple[ float, str, float, str ] ] ]:
+    '''
+    ( label, entry ) of the confident documents, labeled with the class of the heap they were selected in, accepted
+    documents first. A celex id is only kept once, also if it was selected in both heaps.
+    '''
+    entries = []
+    seen = set()
+    for label in sorted( confident, reverse=True ):
+        for entry in confident[ label ].sorted():
+            if entry[1] and entry[1] in seen:
+                continue
+            seen.add( entry[1] )
+            entries.append( ( label, entry ) )
+    return entries
+
+def _write_queue( path: str, entries: List[ Tuple[ int, Tuple[ float, str, float, str ] ] ] ):
+    '''
+    Writes a review queue of ( label, entry ), see the module docstring.
+    '''
+    with open( path + '.part', 'w' ) as fp:
+        for label, ( _, celex_id, accepted_probability, document ) in entries:
+            fp.write( f"{tsv_line( ( document, LABEL_NAMES[ label ], accepted_probability, celex_id ) )}\n" )
+    os.replace( path + '.part', path )
+
+def check_min_confidence( min_confidence: float ):
+    '''
+    A document can only be confident of one class if min_confidence is larger than 0.5.
+    '''
+    if not 0.5 < min_confidence <= 1.0:
+        raise ValueError( f"min_confidence must be larger than 0.5 and at most 1, not {min_confidence}." )
+
+def active_learning( input_dir, model_path, output_dir, n_uncertain=1000, n_confident=1000, min_confidence=0.95,
+                     workers=None, chunk_size=CHUNK_SIZE, output_format='tsv', batch_size=BATCH_SIZE ):
+    '''
+    Scores the unvalidated documents of the .jsonl files of input_dir with the classifier at model_path (pickled or
+    compiled, see model_export.py) and writes the review queues and the pseudo-labeled documents to output_dir,
+    see the module docstring.
+    '''
+    check_min_confidence( min_confidence )
+    os.makedirs( output_dir, exist_ok=True )
+    pseudo_labeled_output = os.path.join( output_dir, 'pseudo_labeled' + WRITERS[ output_format ].extension )
+    if os.path.isfile( pseudo_labeled_output ):
+        raise Exception( 'Pseudo-labeled documents already exist in the output directory.' )
+
+    files = sorted( os.path.join( input_dir, filename ) for filename in os.listdir( input_dir ) if filename.endswith( '.jsonl' ) )
+    chunks = list( file_chunks( files, chunk_size ) )
+    total_size = sum( os.path.getsize( file ) for file in files )
+
+    uncertain = TopK( n_uncertain )
+    confident = { label: TopK( n_confident ) for label in LABEL_NAMES }
+    histogram = np.zeros( len( HISTOGRAM_BINS ) - 1, dtype=np.int64 )
+    processed_size = 0
+
+    score = partial( score_chunk, n_uncertain=n_uncertain, n_confident=n_confident, min_confidence=min_confidence, batch_size=batch_size )
+    with Pool( workers, initializer=_init_worker, initargs=( model_path, ) ) as pool:
+        for chunk_uncertain, chunk_confident, chunk_histogram, n_bytes in pool.imap_unordered( score, chunks ):
+            #the heaps of the byte ranges are merged into the heaps of the export
+            for entry in chunk_uncertain:
+                uncertain.push( entry )
+            for label, heap in chunk_confident.items():
+                for entry in heap:
+                    confident[ label ].push( entry )
+            histogram += chunk_histogram
+            processed_size += n_bytes
+            print( f"{processed_size / 1e6:.1f}/{total_size / 1e6:.1f}MB processed: {histogram.sum()} unvalidated documents scored", flush=True )
+
+    _write_queue( os.path.join( output_dir, 'review_uncertain.tsv' ), [ ( _predicted_label( entry ), entry ) for entry in uncertain.sorted() ] )
+    confident_entries = _confident_entries( confident )
+    _write_queue( os.path.join( output_dir, 'review_confident.tsv' ), confident_entries )
+
+    #write to a temporary file, so that an interrupted run does not leave an incomplete shard
+    with open_writer( pseudo_labeled_output + '.part', output_format ) as output_file:
+        for label, ( _, celex_id, accepted_probability, document ) in confident_entries:
+            record = ( document, LABEL_NAMES[ label ], label, celex_id )
+            output_file.write( tsv_line( record ) if output_format == 'tsv' else record )
+    os.replace( pseudo_labeled_output + '.part', pseudo_labeled_output )
+
+    summary = {
+        'model_path': model_path,
+        'model_version': model_version( model_path ),
+        'n_scored': int( histogram.sum() ),
+        'accepted_probability_histogram': { f'{low:.1f}-{high:.1f}': int( count ) for low, high, count in zip( HISTOGRAM_BINS[:-1], HISTOGRAM_BINS[1:], histogram ) },
+        'n_uncertain': len( uncertain.sorted() ),
+        'n_pseudo_labeled': { LABEL_NAMES[ label ]: sum( entry_label == label for entry_label, _ in confident_entries ) for label in LABEL_NAMES },
+        'min_confidence': min_confidence,
+    }
+    with open( os.path.join( output_dir, 'active_learning.json' ), 'w' ) as fp:
+        json.dump( summary, fp, indent=2 )
+    print( f"{summary[ 'n_uncertain' ]} documents to review, {summary[ 'n_pseudo_labeled' ]} pseudo-labeled documents written to {output_dir}" )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_dir", dest="input_dir", help="Location of the data export.", required=True)
+    parser.add_argument("--model_path", dest="model_path", help="path to the classifier (python pickle format, or directory of a model compiled with model_export.py)", required=True)
+    parser.add_argument("--output_dir", dest="output_dir", help="output directory (where the review queues and the pseudo-labeled documents will be written to)", required=True)
+    parser.add_argument("--n_uncertain", dest="n_uncertain", type=int, default=1000, help="number of uncertain documents in the review queue")
+    parser.add_argument("--n_confident", dest="n_confident", type=int, default=1000, help="maximum number of pseudo-labeled documents per class")
+    parser.add_argument("--min_confidence", dest="min_confidence", type=float, default=0.95, help="minimum probability of the predicted class of a pseudo-labeled document (larger than 0.5)")
+    parser.add_argument("--workers", dest="workers", type=int, default=None, help="number of worker processes (default: number of cpu's)")
+    parser.add_argument("--output_format", dest="output_format", choices=OUTPUT_FORMATS, default='tsv', help="format of the pseudo-labeled documents (see output_writers.py)")
+    parser.add_argument("--chunk_size_mb", dest="chunk_size_mb", type=int, default=CHUNK_SIZE // ( 1024 * 1024 ), help="size (MB) of the parts of the .jsonl files processed by one worker")
+    parser.add_argument("--batch_size", dest="batch_size", type=int, default=BATCH_SIZE, help="number of documents scored with one call of the classifier")
+    args = parser.parse_args()
+    try:
+        check_min_confidence( args.min_confidence )
+    except ValueError as e:
+        parser.error( str( e ) )
+
+    active_learning( args.input_dir, args.model_path, args.output_dir, n_uncertain=args.n_uncertain, n_confident=args.n_confident,
+                     min_confidence=args.min_confidence, workers=args.workers, chunk_size=args.chunk_size_mb * 1024 * 1024,
+                     output_format=args.output_format, batch_size=args.batch_size )
@@ -1,17 +1,41 @@
-import jsonlines
+import json
 import argparse
+import hashlib
 import os
-from base64 import b64decode, b64encode
+from base64 import b64encode
+from collections import Counter
+from functools import partial
 from multiprocessing import Pool
 
 import conf
+from output_writers import OUTPUT_FORMATS, WRITERS, open_writer
+from rule_engine import RuleEngine
 
-ACCEPTED_EUROVOC_NUMBERS=set( [conf.accepted_eurovoc_terms_descriptors[ key ] for key in conf.accepted_eurovoc_terms_descriptors] )
-REJECTED_EUROVOC_NUMBERS=set( [conf.rejected_eurovoc_terms_descriptors[ key ] for key in conf.rejected_eurovoc_terms_descriptors] )
+#fast json parsers, if available
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#size of the byte ranges of the .jsonl files that are processed by one worker
+CHUNK_SIZE = 64 * 1024 * 1024
+
+RULE_ENGINE = RuleEngine( conf )
+
+#fields of a solr record that are used by EurlexDocument and the business rules, the other fields are not materialized (with simdjson)
+FIELDS = ( 'content', 'celex', 'website', 'misc_author', 'misc_department_responsible',
+           'classifications_type', 'classifications_code', 'classifications_label' )
 
 class EurlexDocument:
     """Representation of the Eurlex document
     """
+    __slots__ = ( 'content', 'celex_id', 'misc_author', 'misc_department_responsable', 'classifications',
+                  'classifications_name', 'acceptance_state', 'rule' )
+
     def __init__(self, jsonline_dictionary):
         """Contstructs an EurlexDocument object from a dictionary obtained through jsonline.
 
@@ -41,10 +65,12 @@ class EurlexDocument:
                 self.classifications_name[type_] = [code_]          
                 
         self.acceptance_state = 'unvalidated'
+        self.rule = None
 
-    def set_state(self, state):
+    def set_state(self, state, rule=None):
         assert state in ['accepted', 'rejected'], """State should be 'accepted' or 'rejected'"""
         self.acceptance_state = state
+        self.rule = rule
     
     '''
     def get_content(self, key):
@@ -56,118 +82,262 @@ class EurlexDocument:
             return self.classifications
     '''
 
-    def get_label(self):
-        document = ' '.join(self.content.split())
-        celex_id=self.celex_id
-        encoded_doc = b64encode(document.encode())
+    def get_text(self):
+        '''
+        Returns the content of the document with normalized whitespace, as written to the training data.
+        '''
+        return ' '.join(self.content.split())
+
+    def get_record(self):
+        '''
+        Returns ( document, label description, label, celex id ) of a labeled document, or None if the document is unvalidated.
+        '''
         if self.acceptance_state == 'accepted':
             label = 1
-            label_name = 'accepted'
-            return f"{encoded_doc.decode()  }\t{ label_name }\t{label}\t{celex_id}"
-
-        if self.acceptance_state == 'rejected':
+        elif self.acceptance_state == 'rejected':
             label = 0
-            label_name = 'rejected'
-            return f"{encoded_doc.decode()  }\t{ label_name }\t{label}\t{celex_id}"
-        
-        
+        else:
+            return None
+        return self.get_text(), self.acceptance_state, label, self.celex_id
+
+    def get_label(self):
+        record = self.get_record()
+        if record is None:
+            return None
+        return tsv_line( record )
+
+def tsv_line( record ):
+    '''
+    Line of the tsv training data of a record ( document, label description, label, celex id ).
+    '''
+    document, label_name, label, celex_id = record
+    encoded_doc = b64encode(document.encode())
+    return f"{encoded_doc.decode()  }\t{ label_name }\t{label}\t{celex_id}"
+
 def classify( eurlex_doc: EurlexDocument ):
-    
-    #1. classify author
-    
-    if set( eurlex_doc.misc_author ).intersection( set( conf.accepted_authors ) ):
-        eurlex_doc.set_state( 'accepted' )
-        return
-    
-    #2. classify departement
-    
-    if set( eurlex_doc.misc_department_responsable ).intersection( set( conf.accepted_dep_responsible ) ):
-        eurlex_doc.set_state( 'accepted' )
-        return
+    '''
+    Sets the acceptance state of the document according to the business rules (conf.py), and the name of the rule that fired.
+    '''
+    state, rule = RULE_ENGINE.label( eurlex_doc )
+    if state is not None:
+        eurlex_doc.set_state( state, rule )
 
-    #3. classify summary code
-    
-    if 'summary codes' in eurlex_doc.classifications:
-        if set( conf.accepted_summary_codes ).intersection( set( eurlex_doc.classifications['summary codes'] ) ):
-            eurlex_doc.set_state( 'accepted' )
-            return
+def read_lines( file, start=0, end=None ):
+    '''
+    Yields the lines (bytes) of a .jsonl file that start in the byte range [start, end).
+    '''
+    with open( file, 'rb' ) as reader:
+        if start > 0:
+            #skip the line that started in the previous byte range
+            reader.seek( start - 1 )
+            reader.readline()
+        while end is None or reader.tell() < end:
+            line = reader.readline()
+            if not line:
+                break
+            yield line
 
-    #4. classify directory code
-    
-    if 'directory code' in eurlex_doc.classifications:
-        if set( conf.accepted_directory_codes ).intersection( set( eurlex_doc.classifications['directory code'] )  ):
-            eurlex_doc.set_state( 'accepted' )
-            return
-            
-    if 'directory code' in eurlex_doc.classifications:
-        if set( conf.rejected_directory_codes ).intersection( set( eurlex_doc.classifications['directory code'] )  ):
-            eurlex_doc.set_state( 'rejected' )
-            return
-         
-    #accept under condition:
-    if 'directory code' in eurlex_doc.classifications:
-        if set( conf.accepted_directory_codes_under_eurovoc_condition ).intersection( set( eurlex_doc.classifications['directory code'] )  ):
-            #accept if at least two listed in ACCEPT EUROVOC and no listed in REJECT EUROVOC
-            if 'eurovoc descriptor' in eurlex_doc.classifications:
-                if len( list( ACCEPTED_EUROVOC_NUMBERS.intersection( set( eurlex_doc.classifications[ 'eurovoc descriptor' ] )))) >= 2:
-                    if not REJECTED_EUROVOC_NUMBERS.intersection( set( eurlex_doc.classifications[ 'eurovoc descriptor' ] )):
-                        eurlex_doc.set_state( 'accepted' )
-                        return
-                    
-    #5. classify eurovoc code:
-    
-    #reject documents with any of the rejected eurovoc terms
-    if 'eurovoc descriptor' in eurlex_doc.classifications:
-        if REJECTED_EUROVOC_NUMBERS.intersection( set( eurlex_doc.classifications[ 'eurovoc descriptor' ] )):
-            eurlex_doc.set_state( 'rejected' )
-            return
-                 
-    #accept if at least two listed in ACCEPT EUROVOC and no listed in REJECT EUROVOC
-    if 'eurovoc descriptor' in eurlex_doc.classifications:
-        if len( list( ACCEPTED_EUROVOC_NUMBERS.intersection( set( eurlex_doc.classifications[ 'eurovoc descriptor' ] )))) >= 2:
-            if not REJECTED_EUROVOC_NUMBERS.intersection( set( eurlex_doc.classifications[ 'eurovoc descriptor' ] )):
-                eurlex_doc.set_state( 'accepted' )
-                return
-        
-def parse_jsonlines( file ):
-    with jsonlines.open( file ) as reader:
-        for obj in reader:
-            if 'content' in obj:
-                if 'eurlex' in obj[ 'website' ]:
-                    eurlex_doc=EurlexDocument( obj )
-                    if eurlex_doc:
-                        classify( eurlex_doc )
-                        label = eurlex_doc.get_label()
-                        return label
-
-def bootstrap(input_dir, output_dir):
+def _materialize( value ):
+    if isinstance( value, simdjson.Array ):
+        return value.as_list()
+    if isinstance( value, simdjson.Object ):
+        return value.as_dict()
+    return value
+
+if simdjson is not None:
+    _PARSER = simdjson.Parser()
+
+def parse_record( line: bytes ):
+    '''
+    Parses a line of a .jsonl file into a dictionary with the FIELDS of the record, or returns None if the record is not a
+    eurlex document with content. Lines that can not contain a eurlex document are rejected before they are decoded, with
+    every parser. Only simdjson parses lazily (only the FIELDS are converted to python objects); orjson and json
+    materialize every field of the record before the FIELDS are taken.
+    '''
+    if b'eurlex' not in line or b'"content"' not in line:
+        return None
+
+    if simdjson is not None:
+        #lazy parsing: only the projected fields are converted to python objects
+        document = _PARSER.parse( line )
+        record = { field: _materialize( document[ field ] ) for field in FIELDS if field in document }
+    else:
+        document = orjson.loads( line ) if orjson is not None else json.loads( line )
+        record = { field: document[ field ] for field in FIELDS if field in document }
+
+    if 'content' in record and 'eurlex' in record.get( 'website', '' ):
+        return record
+    return None
+
+def parse_jsonlines( file, start=0, end=None ):
+    '''
+    Yields every eurlex document of (the byte range [start, end) of) a .jsonl file, classified according to the business rules.
+    '''
+    for line in read_lines( file, start, end ):
+        record = parse_record( line )
+        if record is not None:
+            eurlex_doc=EurlexDocument( record )
+            classify( eurlex_doc )
+            yield eurlex_doc
+
+def file_chunks( files, chunk_size=CHUNK_SIZE ):
+    '''
+    Splits the files in byte ranges of at most chunk_size bytes. Yields ( file, start, end ).
+    '''
+    for file in files:
+        size = os.path.getsize( file )
+        for start in range( 0, max( size, 1 ), chunk_size ):
+            yield file, start, min( start + chunk_size, size )
+
+def process_chunk( chunk, output_format='tsv' ):
+    '''
+    Labels the eurlex documents in a byte range of a .jsonl file.
+    Returns ( celex id, tsv line or record, see EurlexDocument.get_record ) of the labeled documents,
+    the number of documents per acceptance state and the size of the byte range.
+    '''
+    file, start, end = chunk
+    labels = []
+    counts = Counter()
+    for eurlex_doc in parse_jsonlines( file, start, end ):
+        counts[ eurlex_doc.acceptance_state ] += 1
+        label = eurlex_doc.get_label() if output_format == 'tsv' else eurlex_doc.get_record()
+        if label is not None:
+            labels.append( ( eurlex_doc.celex_id, label ) )
+    return labels, counts, end - start
+
+def label_files( files, output_file, workers=None, chunk_size=CHUNK_SIZE, celex_ids=None, output_format='tsv' ):
+    '''
+    Labels the eurlex documents of the .jsonl files in parallel and writes them to output_file (see output_writers.py)
+    as soon as a byte range is processed.
+    If a set of celex_ids is given, documents with a celex id in the set are skipped, and the celex ids of the written documents are added to it.
+    '''
+    chunks = list( file_chunks( files, chunk_size ) )
+    total_size = sum( os.path.getsize( file ) for file in files )
+
+    counts = Counter()
+    processed_size = 0
+
+    with Pool( workers ) as pool:
+        for labels, chunk_counts, n_bytes in pool.imap_unordered( partial( process_chunk, output_format=output_format ), chunks ):
+            for celex_id, label in labels:
+                if celex_ids is not None and celex_id:
+                    if celex_id in celex_ids:
+                        counts[ 'duplicate' ] += 1
+                        continue
+                    celex_ids.add( celex_id )
+                output_file.write( label )
+            counts.update( chunk_counts )
+            processed_size += n_bytes
+            print( f"{processed_size / 1e6:.1f}/{total_size / 1e6:.1f}MB processed: "
+                   f"{counts[ 'accepted' ]} accepted, {counts[ 'rejected' ]} rejected, {counts[ 'unvalidated' ]} unvalidated documents"
+                   + ( f", {counts[ 'duplicate' ]} duplicates skipped" if celex_ids is not None else "" ), flush=True )
+
+def rules_hash():
+    '''
+    Hash of the business rules (conf.py).
+    '''
+    with open( conf.__file__, 'rb' ) as fp:
+        return hashlib.sha256( fp.read() ).hexdigest()
+
+def bootstrap(input_dir, output_dir, workers=None, chunk_size=CHUNK_SIZE, incremental=False, output_format='tsv'):
     '''
     bootstrap() takes an input directory and output directory as argument.
     It reads all .jsonl-files and creates a training set according to the business rules.
-    It writes the output to a .tsv-file in the output_dir
+    It writes the output to a .tsv-file (or a .parquet-file if output_format is 'parquet', see output_writers.py) in the output_dir
+
+    Large files are split in byte ranges of chunk_size bytes, which are processed in parallel by `workers` processes
+    (default: number of cpu's). The labeled documents are written as soon as a byte range is processed.
+
+    In incremental mode, see bootstrap_incremental, only new or changed .jsonl-files are processed.
     '''
 
-    pool = Pool()                     # Create a multiprocessing Pool
+    if incremental:
+        return bootstrap_incremental( input_dir, output_dir, workers=workers, chunk_size=chunk_size, output_format=output_format )
 
     os.makedirs(output_dir, exist_ok=True)
 
-    training_set_output = os.path.join(output_dir, 'train_data.tsv')
+    training_set_output = os.path.join(output_dir, 'train_data' + WRITERS[ output_format ].extension)
     if os.path.isfile(training_set_output):
         raise Exception('A training file already exists in the output directory.')
 
-    all_files = [os.path.join(input_dir, filename) for filename in os.listdir(input_dir) if filename.endswith('.jsonl')]
-    results = pool.map(parse_jsonlines, all_files)  # process files iterable with pool
+    all_files = sorted( os.path.join(input_dir, filename) for filename in os.listdir(input_dir) if filename.endswith('.jsonl') )
 
-    with open(training_set_output, 'w+') as output_file:
-        output_file.writelines(f"{result}\n" for result in results if result is not None)
+    #write to a temporary file, so that an interrupted run does not leave an incomplete training file
+    with open_writer( training_set_output + '.part', output_format ) as output_file:
+        label_files( all_files, output_file, workers=workers, chunk_size=chunk_size, output_format=output_format )
+
+    os.replace( training_set_output + '.part', training_set_output )
+
+def bootstrap_incremental(input_dir, output_dir, workers=None, chunk_size=CHUNK_SIZE, output_format='tsv'):
+    '''
+    Incremental version of bootstrap(), for a solr export that grows over time.
+
+    output_dir/manifest.json keeps track of the processed .jsonl-files (path, size, modification time and hash of the business rules)
+    and of the written shards. Every run only processes the .jsonl-files that are new or changed since the previous run,
+    and writes the labeled documents to a new shard output_dir/train_data-<run>.tsv (or .parquet), skipping documents with a celex id
+    that is already in one of the shards (the celex ids of a shard are kept in output_dir/train_data-<run>.celex).
+    The training set is the concatenation of the shards.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest_path = os.path.join( output_dir, 'manifest.json' )
+    if os.path.isfile( manifest_path ):
+        with open( manifest_path ) as fp:
+            manifest = json.load( fp )
+    else:
+        manifest = { 'files': {}, 'shards': [], 'format': output_format }
+
+    if manifest.get( 'format', 'tsv' ) != output_format:
+        raise Exception( f"The training set in the output directory is in the {manifest.get( 'format', 'tsv' )} format." )
+
+    current_rules_hash = rules_hash()
+    if any( state[ 'rules_hash' ] != current_rules_hash for state in manifest[ 'files' ].values() ):
+        raise Exception( 'The business rules (conf.py) changed since the previous run. Create the training set in a new output directory.' )
+
+    files_to_process = []
+    file_states = {}
+    for filename in sorted( os.listdir( input_dir ) ):
+        if not filename.endswith( '.jsonl' ):
+            continue
+        path = os.path.abspath( os.path.join( input_dir, filename ) )
+        stat = os.stat( path )
+        file_states[ path ] = { 'size': stat.st_size, 'mtime': stat.st_mtime, 'rules_hash': current_rules_hash }
+        if manifest[ 'files' ].get( path ) != file_states[ path ]:
+            files_to_process.append( path )
+
+    if not files_to_process:
+        print( "No new or changed files." )
+        return
+
+    celex_ids = set()
+    for shard in manifest[ 'shards' ]:
+        with open( os.path.join( output_dir, shard + '.celex' ) ) as fp:
+            celex_ids.update( line.rstrip( '\n' ) for line in fp )
+    known_celex_ids = set( celex_ids )
+
+    print( f"Processing {len( files_to_process )} new or changed files." )
+    shard = f"train_data-{len( manifest[ 'shards' ] ) + 1:05d}"
+    with open_writer( os.path.join( output_dir, shard + WRITERS[ output_format ].extension ), output_format ) as output_file:
+        label_files( files_to_process, output_file, workers=workers, chunk_size=chunk_size, celex_ids=celex_ids, output_format=output_format )
+    with open( os.path.join( output_dir, shard + '.celex' ), 'w' ) as fp:
+        fp.writelines( f"{celex_id}\n" for celex_id in celex_ids - known_celex_ids )
+
+    #the shard only becomes part of the training set when the manifest is updated
+    for path in files_to_process:
+        manifest[ 'files' ][ path ] = file_states[ path ]
+    manifest[ 'shards' ].append( shard )
+    with open( manifest_path + '.part', 'w' ) as fp:
+        json.dump( manifest, fp, indent=2 )
+    os.replace( manifest_path + '.part', manifest_path )
 
-    pool.close()    #close the multiprocessing pool
-    pool.join()
-    
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_dir", dest="input_dir", help="Location of the data export.", required=True)
     parser.add_argument("--output_dir", dest="output_dir", help="output directory (where the train data will be written to)", required=True)
+    parser.add_argument("--workers", dest="workers", type=int, default=None, help="number of worker processes (default: number of cpu's)")
+    parser.add_argument("--incremental", dest="incremental", action="store_true", help="only process new or changed files, and write the labeled documents to a new shard (see bootstrap_incremental)")
+    parser.add_argument("--output_format", dest="output_format", choices=OUTPUT_FORMATS, default='tsv', help="format of the training data (see output_writers.py)")
+    parser.add_argument("--chunk_size_mb", dest="chunk_size_mb", type=int, default=CHUNK_SIZE // ( 1024 * 1024 ), help="size (MB) of the parts of the .jsonl files processed by one worker")
     args = parser.parse_args()
 
-    bootstrap(input_dir=args.input_dir, output_dir=args.output_dir)
\ No newline at end of file
+    bootstrap(input_dir=args.input_dir, output_dir=args.output_dir, workers=args.workers, chunk_size=args.chunk_size_mb * 1024 * 1024, incremental=args.incremental, output_format=args.output_format)
\ No newline at end of file
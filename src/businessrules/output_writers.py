@@ -0,0 +1,72 @@
+'''
+Writers of the training data created by bootstrap().
+
+- 'tsv': at each line base64_encoded_document \t label_description \t label \t celex_id
+- 'parquet': columns text, label, label_nr and celex, with the documents as plain (compressed) text. Requires pyarrow.
+'''
+OUTPUT_FORMATS = ( 'tsv', 'parquet' )
+
+class TsvWriter:
+    '''
+    Writes the tsv lines made by EurlexDocument.get_label().
+    '''
+    extension = '.tsv'
+
+    def __init__(self, path: str ):
+        self.file = open( path, 'w' )
+
+    def write(self, line: str ):
+        self.file.write( f"{line}\n" )
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info ):
+        self.close()
+
+class ParquetWriter( TsvWriter ):
+    '''
+    Writes the records ( text, label description, label, celex id ) made by EurlexDocument.get_record()
+    in row groups of row_group_size documents.
+    '''
+    extension = '.parquet'
+
+    def __init__(self, path: str, row_group_size: int=1000 ):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError( "pyarrow is needed to write the training data in the parquet format." )
+        self._pa = pa
+        self.schema = pa.schema( [ ( 'text', pa.string() ), ( 'label', pa.string() ), ( 'label_nr', pa.int8() ), ( 'celex', pa.string() ) ] )
+        self.file = pq.ParquetWriter( path, self.schema, compression='zstd' )
+        self.row_group_size = row_group_size
+        self.rows = []
+
+    def write(self, record: tuple ):
+        self.rows.append( record )
+        if len( self.rows ) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            columns = [ list( column ) for column in zip( *self.rows ) ]
+            self.file.write_table( self._pa.Table.from_arrays( [ self._pa.array( column, type=field.type ) for column, field in zip( columns, self.schema ) ], schema=self.schema ) )
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+WRITERS = { 'tsv': TsvWriter, 'parquet': ParquetWriter }
+
+def open_writer( path: str, output_format: str='tsv' ):
+    '''
+    Opens a writer for the training data in the given format.
+    '''
+    if output_format not in WRITERS:
+        raise ValueError( f"Unknown output format {output_format}, use one of {OUTPUT_FORMATS}." )
+    return WRITERS[ output_format ]( path )
@@ -0,0 +1,87 @@
+'''
+Rule engine for the business rules of conf.py. The rules are compiled once into frozensets, and every document is
+labeled with a single pass over its classifications.
+'''
+from typing import Iterable, List, Optional, Tuple
+
+#names of the rules, in the order in which they are applied
+RULES = (
+    'author',
+    'department',
+    'summary code',
+    'directory code',
+    'rejected directory code',
+    'directory code under eurovoc condition',
+    'rejected eurovoc',
+    'accepted eurovoc',
+)
+
+class RuleEngine:
+    '''
+    Business rules compiled from a configuration module (conf.py). The rules are applied in the order of RULES;
+    the first rule that fires decides the acceptance state of the document.
+    '''
+    def __init__(self, conf ):
+        self.accepted_authors = frozenset( conf.accepted_authors )
+        self.accepted_dep_responsible = frozenset( conf.accepted_dep_responsible )
+        self.accepted_summary_codes = frozenset( conf.accepted_summary_codes )
+        self.accepted_directory_codes = frozenset( conf.accepted_directory_codes )
+        self.rejected_directory_codes = frozenset( conf.rejected_directory_codes )
+        self.accepted_directory_codes_under_eurovoc_condition = frozenset( conf.accepted_directory_codes_under_eurovoc_condition )
+        self.accepted_eurovoc_numbers = frozenset( conf.accepted_eurovoc_terms_descriptors.values() )
+        self.rejected_eurovoc_numbers = frozenset( conf.rejected_eurovoc_terms_descriptors.values() )
+
+    def label(self, eurlex_doc ) -> Tuple[ Optional[str], Optional[str] ]:
+        '''
+        Returns the acceptance state ('accepted' or 'rejected') of the document and the name of the rule that fired,
+        or ( None, None ) if no rule applies.
+        '''
+        #1. classify author
+        if not self.accepted_authors.isdisjoint( eurlex_doc.misc_author ):
+            return 'accepted', 'author'
+
+        #2. classify departement
+        if not self.accepted_dep_responsible.isdisjoint( eurlex_doc.misc_department_responsable ):
+            return 'accepted', 'department'
+
+        classifications = eurlex_doc.classifications
+
+        #3. classify summary code
+        summary_codes = classifications.get( 'summary codes' )
+        if summary_codes and not self.accepted_summary_codes.isdisjoint( summary_codes ):
+            return 'accepted', 'summary code'
+
+        #4. classify directory code
+        directory_codes = classifications.get( 'directory code' )
+        under_eurovoc_condition = False
+        if directory_codes:
+            if not self.accepted_directory_codes.isdisjoint( directory_codes ):
+                return 'accepted', 'directory code'
+            if not self.rejected_directory_codes.isdisjoint( directory_codes ):
+                return 'rejected', 'rejected directory code'
+            under_eurovoc_condition = not self.accepted_directory_codes_under_eurovoc_condition.isdisjoint( directory_codes )
+
+        #5. classify eurovoc code
+        eurovoc_descriptors = classifications.get( 'eurovoc descriptor' )
+        if not eurovoc_descriptors:
+            return None, None
+
+        #reject documents with any of the rejected eurovoc terms
+        if not self.rejected_eurovoc_numbers.isdisjoint( eurovoc_descriptors ):
+            return 'rejected', 'rejected eurovoc'
+
+        #accept if at least two listed in ACCEPT EUROVOC and no listed in REJECT EUROVOC
+        #(the accept under eurovoc condition of a directory code comes first, but can only fire if no eurovoc term is rejected)
+        if len( self.accepted_eurovoc_numbers.intersection( eurovoc_descriptors ) ) >= 2:
+            if under_eurovoc_condition:
+                return 'accepted', 'directory code under eurovoc condition'
+            return 'accepted', 'accepted eurovoc'
+
+        return None, None
+
+    def label_batch(self, eurlex_docs: Iterable ) -> List[ Tuple[ Optional[str], Optional[str] ] ]:
+        '''
+        Labels a batch of documents, see label().
+        '''
+        label = self.label
+        return [ label( eurlex_doc ) for eurlex_doc in eurlex_docs ]
@@ -0,0 +1,92 @@
+'''
+Batch prediction of large files (e.g. re-classifying the full Solr index) with a pool of worker processes.
+
+The documents are read in chunks, every worker process loads the model once (a compiled model, see model_export.py,
+is memory mapped and shared between the workers), and the predictions of the chunks are returned in the order of the
+input. At most max_pending chunks are in flight at the same time, so memory use does not grow with the size of the input.
+'''
+import os
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+from typing import Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from model_export import load_model
+from preprocessing import decode_for, normalize_for
+
+#number of documents per chunk
+CHUNK_SIZE = 1000
+
+#model of the worker process, loaded by _init_worker
+_model = None
+
+def _init_worker( model_path: str ):
+    global _model
+    _model = load_model( model_path )
+
+def _predict_chunk( documents: List[str], decode: bool, remove_punctuation_numbers: bool ) -> Tuple[ np.ndarray, np.ndarray ]:
+    '''
+    Labels and probabilities of a chunk of documents; the label is derived from the probabilities, so the pipeline is evaluated only once.
+    '''
+    if decode:
+        #only the part of the documents that the length policy of the model keeps is decoded
+        documents = [ decode_for( _model, document ) for document in documents ]
+    documents = normalize_for( _model, documents, remove_punctuation_numbers )
+    probabilities = _model.predict_proba( documents )
+    return _model.classes_[ probabilities.argmax( axis=1 ) ], probabilities
+
+def iter_line_chunks( path: str, chunk_size: int=CHUNK_SIZE ) -> Iterator[ List[str] ]:
+    '''
+    Reads a file with at each line a (base64 encoded) document in chunks of chunk_size lines.
+    '''
+    with open( path, 'r' ) as fp:
+        lines = ( line.rstrip( '\n' ) for line in fp )
+        while True:
+            chunk = list( islice( lines, chunk_size ) )
+            if not chunk:
+                break
+            yield chunk
+
+def predict_chunks( chunks: Iterable[ List[str] ], model_path: str, workers: int=None, decode: bool=False,
+                    remove_punctuation_numbers: bool=True, max_pending: int=None ) -> Iterator[ Tuple[ np.ndarray, np.ndarray ] ]:
+    '''
+    Yields the ( labels, probabilities ) of every chunk of documents, in the order of the chunks.
+
+    :param chunks: chunks of documents
+    :type chunks: Iterable[ List[str] ]
+    :param model_path: path to the classifier (python pickle format, or directory of a compiled model)
+    :type model_path: str
+    :param workers: number of worker processes (default: number of cpu's), with 1 the chunks are predicted in this process
+    :type workers: int
+    :param decode: whether the documents are base64 encoded
+    :type decode: bool
+    :param remove_punctuation_numbers: whether punctuation and numbers are removed from the documents, for models saved without normalization step
+    :type remove_punctuation_numbers: bool
+    :param max_pending: maximum number of chunks in flight (default: 2 x workers)
+    :type max_pending: int
+    '''
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        _init_worker( model_path )
+        for chunk in chunks:
+            yield _predict_chunk( chunk, decode, remove_punctuation_numbers )
+        return
+
+    max_pending = max_pending or 2 * workers
+    with Pool( workers, initializer=_init_worker, initargs=( model_path, ) ) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append( pool.apply_async( _predict_chunk, ( chunk, decode, remove_punctuation_numbers ) ) )
+            if len( pending ) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def write_predictions( fp, labels: np.ndarray, probabilities: np.ndarray ):
+    '''
+    Writes a line "label [probabilities]" per document.
+    '''
+    for label, probability in zip( labels, probabilities ):
+        fp.write( f"{label} {probability}\n" )
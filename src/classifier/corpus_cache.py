@@ -0,0 +1,138 @@
+'''
+On-disk cache of the preprocessed training corpus, so that repeated training runs and grid points do not decode, clean
+and tokenize the corpus again.
+
+The cache of the training data is the directory CACHE_DIR/<key>, with key a hash of the content of the training files and
+of the preprocessing and vectorizer settings. It contains:
+
+- texts.pkl, labels.npy: the cleaned documents and their labels,
+- counts.npz, terms.npy: the token counts of the whole corpus ( n_documents x n_terms ) and the (sorted) terms,
+- folds.npz: the train and test indices of the cross validation folds,
+- max_df_<max_df>/fold_<i>_train.npz, fold_<i>_test.npz, fold_<i>_columns.npy: for every fold, the token counts
+  restricted to the vocabulary that a vectorizer with this max_df, fitted on the training part of the fold, would have.
+- shared/: uncompressed copies ( .npy ) of the fold counts, memory mapped so that the worker processes of the grid
+  search share them (see fold_counts).
+'''
+import hashlib
+import json
+import numbers
+import os
+import pickle
+from typing import Callable, List, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+import sklearn
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.model_selection import check_cv
+
+from training_data import training_data_files
+
+def file_hash( path: str, block_size: int=1 << 20 ) -> str:
+    sha256 = hashlib.sha256()
+    with open( path, 'rb' ) as fp:
+        for block in iter( lambda: fp.read( block_size ), b'' ):
+            sha256.update( block )
+    return sha256.hexdigest()
+
+def limit_columns( counts: sp.csr_matrix, max_df ) -> np.ndarray:
+    '''
+    Columns (terms) of the token counts that a CountVectorizer with max_df (and min_df=1) fitted on these documents would keep.
+    '''
+    document_frequencies = np.bincount( counts.indices, minlength=counts.shape[1] )
+    max_doc_count = max_df if isinstance( max_df, numbers.Integral ) else max_df * counts.shape[0]
+    return np.flatnonzero( ( document_frequencies >= 1 ) & ( document_frequencies <= max_doc_count ) )
+
+class CorpusCache:
+    '''
+    Cache of the training data, see the module docstring. Every item is computed the first time it is requested.
+    '''
+    def __init__(self, cache_dir: str, input_file: str, settings: dict ):
+        '''
+        :param cache_dir: directory of the cache
+        :type cache_dir: str
+        :param input_file: training data (.tsv or .parquet file, directory, glob pattern or list, see training_data.py)
+        :type input_file: str
+        :param settings: preprocessing and vectorizer settings ( remove_punctuation_numbers, stop_words, n_splits )
+        :type settings: dict
+        '''
+        self.settings = dict( settings, sklearn_version=sklearn.__version__ )
+        key = hashlib.sha256( ( ''.join( file_hash( file ) for file in training_data_files( input_file ) ) + json.dumps( self.settings, sort_keys=True ) ).encode() ).hexdigest()[:32]
+        self.path = os.path.join( cache_dir, key )
+        os.makedirs( self.path, exist_ok=True )
+
+    def _cached(self, name: str, build: Callable, save: Callable, load: Callable ):
+        path = os.path.join( self.path, name )
+        if os.path.isfile( path ):
+            return load( path )
+        value = build()
+        os.makedirs( os.path.dirname( path ), exist_ok=True )
+        #write to a temporary file, so that an interrupted run does not leave an incomplete item in the cache
+        with open( path + '.part', 'wb' ) as fp:
+            save( fp, value )
+        os.replace( path + '.part', path )
+        return value
+
+    def corpus(self, load_corpus: Callable[ [], Tuple[ List[str], List[int] ] ] ) -> Tuple[ List[str], List[int] ]:
+        '''
+        The cleaned documents and labels, load_corpus() reads and cleans them if they are not in the cache.
+        '''
+        corpus = []
+        def get( index ):
+            if not corpus:
+                corpus.extend( load_corpus() )
+            return corpus[ index ]
+        texts = self._cached( 'texts.pkl', lambda: get( 0 ), lambda fp, value: pickle.dump( value, fp ), lambda path: pickle.load( open( path, 'rb' ) ) )
+        labels = self._cached( 'labels.npy', lambda: np.array( get( 1 ) ), np.save, np.load )
+        return texts, labels.tolist()
+
+    def counts(self, texts: List[str] ) -> Tuple[ sp.csr_matrix, np.ndarray ]:
+        '''
+        Token counts of the whole corpus and the (sorted) terms, without stop words.
+        '''
+        vectorizer = CountVectorizer( stop_words=self.settings[ 'stop_words' ] )
+        def build_terms():
+            if not hasattr( vectorizer, 'vocabulary_' ):
+                vectorizer.fit( texts )
+            return np.array( sorted( vectorizer.vocabulary_, key=vectorizer.vocabulary_.get ) )
+        counts = self._cached( 'counts.npz', lambda: vectorizer.fit_transform( texts ).tocsr(), sp.save_npz, sp.load_npz )
+        terms = self._cached( 'terms.npy', build_terms, np.save, np.load )
+        return counts.tocsr(), terms
+
+    def folds(self, labels: List[int] ) -> List[ Tuple[ np.ndarray, np.ndarray ] ]:
+        '''
+        Train and test indices of the (stratified) cross validation folds, as used by GridSearchCV( cv=n_splits ).
+        '''
+        def build():
+            splits = check_cv( self.settings[ 'n_splits' ], labels, classifier=True ).split( np.zeros( len( labels ) ), labels )
+            return { f'{part}_{i}': indices for i, split in enumerate( splits ) for part, indices in zip( ( 'train', 'test' ), split ) }
+        folds = self._cached( 'folds.npz', build, lambda fp, value: np.savez( fp, **value ), lambda path: dict( np.load( path ) ) )
+        return [ ( folds[ f'train_{i}' ], folds[ f'test_{i}' ] ) for i in range( self.settings[ 'n_splits' ] ) ]
+
+    def shared(self, name: str, matrix: sp.csr_matrix ) -> sp.csr_matrix:
+        '''
+        The matrix, backed by memory mapped .npy files in the cache. joblib passes memory mapped arrays to its worker
+        processes by file name, so the workers share one copy of the matrix instead of receiving a pickled copy per task.
+        '''
+        parts = []
+        for part in ( 'data', 'indices', 'indptr' ):
+            self._cached( os.path.join( 'shared', f'{name}_{part}.npy' ), lambda: getattr( matrix, part ), np.save, lambda path: None )
+            parts.append( np.load( os.path.join( self.path, 'shared', f'{name}_{part}.npy' ), mmap_mode='r' ) )
+        return sp.csr_matrix( tuple( parts ), shape=matrix.shape )
+
+    def fold_counts(self, counts: sp.csr_matrix, folds: List[ Tuple[ np.ndarray, np.ndarray ] ], max_df, shared: bool=False ) -> List[ Tuple[ sp.csr_matrix, sp.csr_matrix ] ]:
+        '''
+        Token counts of the training and test part of every fold, restricted to the vocabulary of a vectorizer with max_df fitted on the training part.
+        With shared, the counts are memory mapped (see shared).
+        '''
+        fold_counts = []
+        for i, ( train, test ) in enumerate( folds ):
+            name = os.path.join( f'max_df_{max_df}', f'fold_{i}' )
+            columns = self._cached( f'{name}_columns.npy', lambda: limit_columns( counts[ train ], max_df ), np.save, np.load )
+            X_train = self._cached( f'{name}_train.npz', lambda: counts[ train ][ :, columns ], sp.save_npz, sp.load_npz )
+            X_test = self._cached( f'{name}_test.npz', lambda: counts[ test ][ :, columns ], sp.save_npz, sp.load_npz )
+            X_train, X_test = X_train.tocsr(), X_test.tocsr()
+            if shared:
+                X_train, X_test = self.shared( f'{name}_train', X_train ), self.shared( f'{name}_test', X_test )
+            fold_counts.append( ( X_train, X_test ) )
+        return fold_counts
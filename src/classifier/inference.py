@@ -6,13 +6,15 @@ from base64 import b64encode, b64decode
 import pandas as pd
 import numpy as np
 
+from model_export import load_model
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--model_path", dest="model_path",
-                        help="path to the classfier (python pickle format)", required=True)
+                        help="path to the classfier (python pickle format, or directory of a model compiled with model_export.py)", required=True)
     args = parser.parse_args()
     
-    clf = pickle.load( open(  args.model_path  , "rb" ) )
+    clf = load_model( args.model_path )
 
     document=input()
     print( clf.predict( [document]   )[0] )
@@ -0,0 +1,299 @@
+'''
+Compilation of a trained classifier ( TfidfVectorizer -> SelectFromModel -> CalibratedClassifierCV pipeline, see train.py )
+into a compact form that is evaluated with NumPy/SciPy only:
+
+- the vocabulary as a sorted array of utf-8 encoded terms, with for every term its idf and its column after feature selection
+  ( -1 if the term is not selected; these terms are still needed for the l2 normalization ),
+- the weights of the LinearSVC of every calibration fold, stacked in one ( n_selected_features x n_folds ) matrix,
+- the intercept and the sigmoid parameters of every fold.
+
+A compiled model is saved as flat .npy files and loaded with np.load( mmap_mode='r' ), so that several processes serving
+the same model share one copy of it in the page cache, and no large python dictionary has to be unpickled at start up.
+'''
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import re
+import sys
+from collections import Counter
+from typing import Iterable, List
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.special import expit
+
+from preprocessing import NORMALIZER_STEP, Normalizer, TokenCounter
+
+FORMAT_VERSION = 2
+
+def _calibrated_parts( calibrated_classifier ):
+    '''
+    Yields ( LinearSVC, sigmoid calibrator ) for each of the cross validation folds of a fitted CalibratedClassifierCV.
+    '''
+    for calibrated in calibrated_classifier.calibrated_classifiers_:
+        base_estimator = getattr( calibrated, 'base_estimator', None )
+        if base_estimator is None:
+            #scikit-learn >= 1.2
+            base_estimator = calibrated.estimator
+        calibrators = getattr( calibrated, 'calibrators_', None )
+        if calibrators is None:
+            #scikit-learn >= 0.24
+            calibrators = calibrated.calibrators
+        yield base_estimator, calibrators[0]
+
+def _check_supported( vectorizer, calibrated_classifier ):
+    if not hasattr( vectorizer, 'vocabulary_' ):
+        raise ValueError( "Only pipelines with a fitted TfidfVectorizer can be compiled (not the hashing models of streaming_train.py)." )
+    if vectorizer.analyzer != 'word' or tuple( vectorizer.ngram_range ) != ( 1, 1 ):
+        raise ValueError( "Only word unigram vectorizers can be compiled." )
+    if vectorizer.tokenizer is not None or vectorizer.preprocessor is not None or vectorizer.strip_accents is not None:
+        raise ValueError( "Vectorizers with a custom tokenizer, preprocessor or accent stripping can not be compiled." )
+    if vectorizer.binary or vectorizer.norm != 'l2':
+        raise ValueError( "Only vectorizers with binary=False and norm='l2' can be compiled." )
+    if calibrated_classifier.method != 'sigmoid' or len( calibrated_classifier.classes_ ) != 2:
+        raise ValueError( "Only binary classifiers with sigmoid calibration can be compiled." )
+
+def compile_model( model ):
+    '''
+    Compiles a fitted pipeline into a CompiledModel with the same predict_proba output.
+
+    :param model: fitted Pipeline with steps 'normalizer' (optional), 'vectorizer', 'feature_selection' (optional) and 'classification'
+    :type model: sklearn.pipeline.Pipeline
+    :return: compiled model
+    :rtype: CompiledModel
+    '''
+    normalizer = model.named_steps.get( NORMALIZER_STEP )
+    vectorizer = model.named_steps[ 'vectorizer' ]
+    feature_selection = model.named_steps.get( 'feature_selection' )
+    calibrated_classifier = model.named_steps[ 'classification' ]
+    _check_supported( vectorizer, calibrated_classifier )
+
+    #terms are sorted on their utf-8 encoding, so they can be looked up with np.searchsorted
+    terms = sorted( vectorizer.vocabulary_, key=lambda term: term.encode( 'utf-8' ) )
+    encoded_terms = [ term.encode( 'utf-8' ) for term in terms ]
+    width = max( len( term ) for term in encoded_terms )
+    columns = np.array( [ vectorizer.vocabulary_[ term ] for term in terms ], dtype=np.int64 )
+
+    n_features = len( terms )
+    if vectorizer.use_idf:
+        idf = np.asarray( vectorizer.idf_, dtype=np.float64 )
+    else:
+        idf = np.ones( n_features, dtype=np.float64 )
+
+    if feature_selection is not None:
+        support = feature_selection.get_support()
+    else:
+        support = np.ones( n_features, dtype=bool )
+    selected_columns = np.full( n_features, -1, dtype=np.int32 )
+    selected_columns[ support ] = np.arange( support.sum(), dtype=np.int32 )
+
+    parts = list( _calibrated_parts( calibrated_classifier ) )
+
+    arrays = {
+        'vocabulary': np.array( encoded_terms, dtype=f'S{width}' ),
+        'idf': idf[ columns ],
+        'selected': selected_columns[ columns ],
+        'weights': np.column_stack( [ estimator.coef_.ravel() for estimator, _ in parts ] ),
+        'intercept': np.array( [ np.ravel( estimator.intercept_ )[0] for estimator, _ in parts ] ),
+        'calibration': np.array( [ [ calibrator.a_, calibrator.b_ ] for _, calibrator in parts ] ),
+    }
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'lowercase': bool( vectorizer.lowercase ),
+        'token_pattern': vectorizer.token_pattern,
+        'sublinear_tf': bool( vectorizer.sublinear_tf ),
+        'classes': calibrated_classifier.classes_.tolist(),
+    }
+    if normalizer is not None:
+        meta[ 'remove_punctuation_numbers' ] = bool( normalizer.remove_punctuation_numbers )
+        meta[ 'max_length' ] = int( normalizer.max_length ) if normalizer.max_length else None
+        meta[ 'length_policy' ] = normalizer.length_policy
+    return CompiledModel( arrays, meta )
+
+class CompiledModel:
+    '''
+    Classifier compiled with compile_model. predict_proba gives the same output as predict_proba of the compiled pipeline,
+    without scikit-learn and without building the full tf-idf matrix.
+    '''
+    ARRAYS = [ 'vocabulary', 'idf', 'selected', 'weights', 'intercept', 'calibration' ]
+
+    def __init__(self, arrays: dict, meta: dict ):
+        if meta[ 'format_version' ] != FORMAT_VERSION:
+            raise ValueError( f"Unsupported format version {meta[ 'format_version' ]} of compiled model, compile the model again." )
+        self.meta = meta
+        self.vocabulary = arrays[ 'vocabulary' ]
+        self.idf = arrays[ 'idf' ]
+        self.selected = arrays[ 'selected' ]
+        self.weights = arrays[ 'weights' ]
+        self.intercept = arrays[ 'intercept' ]
+        self.calibration = arrays[ 'calibration' ]
+
+        self.lowercase = meta[ 'lowercase' ]
+        self.token_pattern = re.compile( meta[ 'token_pattern' ] )
+        self.sublinear_tf = meta[ 'sublinear_tf' ]
+        self.classes_ = np.array( meta[ 'classes' ] )
+        #normalization of the pipeline the model was compiled from (models compiled before it was part of the pipeline have none)
+        if 'remove_punctuation_numbers' in meta:
+            self.normalizer = Normalizer( remove_punctuation_numbers=meta[ 'remove_punctuation_numbers' ],
+                                          max_length=meta.get( 'max_length' ), length_policy=meta.get( 'length_policy', 'truncate' ) )
+        else:
+            self.normalizer = None
+        self._max_term_length = self.vocabulary.dtype.itemsize
+
+    def save(self, output_dir: str ):
+        os.makedirs( output_dir, exist_ok=True )
+        for name in self.ARRAYS:
+            np.save( os.path.join( output_dir, f'{name}.npy' ), getattr( self, name ) )
+        with open( os.path.join( output_dir, 'meta.json' ), 'w' ) as fp:
+            json.dump( self.meta, fp, indent=2 )
+
+    @classmethod
+    def load(cls, model_dir: str, mmap_mode: str='r' ):
+        with open( os.path.join( model_dir, 'meta.json' ) ) as fp:
+            meta = json.load( fp )
+        arrays = { name: np.load( os.path.join( model_dir, f'{name}.npy' ), mmap_mode=mmap_mode ) for name in cls.ARRAYS }
+        return cls( arrays, meta )
+
+    def _lookup(self, tokens: List[str] ):
+        '''
+        Returns the positions in the vocabulary of the tokens that are in the vocabulary, and a mask of these tokens.
+        '''
+        encoded = [ token.encode( 'utf-8' ) for token in tokens ]
+        #longer tokens can not be in the vocabulary (and would be truncated by numpy)
+        fits = np.array( [ len( token ) <= self._max_term_length for token in encoded ], dtype=bool )
+        keys = np.array( [ token if fit else b'' for token, fit in zip( encoded, fits ) ], dtype=self.vocabulary.dtype )
+        positions = np.minimum( np.searchsorted( self.vocabulary, keys ), len( self.vocabulary ) - 1 )
+        found = fits & ( self.vocabulary[ positions ] == keys )
+        return positions[ found ], found
+
+    def transform(self, raw_documents: List[str] ) -> sp.csr_matrix:
+        '''
+        Tf-idf features of the documents after feature selection ( n_documents x n_selected_features ).
+        '''
+        if self.normalizer is not None:
+            raw_documents = self.normalizer.transform( raw_documents )
+        return self.transform_counts( Counter( self.token_pattern.findall( document.lower() if self.lowercase else document ) )
+                                      for document in raw_documents )
+
+    def token_counter(self) -> TokenCounter:
+        '''
+        Counts the tokens of a (normalized) document received in pieces, for transform_counts.
+        '''
+        return TokenCounter( self.token_pattern, self.lowercase, self._max_term_length )
+
+    def transform_counts(self, documents_counts: Iterable[Counter] ) -> sp.csr_matrix:
+        '''
+        Same as transform, for documents given as token counts.
+        '''
+        indptr = [ 0 ]
+        indices = []
+        data = []
+        for counts in documents_counts:
+            if not counts:
+                indptr.append( indptr[-1] )
+                continue
+
+            positions, found = self._lookup( list( counts ) )
+            values = np.fromiter( counts.values(), dtype=np.float64, count=len( counts ) )[ found ]
+            if self.sublinear_tf:
+                values = np.log( values ) + 1
+            values *= self.idf[ positions ]
+
+            #l2 normalization over the full vocabulary, before feature selection
+            norm = np.sqrt( np.dot( values, values ) )
+            if norm > 0.0:
+                values /= norm
+
+            columns = self.selected[ positions ]
+            kept = columns >= 0
+            indices.append( columns[ kept ] )
+            data.append( values[ kept ] )
+            indptr.append( indptr[-1] + int( kept.sum() ) )
+
+        return sp.csr_matrix( ( np.concatenate( data ) if data else np.zeros( 0 ),
+                                np.concatenate( indices ) if indices else np.zeros( 0, dtype=np.int32 ),
+                                indptr ), shape=( len( indptr ) - 1, self.weights.shape[0] ) )
+
+    def decision_function(self, raw_documents: List[str] ) -> np.ndarray:
+        '''
+        Decision values of each of the calibrated LinearSVC's ( n_documents x n_folds ).
+        '''
+        return self.transform( raw_documents ) @ np.asarray( self.weights ) + self.intercept
+
+    def predict_proba(self, raw_documents: List[str] ) -> np.ndarray:
+        return self.predict_proba_transformed( self.transform( raw_documents ) )
+
+    def predict_proba_transformed(self, X: sp.csr_matrix ) -> np.ndarray:
+        '''
+        Probabilities of documents already transformed with transform.
+        '''
+        decision = X @ np.asarray( self.weights ) + self.intercept
+        #sigmoid calibration of every fold, averaged over the folds (as CalibratedClassifierCV does)
+        positive = expit( -( self.calibration[ :, 0 ] * decision + self.calibration[ :, 1 ] ) ).mean( axis=1 )
+        return np.column_stack( [ 1.0 - positive, positive ] )
+
+    def predict(self, raw_documents: List[str] ) -> np.ndarray:
+        return self.classes_[ self.predict_proba( raw_documents ).argmax( axis=1 ) ]
+
+def export_model( model, output_dir: str ):
+    '''
+    Compiles a fitted pipeline and saves it to output_dir.
+    '''
+    compile_model( model ).save( output_dir )
+
+def check_parity( model, compiled_model: CompiledModel, documents: List[str] ) -> float:
+    '''
+    Returns the maximum absolute difference between the probabilities predicted by the pipeline and by the compiled model.
+    '''
+    return float( np.abs( model.predict_proba( documents ) - compiled_model.predict_proba( documents ) ).max() )
+
+def model_version( path: str ) -> str:
+    '''
+    Version of a saved model: hash of the content of the model file, or of the files of a compiled model (directory).
+    '''
+    if os.path.isdir( path ):
+        files = [ os.path.join( path, name ) for name in sorted( os.listdir( path ) ) ]
+    else:
+        files = [ path ]
+    sha256 = hashlib.sha256()
+    for file in files:
+        with open( file, 'rb' ) as fp:
+            for block in iter( lambda: fp.read( 1 << 20 ), b'' ):
+                sha256.update( block )
+    return sha256.hexdigest()[:16]
+
+def load_model( path: str, mmap_mode: str='r' ):
+    '''
+    Loads a compiled model (directory), or a pickled scikit-learn model (file).
+    '''
+    if os.path.isdir( path ):
+        return CompiledModel.load( path, mmap_mode=mmap_mode )
+    with open( path, "rb" ) as fp:
+        return pickle.load( fp )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", dest="model_path",
+                        help="path to the classfier (python pickle format)", required=True)
+    parser.add_argument("--output_dir", dest="output_dir",
+                        help="directory where the compiled model will be written to", required=True)
+    parser.add_argument("--check_file", dest="check_file",
+                        help="optional test data (tsv or parquet file, directory, glob pattern or comma separated list of files, see training_data.py) to verify that the compiled model predicts the same probabilities", required=False)
+    parser.add_argument("--tolerance", dest="tolerance", type=float, default=1e-9,
+                        help="maximum allowed difference between the probabilities of the pipeline and the compiled model")
+    args = parser.parse_args()
+
+    from training_data import read_training_data
+
+    model = pickle.load( open( args.model_path, "rb" ) )
+    compiled_model = compile_model( model )
+    compiled_model.save( args.output_dir )
+
+    if args.check_file:
+        documents, _ = read_training_data( args.check_file )
+        difference = check_parity( model, CompiledModel.load( args.output_dir ), documents )
+        print( f"maximum difference in predicted probabilities on {len( documents )} documents: {difference}" )
+        if difference > args.tolerance:
+            sys.exit( "the compiled model does not reproduce the predictions of the pipeline" )
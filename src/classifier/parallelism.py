@@ -0,0 +1,165 @@
+'''
+Parallelism plan of the grid search of train.py.
+
+The grid search evaluates a task for every candidate and cross validation fold, every task fits a
+CalibratedClassifierCV that fits a LinearSVC for each of its calibration folds, and every process may start a BLAS
+thread per core. Parallelizing all of these levels at once starts many more threads than there are cores.
+plan_parallelism gives the process pool to one level only (the search tasks, or the calibration folds), and limits the
+BLAS threads of every process so that processes x threads does not exceed the available cores.
+
+CoreUtilization measures the cpu time of the training process and its worker processes, to log the achieved core
+utilization.
+'''
+import os
+import time
+from contextlib import contextmanager
+
+from joblib import parallel_backend
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+def available_cores() -> int:
+    '''
+    Number of cores this process may run on (e.g. limited by taskset or a container), not the number of cores of the machine.
+    '''
+    if hasattr( os, 'sched_getaffinity' ):
+        return len( os.sched_getaffinity( 0 ) )
+    return os.cpu_count() or 1
+
+def n_cores( jobs: int ) -> int:
+    '''
+    Number of cores to use for a JOBS setting, as joblib interprets n_jobs: -1 is all available cores, -2 all but one, ...
+    '''
+    cores = available_cores()
+    if not jobs:
+        return 1
+    if jobs < 0:
+        return max( 1, cores + 1 + jobs )
+    return min( jobs, cores )
+
+class ParallelismPlan:
+    '''
+    Number of processes of the search tasks ( search_jobs ) and of the calibration folds ( calibration_jobs ), of which
+    at most one is larger than 1, and number of BLAS threads per process ( blas_threads ).
+    '''
+    def __init__(self, n_cores: int, level: str, search_jobs: int, calibration_jobs: int, blas_threads: int ):
+        self.n_cores = n_cores
+        self.level = level
+        self.search_jobs = search_jobs
+        self.calibration_jobs = calibration_jobs
+        self.blas_threads = blas_threads
+
+    def to_dict(self) -> dict:
+        return dict( vars( self ) )
+
+    def __str__(self):
+        return ( f"{self.n_cores} cores: process pool for the {self.level} ({self.search_jobs} search processes, "
+                 f"{self.calibration_jobs} calibration processes), {self.blas_threads} BLAS threads per process" )
+
+def plan_parallelism( jobs: int, n_search_tasks: int, n_calibration_folds: int, calibration_parallel: bool ) -> ParallelismPlan:
+    '''
+    Gives the process pool to the level that can use the most cores: the search tasks ( candidates x cross validation folds ),
+    or the calibration folds of CalibratedClassifierCV (only if it has n_jobs, scikit-learn >= 0.24). The cores that
+    the processes can not use go to the BLAS threads.
+
+    :param jobs: JOBS setting of train.config ( n_jobs )
+    :type jobs: int
+    :param n_search_tasks: number of tasks of the search that can run in parallel
+    :type n_search_tasks: int
+    :param n_calibration_folds: number of calibration folds ( cv ) of the CalibratedClassifierCV
+    :type n_calibration_folds: int
+    :param calibration_parallel: whether the CalibratedClassifierCV can fit its folds in parallel
+    :type calibration_parallel: bool
+    :return: plan
+    :rtype: ParallelismPlan
+    '''
+    cores = n_cores( jobs )
+    search_jobs = max( 1, min( cores, n_search_tasks ) )
+    calibration_jobs = max( 1, min( cores, n_calibration_folds ) ) if calibration_parallel else 1
+    if cores == 1:
+        return ParallelismPlan( cores, 'none', 1, 1, 1 )
+    if search_jobs >= calibration_jobs:
+        return ParallelismPlan( cores, 'search', search_jobs, 1, max( 1, cores // search_jobs ) )
+    return ParallelismPlan( cores, 'calibration', 1, calibration_jobs, max( 1, cores // calibration_jobs ) )
+
+@contextmanager
+def limit_threads( plan: ParallelismPlan ):
+    '''
+    Limits the BLAS threads of this process (with threadpoolctl, if it is installed) and of the joblib worker processes
+    started within the context to plan.blas_threads.
+    '''
+    with parallel_backend( 'loky', inner_max_num_threads=plan.blas_threads ):
+        if threadpool_limits is None:
+            yield
+        else:
+            with threadpool_limits( limits=plan.blas_threads ):
+                yield
+
+def _process_tree_cpu_seconds():
+    '''
+    Cpu time (user and system) of this process and of its (living) descendant processes, read from /proc. None if
+    /proc is not available.
+    '''
+    if not os.path.isdir( '/proc/self' ):
+        return None
+    clock_ticks = os.sysconf( 'SC_CLK_TCK' )
+    parents = {}
+    ticks = {}
+    for name in os.listdir( '/proc' ):
+        if not name.isdigit():
+            continue
+        try:
+            with open( f'/proc/{name}/stat' ) as fp:
+                #the fields after the command name, which may contain spaces
+                fields = fp.read().rsplit( ')', 1 )[1].split()
+        except OSError:
+            continue
+        parents[ int( name ) ] = int( fields[1] )
+        ticks[ int( name ) ] = int( fields[11] ) + int( fields[12] )
+
+    tree = { os.getpid() }
+    added = True
+    while added:
+        children = { pid for pid, parent in parents.items() if parent in tree } - tree
+        tree |= children
+        added = bool( children )
+    return sum( ticks.get( pid, 0 ) for pid in tree ) / clock_ticks
+
+class CoreUtilization:
+    '''
+    Context that measures the wall-clock time and the cpu time of this process and its worker processes, and the
+    fraction of n_cores x wall-clock time that was used. Without /proc (e.g. on macOS), only the cpu time of this process is measured.
+    '''
+    def __init__(self, n_cores: int ):
+        self.n_cores = n_cores
+        self.wall_seconds = None
+        self.cpu_seconds = None
+
+    def __enter__(self):
+        self._start_cpu = _process_tree_cpu_seconds()
+        self._start_process_cpu = time.process_time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info ):
+        self.wall_seconds = time.perf_counter() - self._start
+        end_cpu = _process_tree_cpu_seconds()
+        if self._start_cpu is None or end_cpu is None:
+            self.cpu_seconds = time.process_time() - self._start_process_cpu
+        else:
+            self.cpu_seconds = end_cpu - self._start_cpu
+        return False
+
+    @property
+    def utilization(self) -> float:
+        return self.cpu_seconds / ( self.wall_seconds * self.n_cores ) if self.wall_seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return { 'wall_seconds': self.wall_seconds, 'cpu_seconds': self.cpu_seconds, 'n_cores': self.n_cores, 'utilization': self.utilization }
+
+    def __str__(self):
+        return ( f"{self.wall_seconds:.1f}s wall-clock, {self.cpu_seconds:.1f}s cpu on {self.n_cores} cores: "
+                 f"{self.utilization:.0%} core utilization" )
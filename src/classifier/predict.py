@@ -1,12 +1,8 @@
 import os
 import argparse
-import pickle
-from base64 import b64encode, b64decode
-import pandas as pd
-import numpy as np
+import time
 
-def size_mb(docs):
-    return sum(len(s.encode('utf-8')) for s in docs) / 1e6
+from batch_predict import CHUNK_SIZE, iter_line_chunks, predict_chunks, write_predictions
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -14,39 +10,30 @@ if __name__ == "__main__":
     parser.add_argument("--filename", dest="filename",
                         help="path to the test data (file with at each line a base64 encoded document", required=True)
     parser.add_argument("--model_path", dest="model_path",
-                        help="path to the classfier (python pickle format)", required=True)
+                        help="path to the classfier (python pickle format, or directory of a model compiled with model_export.py)", required=True)
     parser.add_argument("--output_file", dest="output_file",
                         help="output file with predicted labels", required=True)
+    parser.add_argument("--workers", dest="workers", type=int, default=None,
+                        help="number of worker processes (default: number of cpu's)")
+    parser.add_argument("--chunk_size", dest="chunk_size", type=int, default=CHUNK_SIZE,
+                        help="number of documents predicted at once by a worker")
     args = parser.parse_args()
-    
-    test_data=open( args.filename , 'r'  ).read().rstrip("\n").split("\n")
-    
+
     remove_punctuation_numbers=True
-    
+
     if remove_punctuation_numbers:
         print( "Removing punctuation and numbers" )
-        test_data=[ b64decode( doc ).decode().translate(str.maketrans('', '', string.punctuation+'0123456789'  )) for doc in test_data  ]
-        
-    else:
-        test_data=[ b64decode( doc ).decode() for doc in test_data  ]
-    
-    data_test_size_mb = size_mb(test_data)
-
-    print("%d documents - %0.3fMB (test set)" % (
-        len(test_data), data_test_size_mb))
-    print()
-    
-    #load the classifier 
-
-    clf = pickle.load( open(  args.model_path  , "rb" ) )
-
-    #classify with the classifier
-    
-    pred=clf.predict( test_data  )
-    pred_proba=clf.predict_proba( test_data )
 
     os.makedirs(  os.path.dirname( args.output_file ) , exist_ok=True  )
-    
+
+    #classify the documents in chunks, with a pool of workers that each load the classifier once
+
+    start=time.time()
+    n_documents=0
     with open(  args.output_file ,  "w"  ) as fp:
-        for pred_label, pred_proba_label in zip(pred, pred_proba):
-            fp.write( f"{pred_label} {pred_proba_label}\n"     )
+        for pred, pred_proba in predict_chunks( iter_line_chunks( args.filename, args.chunk_size ), args.model_path, workers=args.workers,
+                                                decode=True, remove_punctuation_numbers=remove_punctuation_numbers ):
+            write_predictions( fp, pred, pred_proba )
+            n_documents+=len( pred )
+
+    print( "%d documents classified in %0.1fs" % ( n_documents, time.time()-start ) )
@@ -0,0 +1,306 @@
+'''
+Decoding and normalization of the documents, shared by training (train.py, streaming_train.py), evaluation and
+prediction (test.py, predict.py) and the app.
+
+The normalization (length policy and removal of punctuation and numbers) is part of the saved model: train.py puts a
+TextNormalizer (text_normalizer.py) as first step of the pipeline, and model_export.py stores its settings in the
+compiled model (as a Normalizer), so that a model is always applied to documents normalized as its training documents
+were. This module does not import scikit-learn, so that compiled models can be served without it.
+
+The length policy bounds the cost of very long documents (e.g. acts with large annexes): documents longer than
+max_length characters are cut to their first max_length characters ('truncate'), or to about their first and last
+max_length / 2 characters ('head_tail'). Applying the policy twice gives the same document as applying it once. decode_bounded only decodes the parts of a base64 encoded document that the
+length policy keeps.
+
+StreamDecoder and TokenCounter decode, normalize and tokenize a document received in chunks (e.g. the body of a
+request), keeping about one chunk of it in memory.
+'''
+import binascii
+import codecs
+import re
+import string
+import zlib
+from base64 import b64decode
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional
+
+PUNCTUATION_NUMBERS = string.punctuation + '0123456789'
+
+#deleting the characters with a regular expression is several times faster than str.translate on non ascii text
+PUNCTUATION_NUMBERS_PATTERN = re.compile( '[' + re.escape( PUNCTUATION_NUMBERS ) + ']+' )
+
+#name of the normalization step in the pipeline of a model
+NORMALIZER_STEP = 'normalizer'
+
+LENGTH_POLICIES = ( 'truncate', 'head_tail' )
+
+def _head_tail_lengths( max_length: int, length_policy: str ):
+    if length_policy not in LENGTH_POLICIES:
+        raise ValueError( f"Unknown length policy {length_policy}, expected one of {', '.join( LENGTH_POLICIES )}." )
+    if length_policy == 'truncate' or max_length < 3:
+        return max_length, 0
+    #head, space and tail together are max_length characters long, so that the policy can be applied again (by the model)
+    return max_length - 1 - ( max_length - 1 ) // 2, ( max_length - 1 ) // 2
+
+def apply_length_policy( document: str, max_length: Optional[int]=None, length_policy: str='truncate' ) -> str:
+    '''
+    Cuts a document that is longer than max_length characters, see the module docstring. max_length None (or 0) means no limit.
+    '''
+    if not max_length or len( document ) <= max_length:
+        return document
+    head, tail = _head_tail_lengths( max_length, length_policy )
+    if not tail:
+        return document[ :head ]
+    return document[ :head ] + ' ' + document[ -tail: ]
+
+def normalize( documents: Iterable[str], remove_punctuation_numbers: bool=True, max_length: Optional[int]=None, length_policy: str='truncate' ) -> List[str]:
+    '''
+    Normalizes a batch (list, array or Series) of documents: the length policy is applied first, so that the cost of the
+    normalization is bounded as well.
+    '''
+    if max_length:
+        documents = [ apply_length_policy( document, max_length, length_policy ) for document in documents ]
+    if not remove_punctuation_numbers:
+        return list( documents )
+    sub = PUNCTUATION_NUMBERS_PATTERN.sub
+    return [ sub( '', document ) for document in documents ]
+
+def decode( encoded_documents: Iterable[str] ) -> List[str]:
+    '''
+    Decodes a batch of base64 encoded (utf-8) documents. Raises binascii.Error or UnicodeDecodeError if a document can not be decoded.
+    '''
+    return [ b64decode( document ).decode( 'utf-8' ) for document in encoded_documents ]
+
+def _b64_length( n_bytes: int ) -> int:
+    return 4 * ( ( n_bytes + 2 ) // 3 )
+
+def _decode_head( encoded: str ) -> str:
+    '''Decodes the start of a base64 encoded utf-8 document, without the incomplete character at the end.'''
+    data = b64decode( encoded, validate=True )
+    try:
+        return data.decode( 'utf-8' )
+    except UnicodeDecodeError as e:
+        if e.reason != 'unexpected end of data':
+            raise
+        return data[ :e.start ].decode( 'utf-8' )
+
+def _decode_tail( encoded: str ) -> str:
+    '''Decodes the end of a base64 encoded utf-8 document, without the incomplete character at the start.'''
+    data = b64decode( encoded, validate=True )
+    start = 0
+    while start < min( 3, len( data ) ) and data[ start ] & 0xC0 == 0x80:
+        start += 1
+    return data[ start: ].decode( 'utf-8' )
+
+def decode_bounded( encoded_document: str, max_length: Optional[int]=None, length_policy: str='truncate' ) -> str:
+    '''
+    Same as apply_length_policy( decode( [ encoded_document ] )[0], max_length, length_policy ), but only the parts of
+    the document that the length policy keeps are decoded: a character takes at most 4 bytes, so the first ( last )
+    n characters are in the first ( last ) 4n bytes.
+    '''
+    if max_length:
+        head, tail = _head_tail_lengths( max_length, length_policy )
+        head_length = _b64_length( 4 * head )
+        #one more group, for the padding at the end
+        tail_length = _b64_length( 4 * tail ) + 4 if tail else 0
+        #only documents of more than 4 * max_length bytes are certainly longer than max_length characters (and cut)
+        min_length = max( head_length + tail_length, _b64_length( 4 * max_length ) + 4 )
+        if len( encoded_document ) % 4 == 0 and len( encoded_document ) > min_length:
+            try:
+                document = _decode_head( encoded_document[ :head_length ] )[ :head ]
+                if tail:
+                    document += ' ' + _decode_tail( encoded_document[ -tail_length: ] )[ -tail: ]
+                return document
+            except binascii.Error:
+                #not plain base64 (e.g. line breaks), decode the whole document
+                pass
+    return apply_length_policy( decode( [ encoded_document ] )[0], max_length, length_policy )
+
+def decode_and_normalize( encoded_documents: Iterable[str], remove_punctuation_numbers: bool=True ) -> List[str]:
+    return normalize( decode( encoded_documents ), remove_punctuation_numbers )
+
+class Normalizer:
+    '''
+    Normalization of the (decoded) documents with fixed settings, see normalize. TextNormalizer is the pipeline step.
+    '''
+    #defaults of normalizers pickled before the length policy was added
+    max_length = None
+    length_policy = 'truncate'
+
+    def __init__(self, remove_punctuation_numbers: bool=True, max_length: Optional[int]=None, length_policy: str='truncate' ):
+        self.remove_punctuation_numbers = remove_punctuation_numbers
+        self.max_length = max_length
+        self.length_policy = length_policy
+
+    def transform(self, X ) -> List[str]:
+        return normalize( X, self.remove_punctuation_numbers, self.max_length, self.length_policy )
+
+def __getattr__( name: str ):
+    #models pickled before TextNormalizer moved to text_normalizer.py refer to preprocessing.TextNormalizer
+    if name == 'TextNormalizer':
+        from text_normalizer import TextNormalizer
+        return TextNormalizer
+    raise AttributeError( f"module {__name__!r} has no attribute {name!r}" )
+
+def config_normalizer( config ):
+    '''
+    TextNormalizer with the settings of the [TFIDF_PARAMETERS] section of train.config.
+    '''
+    from text_normalizer import TextNormalizer
+
+    parameters = config[ 'TFIDF_PARAMETERS' ]
+    return TextNormalizer( remove_punctuation_numbers=parameters.getboolean( 'REMOVE_PUNCTUATION_NUMBERS' ),
+                           max_length=parameters.getint( 'MAX_DOCUMENT_LENGTH', fallback=0 ) or None,
+                           length_policy=parameters.get( 'LENGTH_POLICY', fallback='truncate' ) )
+
+#maximum number of bytes decompressed at once by StreamDecoder
+DECOMPRESSED_CHUNK_SIZE = 1 << 16
+
+class StreamDecoder:
+    '''
+    Incremental decoding of a utf-8 document (optionally gzip compressed) received in chunks of bytes, with the length
+    policy and normalization of normalize: the pieces of text returned by feed and close together are
+    normalize( [ document ], remove_punctuation_numbers, max_length, length_policy )[0]. Only the pieces, and with the
+    head_tail policy the last max_length / 2 characters, are kept in memory.
+    '''
+    def __init__(self, remove_punctuation_numbers: bool=True, max_length: Optional[int]=None, length_policy: str='truncate', gzip: bool=False ):
+        self.remove_punctuation_numbers = remove_punctuation_numbers
+        self.max_length = max_length or None
+        self._head, self._tail = _head_tail_lengths( max_length, length_policy ) if max_length else ( None, 0 )
+        self._decompressor = zlib.decompressobj( 16 + zlib.MAX_WBITS ) if gzip else None
+        self._decoder = codecs.getincrementaldecoder( 'utf-8' )()
+        self._tail_buffer = ''
+        #number of (decompressed) bytes and of characters decoded so far
+        self.n_bytes = 0
+        self.n_characters = 0
+
+    @property
+    def done(self) -> bool:
+        '''
+        Whether the rest of the document is cut by the length policy, and does not have to be read.
+        '''
+        return self.max_length is not None and not self._tail and self.n_characters >= self._head
+
+    def feed(self, chunk: bytes ) -> Iterator[str]:
+        '''
+        Yields the normalized text of a chunk. Raises zlib.error or UnicodeDecodeError if the chunk can not be decoded.
+        '''
+        if self._decompressor is None:
+            yield self._text( chunk )
+            return
+        #a compressed chunk is decompressed in parts, so that its decompressed size does not matter
+        while chunk and not self._decompressor.eof and not self.done:
+            yield self._text( self._decompressor.decompress( chunk, DECOMPRESSED_CHUNK_SIZE ) )
+            chunk = self._decompressor.unconsumed_tail
+
+    def close(self) -> str:
+        '''
+        Returns the last normalized text of the document. Raises zlib.error or UnicodeDecodeError if the document is incomplete.
+        '''
+        if self.done:
+            return ''
+        if self._decompressor is not None and not self._decompressor.eof:
+            raise zlib.error( "incomplete gzip stream" )
+        text = self._limit( self._decoder.decode( b'', final=True ) )
+        if self._tail_buffer:
+            if self.n_characters <= self.max_length:
+                #the document is not cut, the buffer holds the rest of it
+                text += self._tail_buffer
+            else:
+                text += ' ' + self._tail_buffer[ -self._tail: ]
+        return self._normalize( text )
+
+    def _text(self, data: bytes ) -> str:
+        self.n_bytes += len( data )
+        return self._normalize( self._limit( self._decoder.decode( data ) ) )
+
+    def _limit(self, text: str ) -> str:
+        '''
+        The part of the text that belongs to the head of the document, the rest is kept in the tail buffer.
+        '''
+        start = self.n_characters
+        self.n_characters += len( text )
+        if self.max_length is None:
+            return text
+        head = text[ :max( self._head - start, 0 ) ]
+        if self._tail and len( head ) < len( text ):
+            #the head, plus a tail of tail + 1 characters, is the whole document if it is not longer than max_length
+            self._tail_buffer = ( self._tail_buffer + text[ len( head ): ][ -( self._tail + 1 ): ] )[ -( self._tail + 1 ): ]
+        return head
+
+    def _normalize(self, text: str ) -> str:
+        if self.remove_punctuation_numbers:
+            return PUNCTUATION_NUMBERS_PATTERN.sub( '', text )
+        return text
+
+#run of word characters at the start of a string
+_WORD_RUN = re.compile( r'\w*' )
+
+class TokenCounter:
+    '''
+    Incremental tokenization of a document received in pieces of text: counts holds the token counts of the
+    concatenated pieces. Tokens may not contain non word characters (as with the default token pattern of scikit-learn),
+    the last run of word characters of a piece is kept until the next piece. Tokens longer than max_token_length
+    characters may be left out of the counts.
+    '''
+    def __init__(self, token_pattern: re.Pattern, lowercase: bool=True, max_token_length: int=1000 ):
+        self.token_pattern = token_pattern
+        self.lowercase = lowercase
+        self.max_token_length = max_token_length
+        self.counts = Counter()
+        self._carry = ''
+        self._skipping = False
+
+    def feed(self, text: str ):
+        if self._skipping:
+            #rest of a run of word characters that is too long to be counted
+            skipped = _WORD_RUN.match( text ).end()
+            if skipped == len( text ):
+                return
+            text = text[ skipped: ]
+            self._skipping = False
+        text = self._carry + text
+        split = len( text ) - _WORD_RUN.match( text[ ::-1 ] ).end()
+        self._carry = text[ split: ]
+        if len( self._carry ) > self.max_token_length:
+            self._carry = ''
+            self._skipping = True
+        self._count( text[ :split ] )
+
+    def close(self) -> Counter:
+        self._count( self._carry )
+        self._carry = ''
+        return self.counts
+
+    def _count(self, text: str ):
+        if self.lowercase:
+            text = text.lower()
+        self.counts.update( self.token_pattern.findall( text ) )
+
+def model_normalizer( model ):
+    '''
+    The normalization of a model: the TextNormalizer step of a pipeline, or of the pipeline a model was compiled from.
+    None for models saved without normalization step, to which the documents have to be passed normalized.
+    '''
+    named_steps = getattr( model, 'named_steps', None )
+    if named_steps is not None:
+        return named_steps.get( NORMALIZER_STEP )
+    return getattr( model, 'normalizer', None )
+
+def decode_for( model, encoded_document: str ) -> str:
+    '''
+    Decodes a base64 encoded document for a model, only the part of it that the length policy of the model keeps.
+    '''
+    normalizer = model_normalizer( model )
+    if normalizer is None:
+        return decode( [ encoded_document ] )[0]
+    return decode_bounded( encoded_document, normalizer.max_length, normalizer.length_policy )
+
+def normalize_for( model, documents: Iterable[str], remove_punctuation_numbers: bool=True ) -> List[str]:
+    '''
+    Normalizes the documents before they are passed to the model, unless the model normalizes them itself.
+    remove_punctuation_numbers is only used for models saved without normalization step.
+    '''
+    if model_normalizer( model ) is not None:
+        return list( documents )
+    return normalize( documents, remove_punctuation_numbers )
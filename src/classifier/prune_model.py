@@ -0,0 +1,197 @@
+'''
+Pruning of a trained classifier (see train.py) to the features kept by its feature selection.
+
+The TfidfVectorizer of the saved pipeline holds the vocabulary of the whole training set (and the terms it removed,
+in stop_words_), and transforms the documents into the full feature space before SelectFromModel masks it. The pruned
+model has a vectorizer with only the selected terms (in the order of the selected columns) and no
+feature selection step.
+
+As the l2 normalization of the tf-idf vectors is now done over the selected terms only, the calibrated classifier is
+fitted again on the pruned features (with the parameters chosen by the grid search), so the predictions of the pruned
+model are close to, but not exactly, those of the full model. As this refit is done on the training documents, its
+agreement with the full model on them (compare_models) says little about its quality: cross_validate_pruned scores
+the pruned model on the cross validation folds of the grid search, next to the full model, and prune writes both to
+pruning_report.json.
+'''
+import argparse
+import json
+import os
+import pickle
+import time
+from typing import List
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.metrics import f1_score, precision_score, recall_score
+from sklearn.model_selection import check_cv
+from sklearn.pipeline import Pipeline
+
+from preprocessing import normalize_for
+
+#number of documents on which the latency per document is measured
+N_LATENCY_DOCUMENTS = 200
+
+#number of cross validation folds, as in the grid search of train.py
+N_SPLITS = 5
+
+SCORES = { 'f1': f1_score, 'precision': precision_score, 'recall': recall_score }
+
+def prune_model( model: Pipeline, documents: List[str], labels: List[int] ) -> Pipeline:
+    '''
+    Returns the model with its vectorizer pruned to the selected features, and its classifier fitted again on them.
+
+    :param model: fitted Pipeline with steps 'normalizer' (optional), 'vectorizer', 'feature_selection' and 'classification'
+    :type model: sklearn.pipeline.Pipeline
+    :param documents: (decoded) training documents
+    :type documents: List[str]
+    :param labels: labels of the training documents
+    :type labels: List[int]
+    :return: pruned model
+    :rtype: sklearn.pipeline.Pipeline
+    '''
+    if 'feature_selection' not in model.named_steps:
+        raise ValueError( "Only models with a feature selection step can be pruned." )
+    vectorizer = model.named_steps[ 'vectorizer' ]
+    if not hasattr( vectorizer, 'vocabulary_' ):
+        raise ValueError( "Only pipelines with a fitted TfidfVectorizer can be pruned (not the hashing models of streaming_train.py)." )
+    support = model.named_steps[ 'feature_selection' ].get_support()
+
+    #selected terms, in the order of the columns of the feature selection
+    terms = [ None ] * len( support )
+    for term, column in vectorizer.vocabulary_.items():
+        terms[ column ] = term
+    terms = [ term for term, selected in zip( terms, support ) if selected ]
+
+    #with a fixed vocabulary, stop words, max_df and min_df are not needed (and no stop_words_ is kept); the idf of the
+    #terms is fitted on the same documents, so it does not change
+    pruned_vectorizer = clone( vectorizer ).set_params( vocabulary=terms, stop_words=None, max_df=1.0, min_df=1, max_features=None )
+    steps = [ ( name, step ) for name, step in model.steps if name not in ( 'vectorizer', 'feature_selection', 'classification' ) ]
+    X = Pipeline( steps + [ ( 'vectorizer', pruned_vectorizer ) ] ).fit_transform( documents )
+    steps.append( ( 'vectorizer', pruned_vectorizer ) )
+    classification = clone( model.named_steps[ 'classification' ] ).fit( X, labels )
+    return Pipeline( steps + [ ( 'classification', classification ) ] )
+
+def _median_seconds( function, repeats: int ) -> float:
+    times = []
+    for _ in range( repeats ):
+        start = time.perf_counter()
+        function()
+        times.append( time.perf_counter() - start )
+    return float( np.median( times ) )
+
+def cross_validate_pruned( model: Pipeline, documents: List[str], labels: List[int], n_splits: int=N_SPLITS ) -> dict:
+    '''
+    Test scores of the model and of the model pruned to its selected features, on the (stratified) cross validation folds
+    of the grid search: on every fold, the model is fitted on the training part, pruned on the training part, and both
+    are scored on the test part.
+
+    :return: { 'n_splits': n_splits, 'model': scores, 'pruned_model': scores }, with scores mean_test_<score> and std_test_<score> (two standard deviations, as in cross_validation_scores.json) of f1, precision and recall
+    :rtype: dict
+    '''
+    labels = np.asarray( labels )
+    fold_scores = { 'model': { name: [] for name in SCORES }, 'pruned_model': { name: [] for name in SCORES } }
+    for train_index, test_index in check_cv( n_splits, labels, classifier=True ).split( documents, labels ):
+        train_documents = [ documents[ i ] for i in train_index ]
+        test_documents = [ documents[ i ] for i in test_index ]
+        fold_model = clone( model ).fit( train_documents, labels[ train_index ] )
+        fold_models = { 'model': fold_model, 'pruned_model': prune_model( fold_model, train_documents, labels[ train_index ] ) }
+        for name, fold_model in fold_models.items():
+            predictions = fold_model.predict( test_documents )
+            for score, function in SCORES.items():
+                fold_scores[ name ][ score ].append( function( labels[ test_index ], predictions ) )
+
+    report = { 'n_splits': n_splits }
+    for name, scores in fold_scores.items():
+        report[ name ] = {}
+        for score, values in scores.items():
+            report[ name ][ f'mean_test_{score}' ] = float( np.mean( values ) )
+            report[ name ][ f'std_test_{score}' ] = float( np.std( values ) * 2 )
+    return report
+
+def compare_models( model_path: str, pruned_model_path: str, documents: List[str], repeats: int=5 ) -> dict:
+    '''
+    Size of the artifact, load time and latency per document of the saved model and of the pruned model, and the
+    agreement of their predictions on the documents (the training documents, on which the pruned model was fitted).
+    '''
+    report = {}
+    models = {}
+    for name, path in ( ( 'model', model_path ), ( 'pruned_model', pruned_model_path ) ):
+        with open( path, 'rb' ) as fp:
+            data = fp.read()
+        models[ name ] = pickle.loads( data )
+        report[ name ] = {
+            'path': path,
+            'size_mb': len( data ) / 1e6,
+            'load_seconds': _median_seconds( lambda: pickle.loads( data ), repeats ),
+            'n_features': len( models[ name ].named_steps[ 'vectorizer' ].vocabulary_ ),
+        }
+        latency_documents = documents[ :N_LATENCY_DOCUMENTS ]
+        report[ name ][ 'latency_ms_per_document' ] = 1000 * _median_seconds(
+            lambda: [ models[ name ].predict_proba( [ document ] ) for document in latency_documents ], repeats ) / max( len( latency_documents ), 1 )
+
+    probabilities = models[ 'model' ].predict_proba( documents )
+    pruned_probabilities = models[ 'pruned_model' ].predict_proba( documents )
+    report[ 'n_train_documents' ] = len( documents )
+    report[ 'train_label_agreement' ] = float( np.mean( probabilities.argmax( axis=1 ) == pruned_probabilities.argmax( axis=1 ) ) )
+    report[ 'train_max_probability_difference' ] = float( np.abs( probabilities - pruned_probabilities ).max() )
+    return report
+
+def print_report( report: dict ):
+    for name in ( 'model', 'pruned_model' ):
+        print( f"{name}: {report[ name ][ 'n_features' ]} features, {report[ name ][ 'size_mb' ]:.2f}MB, "
+               f"loaded in {report[ name ][ 'load_seconds' ]:.3f}s, {report[ name ][ 'latency_ms_per_document' ]:.3f}ms per document" )
+    print( f"on the {report[ 'n_train_documents' ]} training documents, the pruned model predicts the same label for {report[ 'train_label_agreement' ]:.2%} of them, "
+           f"maximum difference in probabilities {report[ 'train_max_probability_difference' ]:.4f}" )
+    cross_validation = report.get( 'cross_validation' )
+    if cross_validation:
+        for name in ( 'model', 'pruned_model' ):
+            print( f"{name}: test f1 {cross_validation[ name ][ 'mean_test_f1' ]:0.3f} (+/-{cross_validation[ name ][ 'std_test_f1' ]:0.3f}) "
+                   f"on {cross_validation[ 'n_splits' ]} cross validation folds" )
+        if 'grid_search_mean_test_f1' in cross_validation:
+            print( f"test f1 of the model in the grid search (cross_validation_scores.json): {cross_validation[ 'grid_search_mean_test_f1' ]:0.3f}" )
+
+def prune( model_path: str, documents: List[str], labels: List[int], output_dir: str, n_splits: int=N_SPLITS ) -> dict:
+    '''
+    Prunes the model at model_path, saves it as output_dir/model_pruned.p and writes output_dir/pruning_report.json,
+    with the scores of cross_validate_pruned (unless n_splits is 0) and the test f1 of the grid search, read from the
+    cross_validation_scores.json next to the model.
+    '''
+    with open( model_path, 'rb' ) as fp:
+        model = pickle.load( fp )
+    #documents of models saved without normalization step are normalized as at training time
+    documents = normalize_for( model, documents )
+    pruned_model_path = os.path.join( output_dir, "model_pruned.p" )
+    with open( pruned_model_path, 'wb' ) as fp:
+        pickle.dump( prune_model( model, documents, labels ), fp )
+
+    report = compare_models( model_path, pruned_model_path, documents )
+    if n_splits:
+        print( f"Scoring the pruned model on {n_splits} cross validation folds." )
+        report[ 'cross_validation' ] = cross_validate_pruned( model, documents, labels, n_splits )
+        scores_path = os.path.join( os.path.dirname( os.path.abspath( model_path ) ), "cross_validation_scores.json" )
+        if os.path.isfile( scores_path ):
+            with open( scores_path ) as fp:
+                scores = json.load( fp )
+            report[ 'cross_validation' ][ 'grid_search_mean_test_f1' ] = scores[ 'mean_test_f1' ]
+            report[ 'cross_validation' ][ 'grid_search_std_test_f1' ] = scores[ 'std_test_f1' ]
+    with open( os.path.join( output_dir, "pruning_report.json" ), 'w' ) as fp:
+        json.dump( report, fp, indent=2 )
+    print_report( report )
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", dest="model_path",
+                        help="path to the classfier (python pickle format)", required=True)
+    parser.add_argument("--filename", dest="filename",
+                        help="training data of the classifier (tsv or parquet file, directory, glob pattern or comma separated list of files, see training_data.py)", required=True)
+    parser.add_argument("--output_dir", dest="output_dir",
+                        help="directory where model_pruned.p and pruning_report.json will be written to (default: the directory of the model)", required=False)
+    parser.add_argument("--n_splits", dest="n_splits", type=int, default=N_SPLITS,
+                        help="number of cross validation folds on which the pruned model is scored (0 to skip)")
+    args = parser.parse_args()
+
+    from training_data import read_training_data
+
+    documents, labels = read_training_data( args.filename )
+    prune( args.model_path, documents, labels, args.output_dir or os.path.dirname( os.path.abspath( args.model_path ) ), n_splits=args.n_splits )
@@ -0,0 +1,264 @@
+'''
+Grid search on the cached token counts of corpus_cache.py. It evaluates the same candidates on the same folds as
+GridSearchCV over the vectorizer -> feature selection -> classification pipeline of train.py, but the corpus is only
+tokenized once: the vectorizer of every fold is replaced by the cached token counts of the fold and a TfidfTransformer.
+
+HalvingGridSearch evaluates the candidates with successive halving: all candidates are first evaluated on a (stratified)
+sample of the training part of every fold, and only the best 1/factor of them are evaluated again on factor times more
+documents, until the remaining candidates are evaluated on the whole training part.
+'''
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+import scipy.sparse as sp
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import ParameterGrid
+from sklearn.pipeline import Pipeline
+
+from corpus_cache import CorpusCache, limit_columns
+
+VECTORIZER_PREFIX = 'vectorizer__'
+CLASSIFICATION_PREFIX = 'classification__'
+#minimum number of documents per class in the smallest sample of the successive halving
+MIN_RESOURCES_PER_CLASS = 10
+
+def counts_pipeline( pipeline: Pipeline ) -> Pipeline:
+    '''
+    Copy of the (unfitted) pipeline in which the vectorizer is replaced by a TfidfTransformer with the same settings,
+    to be fitted on token counts.
+    '''
+    vectorizer = pipeline.named_steps[ 'vectorizer' ]
+    tfidf = TfidfTransformer( norm=vectorizer.norm, use_idf=vectorizer.use_idf, smooth_idf=vectorizer.smooth_idf, sublinear_tf=vectorizer.sublinear_tf )
+    return Pipeline( [ ( 'tfidf', tfidf ) ] + [ ( name, clone( step ) ) for name, step in pipeline.steps[1:] ] )
+
+def assemble_pipeline( pipeline: Pipeline, fitted_counts_pipeline: Pipeline, terms: np.ndarray, columns: np.ndarray, vectorizer_params: dict ) -> Pipeline:
+    '''
+    Fitted vectorizer -> feature selection -> classification pipeline, from a counts_pipeline fitted on the token counts
+    of the given columns (terms).
+    '''
+    vectorizer = clone( pipeline.named_steps[ 'vectorizer' ] ).set_params( **vectorizer_params )
+    vectorizer.vocabulary_ = { term: i for i, term in enumerate( terms[ columns ].tolist() ) }
+    vectorizer.fixed_vocabulary_ = False
+    removed = np.ones( len( terms ), dtype=bool )
+    removed[ columns ] = False
+    vectorizer.stop_words_ = set( terms[ removed ].tolist() )
+    if vectorizer.use_idf:
+        vectorizer.idf_ = fitted_counts_pipeline.named_steps[ 'tfidf' ].idf_
+    return Pipeline( [ ( 'vectorizer', vectorizer ) ] + fitted_counts_pipeline.steps[1:] )
+
+def split_params( params: dict ):
+    '''
+    Splits the parameters of a candidate in the vectorizer parameters and the parameters of the other steps.
+    '''
+    vectorizer_params = { key[ len( VECTORIZER_PREFIX ): ]: value for key, value in params.items() if key.startswith( VECTORIZER_PREFIX ) }
+    if set( vectorizer_params ) - { 'max_df' }:
+        raise ValueError( "Only the max_df parameter of the vectorizer can be searched on cached token counts." )
+    return vectorizer_params, { key: value for key, value in params.items() if not key.startswith( VECTORIZER_PREFIX ) }
+
+def fit_and_score( estimator, params: dict, X_train, y_train, X_test, y_test, scoring ) -> dict:
+    estimator = clone( estimator ).set_params( **params )
+    start = time.time()
+    estimator.fit( X_train, y_train )
+    scores = { 'fit_time': time.time() - start }
+    for name in scoring:
+        scorer = get_scorer( name )
+        scores[ f'test_{name}' ] = scorer( estimator, X_test, y_test )
+        scores[ f'train_{name}' ] = scorer( estimator, X_train, y_train )
+    return scores
+
+def fit_path( estimator: Pipeline, shared_params: dict, path: List[dict], X_train, y_train, X_test, y_test, scoring, sample: np.ndarray=None ) -> List[dict]:
+    '''
+    Like fit_and_score for every parameters of path, which only differ in the parameters of the classification step:
+    the steps before the classification (tf-idf, feature selection) are fitted once, and their fit time is divided over the path.
+    If a sample (of the rows of X_train) is given, the estimators are trained on that sample only; it is taken here, so
+    that a shared (memory mapped) X_train is not copied for every task.
+    '''
+    if sample is not None:
+        X_train, y_train = X_train[ sample ], y_train[ sample ]
+    estimator = clone( estimator ).set_params( **shared_params )
+    start = time.time()
+    head = Pipeline( estimator.steps[:-1] ).fit( X_train, y_train )
+    Xt_train = head.transform( X_train )
+    Xt_test = head.transform( X_test )
+    shared_time = ( time.time() - start ) / len( path )
+
+    results = []
+    for params in path:
+        classifier = clone( estimator.steps[-1][1] ).set_params( **{ key[ len( CLASSIFICATION_PREFIX ): ]: value for key, value in params.items() } )
+        start = time.time()
+        classifier.fit( Xt_train, y_train )
+        scores = { 'fit_time': shared_time + time.time() - start }
+        for name in scoring:
+            scorer = get_scorer( name )
+            scores[ f'test_{name}' ] = scorer( classifier, Xt_test, y_test )
+            scores[ f'train_{name}' ] = scorer( classifier, Xt_train, y_train )
+        results.append( scores )
+    return results
+
+def group_candidates( candidates: List[dict] ) -> OrderedDict:
+    '''
+    Groups the candidates on all their parameters except those of the classification step. Returns for every group
+    ( vectorizer parameters, other shared parameters, [ ( index of the candidate, classification parameters ) ] ).
+    '''
+    groups = OrderedDict()
+    for index, params in enumerate( candidates ):
+        vectorizer_params, params = split_params( params )
+        shared_params = { key: value for key, value in params.items() if not key.startswith( CLASSIFICATION_PREFIX ) }
+        path_params = { key: value for key, value in params.items() if key.startswith( CLASSIFICATION_PREFIX ) }
+        key = json.dumps( [ vectorizer_params, shared_params ], sort_keys=True, default=str )
+        groups.setdefault( key, ( vectorizer_params, shared_params, [] ) )[2].append( ( index, path_params ) )
+    return groups
+
+def stratified_order( labels: np.ndarray, random_state: np.random.RandomState ) -> np.ndarray:
+    '''
+    Random permutation of the documents such that every prefix of it has (about) the class proportions of all documents.
+    '''
+    permutation = random_state.permutation( len( labels ) )
+    quantiles = np.empty( len( labels ) )
+    for label in np.unique( labels ):
+        members = permutation[ labels[ permutation ] == label ]
+        quantiles[ members ] = ( np.arange( len( members ) ) + 0.5 ) / len( members )
+    return np.argsort( quantiles, kind='mergesort' )
+
+class CachedGridSearch:
+    '''
+    Grid search over the parameters of the pipeline of train.py on cached token counts. After fit, it has the
+    cv_results_ ( mean_/std_ train_/test_ scores and fit_time ), best_index_, best_params_ and best_estimator_
+    attributes of a fitted GridSearchCV( refit=refit, return_train_score=True ).
+    '''
+    def __init__(self, estimator: Pipeline, param_grid: dict, scoring, refit: str, n_jobs: int=None ):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.scoring = scoring
+        self.refit = refit
+        self.n_jobs = n_jobs
+
+    def _shared(self) -> bool:
+        '''
+        Whether the fold counts are memory mapped, to share them with the worker processes.
+        '''
+        return self.n_jobs not in ( None, 1 )
+
+    def fit(self, cache: CorpusCache, texts, labels ):
+        labels = np.asarray( labels )
+        counts, terms = cache.counts( texts )
+        folds = cache.folds( labels )
+        default_max_df = self.estimator.named_steps[ 'vectorizer' ].max_df
+
+        candidates = list( ParameterGrid( self.param_grid ) )
+        counts_estimator = counts_pipeline( self.estimator )
+        tasks = []
+        for params in candidates:
+            vectorizer_params, params = split_params( params )
+            fold_counts = cache.fold_counts( counts, folds, vectorizer_params.get( 'max_df', default_max_df ), shared=self._shared() )
+            for ( train, test ), ( X_train, X_test ) in zip( folds, fold_counts ):
+                tasks.append( delayed( fit_and_score )( counts_estimator, params, X_train, labels[ train ], X_test, labels[ test ], self.scoring ) )
+        results = Parallel( n_jobs=self.n_jobs )( tasks )
+
+        self.cv_results_ = { 'params': candidates }
+        for key in results[0]:
+            values = np.array( [ result[ key ] for result in results ] ).reshape( len( candidates ), len( folds ) )
+            self.cv_results_[ f'mean_{key}' ] = values.mean( axis=1 )
+            self.cv_results_[ f'std_{key}' ] = values.std( axis=1 )
+        self.best_index_ = int( np.argmax( self.cv_results_[ f'mean_test_{self.refit}' ] ) )
+        self.best_params_ = candidates[ self.best_index_ ]
+        self._refit_best( counts, terms, labels )
+        return self
+
+    def _refit_best(self, counts: sp.csr_matrix, terms: np.ndarray, labels: np.ndarray ):
+        '''
+        Refits the best candidate on the whole corpus.
+        '''
+        vectorizer_params, params = split_params( self.best_params_ )
+        columns = limit_columns( counts, vectorizer_params.get( 'max_df', self.estimator.named_steps[ 'vectorizer' ].max_df ) )
+        fitted = counts_pipeline( self.estimator ).set_params( **params ).fit( counts[ :, columns ], labels )
+        self.best_estimator_ = assemble_pipeline( self.estimator, fitted, terms, columns, vectorizer_params )
+
+class HalvingGridSearch( CachedGridSearch ):
+    '''
+    Successive halving search over the parameters of the pipeline of train.py on cached token counts, see the module
+    docstring. Candidates that only differ in the parameters of the classification step (e.g. the C of the LinearSVC)
+    share the fit of the tf-idf and feature selection steps. After fit, cv_results_ has a row for every evaluation of a
+    candidate, with the iteration ( iter ) and the number of training documents per fold ( n_resources ), as
+    HalvingGridSearchCV of scikit-learn >= 0.24; best_index_ is the best candidate of the last iteration.
+    '''
+    def __init__(self, estimator: Pipeline, param_grid: dict, scoring, refit: str, factor: int=3, n_jobs: int=None ):
+        super().__init__( estimator, param_grid, scoring, refit, n_jobs=n_jobs )
+        self.factor = factor
+
+    def _evaluate(self, cache: CorpusCache, counts, folds, labels, candidates: List[dict], samples: List[np.ndarray] ) -> List[dict]:
+        '''
+        Scores ( per fold ) of the candidates, trained on the given sample of the training part of every fold.
+        '''
+        default_max_df = self.estimator.named_steps[ 'vectorizer' ].max_df
+        counts_estimator = counts_pipeline( self.estimator )
+
+        groups = group_candidates( candidates )
+        tasks = []
+        for vectorizer_params, shared_params, path in groups.values():
+            fold_counts = cache.fold_counts( counts, folds, vectorizer_params.get( 'max_df', default_max_df ), shared=self._shared() )
+            for ( train, test ), ( X_train, X_test ), sample in zip( folds, fold_counts, samples ):
+                tasks.append( delayed( fit_path )( counts_estimator, shared_params, [ params for _, params in path ],
+                                                   X_train, labels[ train ], X_test, labels[ test ], self.scoring, sample ) )
+        results = Parallel( n_jobs=self.n_jobs )( tasks )
+
+        scores = [ [] for _ in candidates ]
+        task_results = iter( results )
+        for _, _, path in groups.values():
+            for _ in folds:
+                for ( index, _ ), result in zip( path, next( task_results ) ):
+                    scores[ index ].append( result )
+        return scores
+
+    def fit(self, cache: CorpusCache, texts, labels ):
+        labels = np.asarray( labels )
+        counts, terms = cache.counts( texts )
+        folds = cache.folds( labels )
+
+        #order of the training documents of every fold, the sample of an iteration is a prefix of it
+        random_state = np.random.RandomState( 0 )
+        orders = [ stratified_order( labels[ train ], random_state ) for train, _ in folds ]
+        n_train = min( len( train ) for train, _ in folds )
+
+        candidates = list( ParameterGrid( self.param_grid ) )
+        n_iterations = 1
+        while self.factor ** n_iterations < len( candidates ):
+            n_iterations += 1
+        min_resources = MIN_RESOURCES_PER_CLASS * len( np.unique( labels ) )
+
+        rows = []
+        remaining = list( range( len( candidates ) ) )
+        for iteration in range( n_iterations ):
+            n_resources = max( min( n_train, min_resources ), n_train // self.factor ** ( n_iterations - 1 - iteration ) )
+            samples = [ np.sort( order[ :n_resources ] ) for order in orders ]
+            print( f"iteration {iteration}: {len( remaining )} candidates on {n_resources} documents per fold" )
+            scores = self._evaluate( cache, counts, folds, labels, [ candidates[ index ] for index in remaining ], samples )
+            for index, candidate_scores in zip( remaining, scores ):
+                row = { 'params': candidates[ index ], 'iter': iteration, 'n_resources': n_resources }
+                for key in candidate_scores[0]:
+                    values = np.array( [ fold_scores[ key ] for fold_scores in candidate_scores ] )
+                    row[ f'mean_{key}' ] = values.mean()
+                    row[ f'std_{key}' ] = values.std()
+                rows.append( row )
+            if iteration < n_iterations - 1:
+                #keep the best 1/factor of the candidates
+                mean_scores = [ row[ f'mean_test_{self.refit}' ] for row in rows[ -len( remaining ): ] ]
+                ranked = [ remaining[ i ] for i in np.argsort( mean_scores, kind='mergesort' )[::-1] ]
+                remaining = sorted( ranked[ :math.ceil( len( remaining ) / self.factor ) ] )
+
+        self.cv_results_ = { key: [ row[ key ] for row in rows ] for key in rows[0] }
+        for key in rows[0]:
+            if key.startswith( ( 'mean_', 'std_' ) ) or key in ( 'iter', 'n_resources' ):
+                self.cv_results_[ key ] = np.array( self.cv_results_[ key ] )
+        last = len( rows ) - len( remaining )
+        self.best_index_ = last + int( np.argmax( self.cv_results_[ f'mean_test_{self.refit}' ][ last: ] ) )
+        self.best_params_ = rows[ self.best_index_ ][ 'params' ]
+        self._refit_best( counts, terms, labels )
+        return self
@@ -0,0 +1,155 @@
+'''
+Out-of-core training, for training sets that do not fit in memory. The training file is read in chunks:
+
+1. a first pass draws a random hold-out set (every document with probability HOLDOUT_FRACTION, of which the
+   MAX_HOLDOUT_DOCUMENTS with the smallest draws are kept), and counts the document frequencies of the (hashed) terms
+   and the number of documents per class of the other documents,
+2. the following passes (epochs) train a linear SVM (SGDClassifier with hinge loss) incrementally on the tf-idf
+   features of every chunk, except the hold-out documents,
+3. the SVM is calibrated (sigmoid) on the hold-out set.
+
+The draws are seeded and repeated in every pass, so that every pass holds out the same documents, drawn from the whole
+file (also when it is sorted, e.g. by label).
+
+The saved model is a TextNormalizer -> HashingVectorizer -> TfidfTransformer -> CalibratedClassifierCV pipeline, with the same
+predict_proba interface as the model of the grid search in train.py.
+'''
+import json
+import os
+import pickle
+import time
+from configparser import ConfigParser
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.linear_model import SGDClassifier
+from sklearn import metrics
+from sklearn.pipeline import Pipeline
+
+from preprocessing import NORMALIZER_STEP, config_normalizer
+from training_data import iter_training_data
+
+#seed of the random draws of the hold-out documents
+HOLDOUT_SEED = 0
+
+def _read_chunks( config: ConfigParser ):
+    '''
+    Yields ( cleaned documents, labels ) of the chunks of the training file.
+    '''
+    normalizer = config_normalizer( config )
+    chunk_size = config.getint( 'STREAMING', 'CHUNK_SIZE', fallback=10000 )
+    for chunk in iter_training_data( config[ 'INPUT/OUTPUT' ].get( 'INPUT_FILE' ), chunk_size=chunk_size ):
+        yield normalizer.transform( chunk[ 'text' ] ), chunk[ 'label_nr' ].astype( int ).values
+
+def _calibrate( classifier, X, y ):
+    '''
+    Sigmoid calibration of a fitted classifier on hold-out data.
+    '''
+    try:
+        #scikit-learn >= 1.6
+        from sklearn.frozen import FrozenEstimator
+        return CalibratedClassifierCV( FrozenEstimator( classifier ), method='sigmoid' ).fit( X, y )
+    except ImportError:
+        return CalibratedClassifierCV( classifier, cv='prefit', method='sigmoid' ).fit( X, y )
+
+def train_streaming( config: ConfigParser ):
+    '''
+    Trains a model on a training file that is read in chunks, see the module docstring. Configured in the [STREAMING] section of train.config.
+    '''
+    output_dir = config[ 'INPUT/OUTPUT' ].get( 'OUTPUT_DIR' )
+    os.makedirs( output_dir, exist_ok=True )
+
+    epochs = config.getint( 'STREAMING', 'EPOCHS', fallback=3 )
+    holdout_fraction = config.getfloat( 'STREAMING', 'HOLDOUT_FRACTION', fallback=0.1 )
+    max_holdout_documents = config.getint( 'STREAMING', 'MAX_HOLDOUT_DOCUMENTS', fallback=20000 )
+
+    vectorizer = HashingVectorizer( n_features=config.getint( 'STREAMING', 'N_FEATURES', fallback=2 ** 20 ),
+                                    stop_words=config[ 'TFIDF_PARAMETERS' ].get( 'LANGUAGE' ) or None,
+                                    alternate_sign=False, norm=None )
+
+    #1) hold-out set, and document frequencies and class counts of the documents drawn for training
+    print( "Counting document frequencies." )
+    document_frequencies = np.zeros( vectorizer.n_features, dtype=np.int64 )
+    class_counts = {}
+    n_seen = 0
+    n_documents = 0
+    #smallest draws of the documents drawn for the hold-out set
+    holdout_draws = np.empty( 0 )
+    random_state = np.random.RandomState( HOLDOUT_SEED )
+    for documents, labels in _read_chunks( config ):
+        draws = random_state.random_sample( len( documents ) )
+        train = draws >= holdout_fraction
+        n_seen += len( documents )
+        holdout_draws = np.sort( np.concatenate( [ holdout_draws, draws[ ~train ] ] ) )[ :max_holdout_documents ]
+        counts = vectorizer.transform( [ doc for doc, keep in zip( documents, train ) if keep ] )
+        document_frequencies += np.bincount( counts.indices, minlength=vectorizer.n_features )
+        n_documents += counts.shape[0]
+        for label, count in zip( *np.unique( labels[ train ], return_counts=True ) ):
+            class_counts[ label ] = class_counts.get( label, 0 ) + count
+    #documents with a draw below the threshold are held out
+    if len( holdout_draws ) == max_holdout_documents:
+        holdout_threshold = np.nextafter( holdout_draws[-1], 1 )
+    else:
+        holdout_threshold = holdout_fraction
+    print( f"{n_seen - len( holdout_draws )} training documents, {len( holdout_draws )} hold-out documents, {len( class_counts )} categories" )
+
+    #idf as computed by TfidfTransformer( smooth_idf=True )
+    tfidf = TfidfTransformer( sublinear_tf=True )
+    tfidf.idf_ = np.log( ( 1 + n_documents ) / ( 1 + document_frequencies ) ) + 1
+
+    classes = np.array( sorted( class_counts ) )
+    if config[ 'TFIDF_PARAMETERS' ].getboolean( 'BALANCED' ):
+        print("Using balanced class weights.")
+        class_weight = { label: n_documents / ( len( classes ) * class_counts[ label ] ) for label in classes }
+    else:
+        class_weight = None
+
+    #2) incremental training
+    classifier = SGDClassifier( loss='hinge', penalty=config[ 'TFIDF_PARAMETERS' ].get( 'PENALTY' ),
+                                alpha=config.getfloat( 'STREAMING', 'ALPHA', fallback=1e-5 ), class_weight=class_weight, random_state=0 )
+    shuffle_state = np.random.RandomState( 0 )
+    holdout_X = []
+    holdout_y = []
+    start = time.time()
+    for epoch in range( epochs ):
+        random_state = np.random.RandomState( HOLDOUT_SEED )
+        for documents, labels in _read_chunks( config ):
+            holdout = random_state.random_sample( len( documents ) ) < holdout_threshold
+            X = tfidf.transform( vectorizer.transform( documents ) )
+            if epoch == 0 and holdout.any():
+                holdout_X.append( X[ holdout ] )
+                holdout_y.append( labels[ holdout ] )
+            train = np.flatnonzero( ~holdout )
+            shuffle_state.shuffle( train )
+            if len( train ):
+                classifier.partial_fit( X[ train ], labels[ train ], classes=classes )
+        print( f"epoch {epoch + 1}/{epochs} done after {time.time() - start:.1f}s" )
+
+    #3) calibration on the hold-out set
+    holdout_X = sp.vstack( holdout_X ).tocsr()
+    holdout_y = np.concatenate( holdout_y )
+    print( f"Calibrating on {holdout_X.shape[0]} hold-out documents." )
+
+    pred = classifier.predict( holdout_X )
+    scores_dict = {
+        'holdout_f1': metrics.f1_score( holdout_y, pred ),
+        'holdout_precision': metrics.precision_score( holdout_y, pred ),
+        'holdout_recall': metrics.recall_score( holdout_y, pred ),
+        'fit_time': time.time() - start,
+    }
+    print( metrics.classification_report( holdout_y, pred ) )
+    json.dump( scores_dict, open( os.path.join( output_dir, "holdout_scores.json" ), "w" ) )
+
+    calibrated_classifier = _calibrate( classifier, holdout_X, holdout_y )
+
+    clf = Pipeline( [
+        ( NORMALIZER_STEP, config_normalizer( config ) ),
+        ( 'vectorizer', vectorizer ),
+        ( 'tfidf', tfidf ),
+        ( 'classification', calibrated_classifier ),
+    ] )
+
+    pickle.dump( clf, open( os.path.join( output_dir, "model.p" ), "wb" ) )
+    return clf
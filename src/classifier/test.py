@@ -1,11 +1,10 @@
 import os
 import argparse
-import pickle
-from base64 import b64encode, b64decode
-import pandas as pd
 import numpy as np
 from sklearn import metrics
-import string
+
+from batch_predict import CHUNK_SIZE, predict_chunks, write_predictions
+from training_data import iter_training_data
 
 def size_mb(docs):
     return sum(len(s.encode('utf-8')) for s in docs) / 1e6
@@ -15,52 +14,48 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     #Input-output:
     parser.add_argument("--filename", dest="filename",
-                        help="path to the test data (tsv file with at each line: base64 encoded document \t label \t label_nr )", required=True)
+                        help="path to the test data (tsv file with at each line: base64 encoded document \t label \t label_nr, or parquet file created by bootstrap, or a directory, glob pattern or comma separated list of these files )", required=True)
     parser.add_argument("--model_path", dest="model_path",
-                        help="path to the classfier (python pickle format)", required=True)
+                        help="path to the classfier (python pickle format, or directory of a model compiled with model_export.py)", required=True)
     parser.add_argument("--output_file", dest="output_file",
                         help="output file with predicted labels", required=True)
-    
+    parser.add_argument("--workers", dest="workers", type=int, default=None,
+                        help="number of worker processes (default: number of cpu's)")
+    parser.add_argument("--chunk_size", dest="chunk_size", type=int, default=CHUNK_SIZE,
+                        help="number of documents predicted at once by a worker")
+
     args = parser.parse_args()
-    
-    #read in (test data)
-    data=pd.read_csv(  args.filename, sep='\t' , header=None ) 
 
-    test_data=data[0].tolist()
-    test_labels=data[2].tolist()
-    
-    del data
-    
     remove_punctuation_numbers=True
-    
+
     if remove_punctuation_numbers:
         print( "Removing punctuation and numbers" )
-        test_data=[ b64decode( doc ).decode().translate(str.maketrans('', '', string.punctuation+'0123456789'  )) for doc in test_data  ]
-        
-    else:
-        test_data=[ b64decode( doc ).decode() for doc in test_data  ]
-    
-    data_test_size_mb = size_mb(test_data)
 
-    print("%d documents - %0.3fMB (test set)" % (
-        len(test_data), data_test_size_mb))
-    print("%d categories" % len(  np.unique( test_labels  ).tolist()  ))
-    print()
-    
-    #load the classifier 
+    #read in (test data) in chunks, only the labels are kept in memory
+    test_labels=[]
+    data_test_size_mb=0.0
+    def read_chunks():
+        global data_test_size_mb
+        for chunk in iter_training_data( args.filename, chunk_size=args.chunk_size ):
+            test_labels.extend( chunk[ 'label_nr' ].astype( int ).tolist() )
+            documents=chunk[ 'text' ].tolist()
+            data_test_size_mb+=size_mb( documents )
+            yield documents
+
+    os.makedirs(  os.path.dirname( args.output_file ) , exist_ok=True  )
 
-    clf = pickle.load( open(  args.model_path  , "rb" ) )
+    #classify with the classifier, with a pool of workers that each load the classifier once
 
-    pred=clf.predict( test_data  )
-    pred_proba=clf.predict_proba( test_data )
+    pred=[]
+    with open(  args.output_file ,  "w"  ) as fp:
+        for pred_chunk, pred_proba_chunk in predict_chunks( read_chunks(), args.model_path, workers=args.workers,
+                                                            remove_punctuation_numbers=remove_punctuation_numbers ):
+            write_predictions( fp, pred_chunk, pred_proba_chunk )
+            pred.extend( pred_chunk.tolist() )
 
+    print("%d documents - %0.3fMB (test set)" % (
+        len(test_labels), data_test_size_mb))
+    print("%d categories" % len(  np.unique( test_labels  ).tolist()  ))
+    print()
 
     print(metrics.classification_report(test_labels, pred  ))
-    
-    
-    os.makedirs(  os.path.dirname( args.output_file ) , exist_ok=True  )
-    
-    with open(  args.output_file ,  "w"  ) as fp:
-        for pred_label, pred_proba_label in zip(pred, pred_proba):
-            fp.write( f"{pred_label} {pred_proba_label}\n"     )
-            
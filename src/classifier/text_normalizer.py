@@ -0,0 +1,21 @@
+'''
+The normalization of preprocessing.py as a scikit-learn pipeline step. It is kept apart from preprocessing.py, so
+that compiled models (model_export.py) can be loaded and served without scikit-learn.
+'''
+from typing import Optional
+
+from sklearn.base import BaseEstimator, TransformerMixin
+
+from preprocessing import Normalizer
+
+class TextNormalizer( BaseEstimator, TransformerMixin, Normalizer ):
+    '''
+    Pipeline step that normalizes the (decoded) documents, see preprocessing.normalize.
+    '''
+    def __init__(self, remove_punctuation_numbers: bool=True, max_length: Optional[int]=None, length_policy: str='truncate' ):
+        self.remove_punctuation_numbers = remove_punctuation_numbers
+        self.max_length = max_length
+        self.length_policy = length_policy
+
+    def fit(self, X, y=None ):
+        return self
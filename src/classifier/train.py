@@ -1,22 +1,26 @@
-from typing import List
 import json
 import os
 import pickle
-import string
 import configparser
+import tempfile
 from configparser import ConfigParser
 
-from base64 import b64decode, b64encode
-
 import numpy as np
-import pandas as pd
 from sklearn.calibration import CalibratedClassifierCV
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.feature_selection import SelectFromModel
-from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import GridSearchCV, ParameterGrid
 from sklearn.pipeline import Pipeline
 from sklearn.svm import LinearSVC
 
+from corpus_cache import CorpusCache
+from parallelism import CoreUtilization, limit_threads, plan_parallelism
+from preprocessing import NORMALIZER_STEP, config_normalizer
+from prune_model import prune
+from search import CachedGridSearch, HalvingGridSearch, group_candidates
+from streaming_train import train_streaming
+from training_data import read_training_data
+
 PATH=os.getcwd()
 
 CONFIG = configparser.ConfigParser()
@@ -26,6 +30,10 @@ def size_mb(docs):
     return sum(len(s.encode('utf-8')) for s in docs) / 1e6
 
 def train( config:ConfigParser=CONFIG):
+
+    #out-of-core training for training sets that do not fit in memory (see streaming_train.py)
+    if config.get( 'TRAINING', 'MODE', fallback='grid' )=='streaming':
+        return train_streaming( config )
     
     #1)Data
 
@@ -36,17 +44,43 @@ def train( config:ConfigParser=CONFIG):
     threshold=config[ 'TFIDF_PARAMETERS' ].getfloat( 'THRESHOLD_FEATURE_SELECTION' )
     max_features=config[ 'TFIDF_PARAMETERS' ].getint( 'MAX_FEATURES' )
             
-    #read in (train data)
-    data=pd.read_csv(  config[ "INPUT/OUTPUT" ].get('INPUT_FILE')  , sep='\t' , header=None ) 
-
-    train_data=data[0].tolist()
-    train_labels=data[2].tolist()
-    
-    if config[ 'TFIDF_PARAMETERS' ].getboolean( 'REMOVE_PUNCTUATION_NUMBERS' ):
-        print( "Removing punctuation and numbers" )
-        train_data=[ b64decode( doc ).decode().translate(str.maketrans('', '', string.punctuation+'0123456789'  )) for doc in train_data  ]
+    input_file=config[ "INPUT/OUTPUT" ].get('INPUT_FILE')
+    remove_punctuation_numbers=config[ 'TFIDF_PARAMETERS' ].getboolean( 'REMOVE_PUNCTUATION_NUMBERS' )
+    #length policy and removal of punctuation and numbers, saved with the model (see preprocessing.py)
+    normalizer=config_normalizer( config )
+    #number of cross validation folds of the grid search
+    n_splits=5
+
+    def load_corpus():
+        #read in (train data), .tsv or .parquet
+        train_data, train_labels=read_training_data( input_file )
+
+        if remove_punctuation_numbers:
+            print( "Removing punctuation and numbers" )
+        if normalizer.max_length:
+            print( f"Limiting documents to {normalizer.max_length} characters ({normalizer.length_policy})" )
+        train_data=normalizer.transform( train_data )
+        return train_data, train_labels
+
+    #cache of the cleaned and tokenized corpus (see corpus_cache.py)
+    cache_dir=config[ 'INPUT/OUTPUT' ].get( 'CACHE_DIR', '' )
+    #grid: exhaustive grid search, halving: successive halving (see search.py)
+    search_method=config.get( 'SEARCH', 'METHOD', fallback='grid' )
+    if search_method=='halving' and not cache_dir:
+        #the successive halving search works on the token counts of the corpus cache, keep them in a temporary directory
+        temporary_cache_dir=tempfile.TemporaryDirectory()
+        cache_dir=temporary_cache_dir.name
+    cache_settings={ 'remove_punctuation_numbers': remove_punctuation_numbers,
+                     'max_length': normalizer.max_length,
+                     'length_policy': normalizer.length_policy,
+                     'stop_words': config["TFIDF_PARAMETERS"].get( 'LANGUAGE' ),
+                     'n_splits': n_splits }
+    if cache_dir:
+        print( f"Using the corpus cache in {cache_dir}" )
+        cache=CorpusCache( cache_dir, input_file, cache_settings )
+        train_data, train_labels=cache.corpus( load_corpus )
     else:
-        train_data=[ b64decode( doc ).decode() for doc in train_data  ]
+        train_data, train_labels=load_corpus()
 
     data_train_size_mb = size_mb(train_data)
 
@@ -82,6 +116,8 @@ def train( config:ConfigParser=CONFIG):
     
     #calibrated the classifier (for predict_proba): 
     calibrated_classifier = CalibratedClassifierCV(classifier , cv=5 ) 
+    #parameter of the calibrated classifier that holds the LinearSVC (base_estimator before scikit-learn 1.2)
+    classifier_C='classification__%s__C' % ( 'estimator' if 'estimator' in calibrated_classifier.get_params() else 'base_estimator' )
     
     if feature_selection:
         clf=Pipeline([
@@ -94,7 +130,7 @@ def train( config:ConfigParser=CONFIG):
         param_grid = {
         'vectorizer__max_df': [0.5 ] ,#[0.3,0.4,0.5,0.6,0.7 ]
         'feature_selection__estimator__C': [1.0] ,
-        'classification__base_estimator__C': list(np.logspace(-3, 1, 5)) 
+        classifier_C: list(np.logspace(-3, 1, 5)) 
         }
         
     else:
@@ -106,15 +142,45 @@ def train( config:ConfigParser=CONFIG):
         #grid
         param_grid = {
         'vectorizer__max_df': [0.5  ] ,
-        'classification__base_estimator__C': list(np.logspace(-3, 1, 5)) 
+        classifier_C: list(np.logspace(-3, 1, 5)) 
         }
 
 
     scoring=['f1', 'precision', 'recall']
 
-    search = GridSearchCV(clf, param_grid, scoring=scoring , n_jobs=config[ 'TFIDF_PARAMETERS' ].getint( 'JOBS' ) , cv=5, refit=scoring[0], return_train_score=True   )
-
-    search.fit(train_data, train_labels)
+    #parallelism plan (see parallelism.py): the process pool goes either to the search tasks (candidates x folds; the
+    #halving search fits the candidates that only differ in C in one task) or to the calibration folds
+    if search_method=='halving':
+        n_search_tasks=len( group_candidates( list( ParameterGrid( param_grid ) ) ) )*n_splits
+    else:
+        n_search_tasks=len( ParameterGrid( param_grid ) )*n_splits
+    calibration_parallel='n_jobs' in calibrated_classifier.get_params()
+    plan=plan_parallelism( config[ 'TFIDF_PARAMETERS' ].getint( 'JOBS' ), n_search_tasks, calibrated_classifier.cv, calibration_parallel )
+    print( f"Parallelism: {plan}" )
+    if calibration_parallel:
+        calibrated_classifier.set_params( n_jobs=plan.calibration_jobs )
+    if plan.search_jobs > 1 and not cache_dir:
+        #the worker processes share the memory mapped token counts of the folds of a (temporary) corpus cache,
+        #instead of receiving a pickled copy of the training documents with every task
+        temporary_cache_dir=tempfile.TemporaryDirectory()
+        cache_dir=temporary_cache_dir.name
+        cache=CorpusCache( cache_dir, input_file, cache_settings )
+
+    utilization=CoreUtilization( plan.n_cores )
+    with limit_threads( plan ), utilization:
+        if search_method=='halving':
+            print( "Using successive halving search." )
+            search = HalvingGridSearch(clf, param_grid, scoring=scoring, refit=scoring[0], factor=config.getint( 'SEARCH', 'HALVING_FACTOR', fallback=3 ), n_jobs=plan.search_jobs )
+            search.fit(cache, train_data, train_labels)
+        elif cache_dir:
+            #the vectorizer is fitted on the cached token counts of every fold
+            search = CachedGridSearch(clf, param_grid, scoring=scoring, refit=scoring[0], n_jobs=plan.search_jobs )
+            search.fit(cache, train_data, train_labels)
+        else:
+            search = GridSearchCV(clf, param_grid, scoring=scoring , n_jobs=plan.search_jobs , cv=n_splits, refit=scoring[0], return_train_score=True   )
+
+            search.fit(train_data, train_labels)
+    print( f"Grid search: {utilization}" )
 
     #show the selected features (i.e. keywords used for classification):
 
@@ -134,6 +200,19 @@ def train( config:ConfigParser=CONFIG):
     'mean_fit_time' : search.cv_results_['mean_fit_time'][ search.best_index_],
     'std_fit_time' : search.cv_results_['std_fit_time'][ search.best_index_]*2
     }
+
+    #wall-clock fit time (per fold) and score of every evaluated candidate
+    scores_dict[ 'candidates' ]=[]
+    for i, params in enumerate( search.cv_results_['params'] ):
+        candidate={ 'params': params,
+                    'mean_fit_time': search.cv_results_['mean_fit_time'][i],
+                    'mean_test_f1': search.cv_results_['mean_test_f1'][i] }
+        if 'n_resources' in search.cv_results_:
+            candidate[ 'iter' ]=int( search.cv_results_['iter'][i] )
+            candidate[ 'n_resources' ]=int( search.cv_results_['n_resources'][i] )
+        scores_dict[ 'candidates' ].append( candidate )
+
+    scores_dict[ 'parallelism' ]=dict( plan.to_dict(), **utilization.to_dict() )
     
     json.dump(scores_dict, open( os.path.join( config[ "INPUT/OUTPUT" ].get('OUTPUT_DIR'), "cross_validation_scores.json"  ), "w" ))
     
@@ -144,19 +223,27 @@ def train( config:ConfigParser=CONFIG):
         select=search.best_estimator_.named_steps[ 'feature_selection' ]
         vec=search.best_estimator_.named_steps[ 'vectorizer' ]
         
+        #get_feature_names_out since scikit-learn 1.0
+        feature_names=vec.get_feature_names_out() if hasattr( vec, 'get_feature_names_out' ) else vec.get_feature_names()
         i=0
 
-        assert( select.get_support().shape[0]  ==  len(  vec.get_feature_names() ) )
-        for selected, feature in zip( select.get_support(), vec.get_feature_names()  ):
+        assert( select.get_support().shape[0]  ==  len(  feature_names ) )
+        for selected, feature in zip( select.get_support(), feature_names  ):
             if selected:
                 i=i+1
                 print(feature)
 
-        print( f"{i} selected features from total of {len( vec.get_feature_names() )}" )
+        print( f"{i} selected features from total of {len( feature_names )}" )
     
-    #3) Save the classifier
+    #3) Save the classifier, with the normalization of the training documents as first step
+
+    model=Pipeline( [ ( NORMALIZER_STEP, normalizer ) ] + search.best_estimator_.steps )
+    pickle.dump( model , open( os.path.join( config[ "INPUT/OUTPUT" ].get('OUTPUT_DIR'), "model.p"  ), "wb" ) )
 
-    pickle.dump( search.best_estimator_ , open( os.path.join( config[ "INPUT/OUTPUT" ].get('OUTPUT_DIR'), "model.p"  ), "wb" ) )
+    #4) Save the classifier pruned to the selected features (see prune_model.py) next to it
+    if config["TFIDF_PARAMETERS"].getboolean( 'FEATURE_SELECTION_SVC' ) and config.getboolean( 'TRAINING', 'PRUNE', fallback=False ):
+        print( "Pruning the classifier to the selected features." )
+        prune( os.path.join( config[ "INPUT/OUTPUT" ].get('OUTPUT_DIR'), "model.p"  ), train_data, train_labels, config[ "INPUT/OUTPUT" ].get('OUTPUT_DIR'), n_splits=n_splits )
     
 if __name__ == "__main__":
     train()
\ No newline at end of file
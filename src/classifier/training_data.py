@@ -0,0 +1,83 @@
+'''
+Readers of the (training / test) data created by bootstrap (see businessrules/output_writers.py):
+
+- .tsv: tab separated file with at each line: base64_encoded_document \t label_description \t label ( \t celex_id )
+- .parquet: columns text, label, label_nr and celex, with the documents as plain text. Requires pyarrow.
+
+The data can be split over several files (e.g. the shards of an incremental bootstrap, and pseudo_labeled.tsv of
+active_learning.py), in either format: a path is a file, a directory, a glob pattern, several of these separated by
+commas, or a list of these (see training_data_files).
+'''
+import glob
+import os
+from base64 import b64decode
+from typing import Iterator, List, Tuple, Union
+
+import pandas as pd
+
+COLUMNS = [ 'text', 'label', 'label_nr', 'celex' ]
+
+#number of documents read at once
+CHUNK_SIZE = 10000
+
+#extensions of the files of a directory that are read as data
+EXTENSIONS = ( '.tsv', '.parquet' )
+
+def is_parquet( path: str ) -> bool:
+    return path.endswith( '.parquet' )
+
+def training_data_files( path: Union[ str, List[str] ] ) -> List[str]:
+    '''
+    The files of the data at path: a file, a directory (its .tsv and .parquet files), a glob pattern
+    ( e.g. train_data-*.parquet ), several of these separated by commas, or a list of these. The files of a directory
+    or glob pattern are sorted by name.
+    '''
+    paths = path.split( ',' ) if isinstance( path, str ) else path
+    files = []
+    for part in paths:
+        part = part.strip()
+        if not part:
+            continue
+        if os.path.isdir( part ):
+            files.extend( sorted( os.path.join( part, name ) for name in os.listdir( part ) if name.endswith( EXTENSIONS ) ) )
+        elif any( character in part for character in '*?[' ):
+            files.extend( sorted( glob.glob( part ) ) )
+        else:
+            files.append( part )
+    if not files:
+        raise FileNotFoundError( f"No training data found at {path}." )
+    return files
+
+def iter_training_data( path: Union[ str, List[str] ], chunk_size: int=CHUNK_SIZE ) -> Iterator[ pd.DataFrame ]:
+    '''
+    Reads the data (see training_data_files) in chunks of at most chunk_size documents, file after file.
+    Yields DataFrames with the columns text (decoded document), label, label_nr and celex.
+    '''
+    for file in training_data_files( path ):
+        yield from _iter_file( file, chunk_size )
+
+def _iter_file( path: str, chunk_size: int ) -> Iterator[ pd.DataFrame ]:
+    if is_parquet( path ):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError( "pyarrow is needed to read training data in the parquet format." )
+        for batch in pq.ParquetFile( path ).iter_batches( batch_size=chunk_size, columns=COLUMNS ):
+            yield batch.to_pandas()
+    else:
+        #files without celex id have 3 columns
+        for chunk in pd.read_csv( path, sep='\t', header=None, names=COLUMNS, dtype={ 'text': str, 'label': str, 'celex': str },
+                                  keep_default_na=False, chunksize=chunk_size ):
+            chunk[ 'text' ] = [ b64decode( doc ).decode() for doc in chunk[ 'text' ] ]
+            yield chunk
+
+def read_training_data( path: Union[ str, List[str] ] ) -> Tuple[ List[str], List[int] ]:
+    '''
+    Returns the (decoded) documents and the labels ( label_nr ) of the data.
+    '''
+    documents = []
+    labels = []
+    for chunk in iter_training_data( path ):
+        documents.extend( chunk[ 'text' ].tolist() )
+        labels.extend( chunk[ 'label_nr' ].astype( int ).tolist() )
+    return documents, labels
@@ -0,0 +1,11 @@
+'''
+The scripts of src import their sibling modules directly (e.g. `from preprocessing import normalize`), so their
+directories are put on the path of the tests.
+'''
+import os
+import sys
+
+SRC = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' )
+
+for directory in ( 'classifier', 'businessrules', 'benchmarks' ):
+    sys.path.insert( 0, os.path.join( SRC, directory ) )
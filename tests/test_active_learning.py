@@ -0,0 +1,71 @@
+'''
+The pseudo labels of active_learning.py are the classes of the heaps the documents were selected in, once per celex id.
+'''
+import os
+import pickle
+import shutil
+from base64 import b64decode
+
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+
+from active_learning import TopK, _confident_entries, active_learning, check_min_confidence
+from preprocessing import NORMALIZER_STEP
+from text_normalizer import TextNormalizer
+from synthetic import write_export
+
+def _read_tsv( path ):
+    with open( path ) as fp:
+        return [ line.rstrip( '\n' ).split( '\t' ) for line in fp ]
+
+def test_confident_entries():
+    confident = { 0: TopK( 3 ), 1: TopK( 3 ) }
+    confident[ 1 ].push( ( 0.7, 'a', 0.7, 'document a' ) )
+    confident[ 1 ].push( ( 0.9, 'b', 0.9, 'document b' ) )
+    confident[ 0 ].push( ( 0.3, 'a', 0.7, 'document a' ) )
+    confident[ 0 ].push( ( 0.8, 'c', 0.2, 'document c' ) )
+    confident[ 0 ].push( ( 0.8, 'c', 0.2, 'document c' ) )
+    entries = _confident_entries( confident )
+    assert [ ( label, entry[1] ) for label, entry in entries ] == [ ( 1, 'b' ), ( 1, 'a' ), ( 0, 'c' ) ]
+
+@pytest.mark.parametrize( 'min_confidence', [ 0.0, 0.4, 0.5, 1.5 ] )
+def test_min_confidence( min_confidence, tmp_path ):
+    with pytest.raises( ValueError ):
+        check_min_confidence( min_confidence )
+    with pytest.raises( ValueError ):
+        active_learning( str( tmp_path ), 'model.p', str( tmp_path / 'output' ), min_confidence=min_confidence )
+
+def test_active_learning( tmp_path ):
+    export_dir = str( tmp_path / 'export' )
+    write_export( export_dir, n_files=1, records_per_file=300, content_words=50 )
+    #the same documents twice, as in an export with duplicates
+    shutil.copy( os.path.join( export_dir, 'export_00000.jsonl' ), os.path.join( export_dir, 'export_00001.jsonl' ) )
+
+    documents = [ 'bank credit capital', 'financial market securities', 'fisheries agriculture customs', 'veterinary import export' ]
+    model = Pipeline( [ ( NORMALIZER_STEP, TextNormalizer() ), ( 'vectorizer', TfidfVectorizer() ),
+                        ( 'classification', LogisticRegression( C=100 ) ) ] ).fit( documents, [ 1, 1, 0, 0 ] )
+    model_path = str( tmp_path / 'model.p' )
+    with open( model_path, 'wb' ) as fp:
+        pickle.dump( model, fp )
+
+    output_dir = str( tmp_path / 'output' )
+    min_confidence = 0.6
+    active_learning( export_dir, model_path, output_dir, n_uncertain=10, n_confident=20, min_confidence=min_confidence, workers=1 )
+
+    confident = _read_tsv( os.path.join( output_dir, 'review_confident.tsv' ) )
+    pseudo_labeled = _read_tsv( os.path.join( output_dir, 'pseudo_labeled.tsv' ) )
+    assert confident and len( confident ) <= 40
+    celex_ids = [ row[3] for row in confident ]
+    assert len( set( celex_ids ) ) == len( celex_ids )
+    for ( document, label_name, accepted_probability, celex_id ), row in zip( confident, pseudo_labeled ):
+        label = int( row[2] )
+        assert row == [ document, label_name, row[2], celex_id ]
+        assert label_name == ( 'accepted' if label else 'rejected' )
+        probability = float( accepted_probability ) if label else 1.0 - float( accepted_probability )
+        assert probability >= min_confidence
+        assert model.predict_proba( [ b64decode( document ).decode() ] )[ 0, 1 ] == pytest.approx( float( accepted_probability ) )
+
+    uncertain = _read_tsv( os.path.join( output_dir, 'review_uncertain.tsv' ) )
+    assert len( uncertain ) == len( set( row[3] for row in uncertain ) ) == 10
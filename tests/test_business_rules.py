@@ -0,0 +1,54 @@
+'''
+The byte ranges of file_chunks, read with read_lines, give every line of a .jsonl file exactly once, and the compiled
+rule engine gives the acceptance states of the original business rules.
+'''
+import json
+import random
+
+import pytest
+
+import conf
+from bench_rules import reference_classify
+from business_rules import EurlexDocument, file_chunks, parse_jsonlines, read_lines
+from rule_engine import RuleEngine
+from synthetic import synthetic_records
+
+def _write_lines( path, lines ):
+    with open( path, 'wb' ) as fp:
+        fp.write( b''.join( lines ) )
+    return str( path )
+
+def _read_chunks( files, chunk_size: int ):
+    return [ line for file, start, end in file_chunks( files, chunk_size ) for line in read_lines( file, start, end ) ]
+
+@pytest.mark.parametrize( 'chunk_size', [ 1, 2, 3, 5, 7, 16, 64, 1000, 100000 ] )
+def test_file_chunks( tmp_path, chunk_size ):
+    rng = random.Random( chunk_size )
+    lines = [ ( 'x' * rng.randint( 0, 40 ) + 'é€' * rng.randint( 0, 3 ) + '\n' ).encode( 'utf-8' ) for _ in range( 100 ) ]
+    #empty lines, and a last line without line break
+    lines[ 10 ] = lines[ 11 ] = b'\n'
+    lines[ -1 ] = lines[ -1 ].rstrip( b'\n' )
+    files = [ _write_lines( tmp_path / 'a.jsonl', lines ), _write_lines( tmp_path / 'empty.jsonl', [] ), _write_lines( tmp_path / 'b.jsonl', lines[ :3 ] ) ]
+    assert _read_chunks( files, chunk_size ) == lines + lines[ :3 ]
+
+def test_file_chunks_cover_files( tmp_path ):
+    file = _write_lines( tmp_path / 'a.jsonl', [ b'line\n' ] * 10 )
+    chunks = list( file_chunks( [ file ], 7 ) )
+    assert chunks[0][1] == 0 and chunks[-1][2] == 50
+    assert all( end == next_start for ( _, _, end ), ( _, next_start, _ ) in zip( chunks, chunks[1:] ) )
+    assert list( file_chunks( [ _write_lines( tmp_path / 'empty.jsonl', [] ) ], 7 ) ) == [ ( str( tmp_path / 'empty.jsonl' ), 0, 0 ) ]
+
+@pytest.mark.parametrize( 'chunk_size', [ 1, 50, 333, 100000 ] )
+def test_parse_jsonlines_chunks( tmp_path, chunk_size ):
+    records = [ { 'website': 'eurlex', 'celex': f'3202{i}R000{i}', 'content': f'document {i} ' * ( i % 7 ) } for i in range( 40 ) ]
+    records.insert( 5, { 'website': 'other', 'content': 'not a eurlex document' } )
+    file = _write_lines( tmp_path / 'export.jsonl', [ ( json.dumps( record ) + '\n' ).encode( 'utf-8' ) for record in records ] )
+    celex_ids = [ eurlex_doc.celex_id for chunk in file_chunks( [ file ], chunk_size ) for eurlex_doc in parse_jsonlines( *chunk ) ]
+    assert celex_ids == [ record[ 'celex' ] for record in records if record[ 'website' ] == 'eurlex' ]
+
+@pytest.mark.parametrize( 'seed', [ 0, 1, 2 ] )
+def test_rule_engine( seed ):
+    documents = [ EurlexDocument( record ) for record in synthetic_records( 5000, seed=seed, content_words=10 ) ]
+    reference_states = [ reference_classify( doc ) for doc in documents ]
+    assert set( reference_states ) == { 'accepted', 'rejected', None }
+    assert [ state for state, _ in RuleEngine( conf ).label_batch( documents ) ] == reference_states
@@ -0,0 +1,107 @@
+'''
+A compiled model (model_export.py) predicts the same probabilities as the pipeline it was compiled from.
+'''
+import json
+import os
+import random
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_selection import SelectFromModel
+from sklearn.pipeline import Pipeline
+from sklearn.svm import LinearSVC
+
+import model_export
+from model_export import compile_model, export_model, load_model
+from preprocessing import NORMALIZER_STEP
+from text_normalizer import TextNormalizer
+
+ACCEPTED_WORDS = [ 'capital', 'credit', 'institutions', 'prudential', 'requirements', 'bank', 'liquidity', 'résolution' ]
+REJECTED_WORDS = [ 'fisheries', 'agriculture', 'vessels', 'catch', 'quota', 'milk', 'cereals', 'fischerei' ]
+COMMON_WORDS = [ 'the', 'of', 'regulation', 'commission', 'article', 'council', 'decision', 'annex' ]
+
+def _documents( n_documents: int, seed: int ):
+    rng = random.Random( seed )
+    documents = []
+    labels = []
+    for i in range( n_documents ):
+        label = i % 2
+        words = ACCEPTED_WORDS if label else REJECTED_WORDS
+        tokens = [ rng.choice( words + COMMON_WORDS ) for _ in range( rng.randint( 5, 60 ) ) ]
+        #punctuation and numbers, removed by the normalizer
+        tokens.insert( rng.randrange( len( tokens ) ), f'({rng.randint( 1, 2020 )}/{rng.randint( 1, 99 )}),' )
+        documents.append( ' '.join( tokens ) )
+        labels.append( label )
+    return documents, labels
+
+@pytest.fixture( scope='module', params=[ ( None, 'truncate' ), ( 60, 'head_tail' ) ], ids=[ 'no_length_limit', 'head_tail' ] )
+def pipeline( request ):
+    max_length, length_policy = request.param
+    documents, labels = _documents( 200, seed=0 )
+    model = Pipeline( [
+        ( NORMALIZER_STEP, TextNormalizer( max_length=max_length, length_policy=length_policy ) ),
+        ( 'vectorizer', TfidfVectorizer( sublinear_tf=True, max_df=0.5 ) ),
+        ( 'feature_selection', SelectFromModel( LinearSVC( penalty='l1', dual=False, tol=1e-3 ) ) ),
+        ( 'classification', CalibratedClassifierCV( LinearSVC(), cv=3 ) ),
+    ] )
+    return model.fit( documents, labels )
+
+def _test_documents():
+    documents, _ = _documents( 50, seed=1 )
+    return documents + [
+        #empty documents, and documents without any term of the vocabulary
+        '',
+        '   ',
+        '2020/1234 (EU) -- 12.5%',
+        'zzz unknownterm otherunknownterm',
+        'ünïcödé wörds außerhalb des vokabulars',
+        #terms of the vocabulary mixed with unknown terms, in upper case
+        'CAPITAL zzz Fisheries unknownterm credit',
+        'x' * 500,
+    ]
+
+def test_compiled_model_parity( pipeline ):
+    documents = _test_documents()
+    compiled_model = compile_model( pipeline )
+    assert np.allclose( compiled_model.predict_proba( documents ), pipeline.predict_proba( documents ) )
+    assert ( compiled_model.predict( documents ) == pipeline.predict( documents ) ).all()
+
+def test_exported_model_parity( pipeline, tmp_path ):
+    documents = _test_documents()
+    export_model( pipeline, str( tmp_path ) )
+    compiled_model = load_model( str( tmp_path ), mmap_mode='r' )
+    assert isinstance( compiled_model.weights, np.memmap )
+    assert np.allclose( compiled_model.predict_proba( documents ), pipeline.predict_proba( documents ) )
+
+def test_streamed_counts_parity( pipeline ):
+    documents = _test_documents()
+    compiled_model = compile_model( pipeline )
+    documents_counts = []
+    for document in compiled_model.normalizer.transform( documents ):
+        counter = compiled_model.token_counter()
+        for start in range( 0, len( document ), 7 ):
+            counter.feed( document[ start:start + 7 ] )
+        documents_counts.append( counter.close() )
+    probabilities = compiled_model.predict_proba_transformed( compiled_model.transform_counts( documents_counts ) )
+    assert np.allclose( probabilities, pipeline.predict_proba( documents ) )
+
+#loads a compiled model and prints its probabilities, in a python process in which scikit-learn can not be imported
+WITHOUT_SKLEARN = '''
+import json, sys
+sys.modules[ 'sklearn' ] = None
+sys.path.insert( 0, sys.argv[1] )
+from model_export import load_model
+print( json.dumps( load_model( sys.argv[2] ).predict_proba( json.loads( sys.argv[3] ) ).tolist() ) )
+'''
+
+def test_compiled_model_without_sklearn( pipeline, tmp_path ):
+    documents = _test_documents()
+    export_model( pipeline, str( tmp_path ) )
+    classifier_dir = os.path.dirname( os.path.abspath( model_export.__file__ ) )
+    output = subprocess.run( [ sys.executable, '-c', WITHOUT_SKLEARN, classifier_dir, str( tmp_path ), json.dumps( documents ) ],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True ).stdout
+    assert np.allclose( json.loads( output ), pipeline.predict_proba( documents ) )
@@ -0,0 +1,58 @@
+'''
+The parallelism plan (parallelism.py) gives the process pool to one level only, and does not start more threads than
+there are cores.
+'''
+import os
+
+import pytest
+
+import parallelism
+from parallelism import available_cores, limit_threads, n_cores, plan_parallelism
+
+CORES = 8
+
+@pytest.fixture
+def cores( monkeypatch ):
+    monkeypatch.setattr( os, 'sched_getaffinity', lambda pid: set( range( CORES ) ), raising=False )
+    monkeypatch.setattr( os, 'cpu_count', lambda: 2 * CORES )
+    return CORES
+
+def test_available_cores( cores ):
+    assert available_cores() == cores
+    assert [ n_cores( jobs ) for jobs in ( -1, -2, -100, 0, None, 1, 3, 100 ) ] == [ cores, cores - 1, 1, 1, 1, 1, 3, cores ]
+
+@pytest.mark.parametrize( 'jobs', [ -1, -2, 1, 3, 100 ] )
+@pytest.mark.parametrize( 'n_search_tasks', [ 1, 3, 5, 25 ] )
+@pytest.mark.parametrize( 'calibration_parallel', [ False, True ] )
+def test_plan( cores, jobs, n_search_tasks, calibration_parallel ):
+    plan = plan_parallelism( jobs, n_search_tasks, 5, calibration_parallel )
+    assert plan.n_cores == n_cores( jobs )
+    #the process pool goes to one level only
+    assert min( plan.search_jobs, plan.calibration_jobs ) == 1
+    assert plan.search_jobs <= n_search_tasks
+    if not calibration_parallel:
+        assert plan.calibration_jobs == 1
+    #processes x BLAS threads ( inner_max_num_threads ) stays within the cores
+    assert plan.search_jobs * plan.calibration_jobs * plan.blas_threads <= plan.n_cores
+    #the cores go to the level that can use the most of them
+    assert max( plan.search_jobs, plan.calibration_jobs ) == min( plan.n_cores, max( n_search_tasks, 5 if calibration_parallel else 1 ) )
+
+def test_plan_levels( cores ):
+    plan = plan_parallelism( -1, 25, 5, True )
+    assert ( plan.level, plan.search_jobs, plan.calibration_jobs, plan.blas_threads ) == ( 'search', 8, 1, 1 )
+    plan = plan_parallelism( -1, 2, 5, True )
+    assert ( plan.level, plan.search_jobs, plan.calibration_jobs, plan.blas_threads ) == ( 'calibration', 1, 5, 1 )
+    plan = plan_parallelism( -1, 2, 5, False )
+    assert ( plan.level, plan.search_jobs, plan.calibration_jobs, plan.blas_threads ) == ( 'search', 2, 1, 4 )
+    plan = plan_parallelism( 1, 25, 5, True )
+    assert ( plan.level, plan.search_jobs, plan.calibration_jobs, plan.blas_threads ) == ( 'none', 1, 1, 1 )
+
+def test_limit_threads( cores ):
+    from joblib.parallel import get_active_backend
+    plan = plan_parallelism( -1, 2, 5, False )
+    with limit_threads( plan ):
+        backend, _ = get_active_backend()
+        assert backend.inner_max_num_threads == plan.blas_threads
+        if parallelism.threadpool_limits is not None:
+            from threadpoolctl import threadpool_info
+            assert all( pool[ 'num_threads' ] <= plan.blas_threads for pool in threadpool_info() )
@@ -0,0 +1,135 @@
+'''
+The bounded and streamed decoding of preprocessing.py give the same documents as decoding the whole document.
+'''
+import binascii
+import gzip
+import random
+import re
+import zlib
+from base64 import b64encode, encodebytes
+from collections import Counter
+
+import pytest
+
+from preprocessing import LENGTH_POLICIES, StreamDecoder, TokenCounter, apply_length_policy, decode, decode_bounded, normalize
+
+#characters of 1 to 4 bytes in utf-8, so that the cuts of decode_bounded fall inside characters
+ALPHABET = 'ab c.1é€𝄞\n'
+
+#default token pattern of scikit-learn
+TOKEN_PATTERN = re.compile( r'(?u)\b\w\w+\b' )
+
+MAX_LENGTHS = [ None, 0, 1, 2, 3, 4, 5, 10, 33, 100 ]
+
+def _random_document( rng: random.Random ) -> str:
+    return ''.join( rng.choice( ALPHABET ) for _ in range( rng.randint( 0, 150 ) ) )
+
+def _documents( n_documents: int=300, seed: int=0 ):
+    rng = random.Random( seed )
+    return [ _random_document( rng ) for _ in range( n_documents ) ]
+
+def _four_byte_documents( max_length ):
+    '''
+    Documents of only 4 byte characters, around max_length characters long: the longest documents per base64 character
+    that are not cut.
+    '''
+    return [ '𝄞😀' * ( n // 2 ) + '😀' * ( n % 2 ) for n in range( max( ( max_length or 0 ) - 3, 0 ), ( max_length or 0 ) + 12 ) ]
+
+@pytest.mark.parametrize( 'length_policy', LENGTH_POLICIES )
+@pytest.mark.parametrize( 'max_length', MAX_LENGTHS + [ 7, 13, 19, 25, 31, 37 ] )
+def test_decode_bounded( max_length, length_policy ):
+    for document in _documents() + _four_byte_documents( max_length ):
+        encoded = b64encode( document.encode( 'utf-8' ) ).decode()
+        expected = apply_length_policy( decode( [ encoded ] )[0], max_length, length_policy )
+        assert decode_bounded( encoded, max_length, length_policy ) == expected
+
+@pytest.mark.parametrize( 'length_policy', LENGTH_POLICIES )
+def test_decode_bounded_line_breaks( length_policy ):
+    #base64 with line breaks is not cut, but decoded as a whole
+    for document in _documents( 50 ):
+        encoded = encodebytes( document.encode( 'utf-8' ) ).decode()
+        assert decode_bounded( encoded, 10, length_policy ) == apply_length_policy( document, 10, length_policy )
+
+@pytest.mark.parametrize( 'length_policy', LENGTH_POLICIES )
+@pytest.mark.parametrize( 'max_length', MAX_LENGTHS )
+def test_length_policy_idempotent( max_length, length_policy ):
+    for document in _documents():
+        cut = apply_length_policy( document, max_length, length_policy )
+        assert not max_length or len( cut ) <= max_length
+        assert apply_length_policy( cut, max_length, length_policy ) == cut
+
+def test_decode_bounded_errors():
+    with pytest.raises( binascii.Error ):
+        decode_bounded( 'not base64!', 10 )
+    with pytest.raises( UnicodeDecodeError ):
+        decode_bounded( b64encode( b'\xff\xfe' ).decode(), 10 )
+
+def test_unknown_length_policy():
+    with pytest.raises( ValueError ):
+        apply_length_policy( 'a' * 20, 10, 'middle' )
+
+def _chunks( data, rng: random.Random ):
+    '''
+    Splits data at random positions (also inside characters), with empty chunks.
+    '''
+    start = 0
+    while start < len( data ):
+        end = start + rng.randint( 0, 12 )
+        yield data[ start:end ]
+        start = end
+
+def _stream_decode( decoder: StreamDecoder, data: bytes, rng: random.Random ) -> str:
+    pieces = []
+    for chunk in _chunks( data, rng ):
+        pieces.extend( decoder.feed( chunk ) )
+        if decoder.done:
+            break
+    pieces.append( decoder.close() )
+    return ''.join( pieces )
+
+@pytest.mark.parametrize( 'compressed', [ False, True ], ids=[ 'plain', 'gzip' ] )
+@pytest.mark.parametrize( 'remove_punctuation_numbers', [ True, False ] )
+@pytest.mark.parametrize( 'length_policy', LENGTH_POLICIES )
+@pytest.mark.parametrize( 'max_length', MAX_LENGTHS )
+def test_stream_decoder( max_length, length_policy, remove_punctuation_numbers, compressed ):
+    rng = random.Random( 1 )
+    for document in _documents( 100 ):
+        data = document.encode( 'utf-8' )
+        if compressed:
+            data = gzip.compress( data )
+        decoder = StreamDecoder( remove_punctuation_numbers, max_length, length_policy, gzip=compressed )
+        expected = normalize( [ document ], remove_punctuation_numbers, max_length, length_policy )[0]
+        assert _stream_decode( decoder, data, rng ) == expected
+
+def test_stream_decoder_errors():
+    rng = random.Random( 2 )
+    with pytest.raises( UnicodeDecodeError ):
+        _stream_decode( StreamDecoder(), 'abcé'.encode( 'utf-8' )[ :-1 ], rng )
+    with pytest.raises( UnicodeDecodeError ):
+        _stream_decode( StreamDecoder(), b'abc\xff\xfedef', rng )
+    with pytest.raises( zlib.error ):
+        _stream_decode( StreamDecoder( gzip=True ), gzip.compress( b'abc' * 100 )[ :-10 ], rng )
+    with pytest.raises( zlib.error ):
+        _stream_decode( StreamDecoder( gzip=True ), b'not gzip', rng )
+
+@pytest.mark.parametrize( 'lowercase', [ True, False ] )
+def test_token_counter( lowercase ):
+    rng = random.Random( 3 )
+    words = [ 'Capital', 'credit', 'é', 'ab', 'x', '€', '𝄞', 'Régulation' ]
+    for _ in range( 200 ):
+        document = ''.join( rng.choice( words + [ ' ', ', ', '.' ] ) for _ in range( rng.randint( 0, 40 ) ) )
+        counter = TokenCounter( TOKEN_PATTERN, lowercase )
+        for piece in _chunks( document, rng ):
+            counter.feed( piece )
+        expected = Counter( TOKEN_PATTERN.findall( document.lower() if lowercase else document ) )
+        assert counter.close() == expected
+
+def test_token_counter_long_tokens():
+    rng = random.Random( 4 )
+    document = 'credit ' + 'a' * 50 + ' capital ' + 'b' * 8 + ' bank'
+    for _ in range( 50 ):
+        counter = TokenCounter( TOKEN_PATTERN, max_token_length=10 )
+        for piece in _chunks( document, rng ):
+            counter.feed( piece )
+        #the token longer than max_token_length is left out, the tokens after it are counted
+        assert counter.close() == Counter( [ 'credit', 'capital', 'b' * 8, 'bank' ] )
@@ -0,0 +1,106 @@
+'''
+CachedGridSearch (search.py) on the token counts of corpus_cache.py evaluates the candidates as GridSearchCV on the
+documents, and the corpus cache is reused for the same data and settings only.
+'''
+import random
+
+import numpy as np
+import pytest
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_selection import SelectFromModel
+from sklearn.model_selection import GridSearchCV
+from sklearn.pipeline import Pipeline
+from sklearn.svm import LinearSVC
+
+from corpus_cache import CorpusCache
+from search import CachedGridSearch
+
+N_SPLITS = 3
+SCORING = [ 'f1', 'precision', 'recall' ]
+WORDS = [ 'capital', 'credit', 'bank', 'liquidity', 'fisheries', 'vessels', 'milk', 'quota', 'the', 'of', 'regulation', 'article' ] \
+    + [ f'term{i}' for i in range( 40 ) ]
+
+#name of the classifier parameter of CalibratedClassifierCV ( estimator since scikit-learn 1.2 )
+CALIBRATED = 'estimator' if 'estimator' in CalibratedClassifierCV().get_params() else 'base_estimator'
+
+def corpus( n_documents: int=120, seed: int=0 ):
+    rng = random.Random( seed )
+    documents = []
+    labels = []
+    for i in range( n_documents ):
+        label = i % 2
+        #the first words are more frequent in accepted documents, with some noise
+        weights = [ 5 if ( j < 4 ) == bool( label ) else 1 for j in range( len( WORDS ) ) ]
+        documents.append( ' '.join( rng.choices( WORDS, weights, k=rng.randint( 5, 20 ) ) ) )
+        labels.append( label )
+    return documents, labels
+
+def pipeline():
+    #fixed random states: liblinear shuffles the features in the l1 (coordinate descent) solver
+    return Pipeline( [
+        ( 'vectorizer', TfidfVectorizer( sublinear_tf=True, max_df=0.5 ) ),
+        ( 'feature_selection', SelectFromModel( LinearSVC( penalty='l1', dual=False, tol=1e-3, random_state=0 ), threshold=1e-5 ) ),
+        ( 'classification', CalibratedClassifierCV( LinearSVC( dual=False, random_state=0 ), cv=3 ) ),
+    ] )
+
+PARAM_GRID = {
+    'vectorizer__max_df': [ 0.5, 0.95 ],
+    f'classification__{CALIBRATED}__C': [ 0.01, 1.0, 10.0 ],
+}
+
+def write_corpus( path, documents, labels ):
+    with open( path, 'w' ) as fp:
+        for document, label in zip( documents, labels ):
+            fp.write( f"{document}\t{label}\n" )
+    return str( path )
+
+@pytest.fixture( scope='module' )
+def grid_search():
+    documents, labels = corpus()
+    return GridSearchCV( pipeline(), PARAM_GRID, scoring=SCORING, refit='f1', cv=N_SPLITS, return_train_score=True ).fit( documents, labels )
+
+@pytest.mark.parametrize( 'n_jobs', [ 1, 2 ] )
+def test_cached_grid_search_parity( grid_search, tmp_path, n_jobs ):
+    documents, labels = corpus()
+    input_file = write_corpus( tmp_path / 'corpus.tsv', documents, labels )
+    cache = CorpusCache( str( tmp_path / 'cache' ), input_file, { 'stop_words': None, 'n_splits': N_SPLITS } )
+    search = CachedGridSearch( pipeline(), PARAM_GRID, scoring=SCORING, refit='f1', n_jobs=n_jobs ).fit( cache, documents, labels )
+
+    assert search.cv_results_[ 'params' ] == grid_search.cv_results_[ 'params' ]
+    for score in SCORING:
+        for part in ( 'train', 'test' ):
+            assert np.allclose( search.cv_results_[ f'mean_{part}_{score}' ], grid_search.cv_results_[ f'mean_{part}_{score}' ] )
+            assert np.allclose( search.cv_results_[ f'std_{part}_{score}' ], grid_search.cv_results_[ f'std_{part}_{score}' ] )
+    assert search.best_params_ == grid_search.best_params_
+    assert np.allclose( search.best_estimator_.predict_proba( documents ), grid_search.best_estimator_.predict_proba( documents ) )
+
+def test_corpus_cache( tmp_path ):
+    documents, labels = corpus( 30 )
+    input_file = write_corpus( tmp_path / 'corpus.tsv', documents, labels )
+    settings = { 'stop_words': None, 'n_splits': N_SPLITS }
+    loads = []
+    def load_corpus():
+        loads.append( 1 )
+        return documents, labels
+
+    cache = CorpusCache( str( tmp_path / 'cache' ), input_file, settings )
+    assert cache.corpus( load_corpus ) == ( documents, labels )
+    counts, terms = cache.counts( documents )
+    assert len( loads ) == 1
+
+    #same data and settings: the cached corpus and counts are used
+    cache = CorpusCache( str( tmp_path / 'cache' ), input_file, settings )
+    assert cache.corpus( load_corpus ) == ( documents, labels )
+    cached_counts, cached_terms = cache.counts( [] )
+    assert len( loads ) == 1
+    assert ( cached_counts != counts ).nnz == 0 and ( cached_terms == terms ).all()
+
+    #other settings, or changed data: a new cache
+    other_settings = CorpusCache( str( tmp_path / 'cache' ), input_file, dict( settings, stop_words='english' ) )
+    assert other_settings.path != cache.path
+    write_corpus( input_file, documents[ :-1 ], labels[ :-1 ] )
+    changed = CorpusCache( str( tmp_path / 'cache' ), input_file, settings )
+    assert changed.path != cache.path
+    assert changed.corpus( load_corpus ) == ( documents, labels )
+    assert len( loads ) == 2
@@ -0,0 +1,60 @@
+'''
+Out-of-core training (streaming_train.py, [TRAINING] MODE = streaming) on a small synthetic corpus.
+'''
+import configparser
+import json
+import os
+import pickle
+import random
+from base64 import b64encode
+
+import pytest
+
+from train import train
+
+WORDS = [ 'capital', 'credit', 'bank', 'liquidity', 'fisheries', 'vessels', 'milk', 'quota' ] + [ f'term{i}' for i in range( 40 ) ]
+
+def _write_corpus( path, sort: bool, n_documents: int=400, seed: int=0 ):
+    '''Writes a training file (sorted by label), returns its documents and labels.'''
+    rng = random.Random( seed )
+    labels = [ i % 2 for i in range( n_documents ) ]
+    if sort:
+        labels.sort()
+    documents = []
+    with open( path, 'w' ) as fp:
+        for i, label in enumerate( labels ):
+            weights = [ 5 if ( j < 4 ) == bool( label ) else 1 for j in range( len( WORDS ) ) ]
+            document = ' '.join( rng.choices( WORDS, weights, k=rng.randint( 5, 20 ) ) )
+            documents.append( document )
+            fp.write( f"{b64encode( document.encode() ).decode()}\t{'accepted' if label else 'rejected'}\t{label}\tcelex{i}\n" )
+    return documents, labels
+
+def _config( input_file: str, output_dir: str, chunk_size: int, max_holdout_documents: int ) -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    config.read( os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src', 'classifier', 'train.config' ) )
+    config[ 'INPUT/OUTPUT' ][ 'INPUT_FILE' ] = input_file
+    config[ 'INPUT/OUTPUT' ][ 'OUTPUT_DIR' ] = output_dir
+    config[ 'TRAINING' ][ 'MODE' ] = 'streaming'
+    config[ 'STREAMING' ][ 'N_FEATURES' ] = str( 2 ** 12 )
+    config[ 'STREAMING' ][ 'EPOCHS' ] = '10'
+    config[ 'STREAMING' ][ 'CHUNK_SIZE' ] = str( chunk_size )
+    config[ 'STREAMING' ][ 'HOLDOUT_FRACTION' ] = '0.2'
+    config[ 'STREAMING' ][ 'MAX_HOLDOUT_DOCUMENTS' ] = str( max_holdout_documents )
+    return config
+
+#a file sorted by label is read in one chunk: the SGDClassifier is only trained well on chunks of mixed labels
+@pytest.mark.parametrize( 'sort, chunk_size, max_holdout_documents', [ ( False, 50, 20000 ), ( False, 50, 30 ), ( True, 400, 30 ) ] )
+def test_train_streaming( tmp_path, sort, chunk_size, max_holdout_documents ):
+    documents, labels = _write_corpus( tmp_path / 'train.tsv', sort )
+    train( _config( str( tmp_path / 'train.tsv' ), str( tmp_path / 'model' ), chunk_size, max_holdout_documents ) )
+
+    #the hold-out set has documents of both classes, also when it is limited to the first draws of a sorted file
+    with open( tmp_path / 'model' / 'holdout_scores.json' ) as fp:
+        scores = json.load( fp )
+    assert scores[ 'holdout_f1' ] > 0.7
+    assert scores[ 'holdout_precision' ] > 0.7
+
+    with open( tmp_path / 'model' / 'model.p', 'rb' ) as fp:
+        model = pickle.load( fp )
+    assert ( model.predict( documents ) == labels ).mean() > 0.8
+    assert model.predict_proba( documents ).shape == ( len( documents ), 2 )
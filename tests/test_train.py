@@ -0,0 +1,52 @@
+'''
+Training with the successive halving search (train.py, [SEARCH] METHOD = halving) on a small synthetic corpus.
+'''
+import configparser
+import json
+import os
+import pickle
+import random
+from base64 import b64encode
+
+from train import train
+
+WORDS = [ 'capital', 'credit', 'bank', 'liquidity', 'fisheries', 'vessels', 'milk', 'quota' ] + [ f'term{i}' for i in range( 40 ) ]
+
+def _write_corpus( path, n_documents: int=200, seed: int=0 ):
+    rng = random.Random( seed )
+    documents = []
+    with open( path, 'w' ) as fp:
+        for i in range( n_documents ):
+            label = i % 2
+            weights = [ 5 if ( j < 4 ) == bool( label ) else 1 for j in range( len( WORDS ) ) ]
+            document = ' '.join( rng.choices( WORDS, weights, k=rng.randint( 5, 20 ) ) )
+            documents.append( document )
+            fp.write( f"{b64encode( document.encode() ).decode()}\t{'accepted' if label else 'rejected'}\t{label}\tcelex{i}\n" )
+    return documents
+
+def _config( input_file: str, output_dir: str ) -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    config.read( os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src', 'classifier', 'train.config' ) )
+    config[ 'INPUT/OUTPUT' ][ 'INPUT_FILE' ] = input_file
+    config[ 'INPUT/OUTPUT' ][ 'OUTPUT_DIR' ] = output_dir
+    config[ 'TFIDF_PARAMETERS' ][ 'JOBS' ] = '1'
+    config[ 'SEARCH' ][ 'METHOD' ] = 'halving'
+    return config
+
+def test_train_halving( tmp_path ):
+    documents = _write_corpus( tmp_path / 'train.tsv' )
+    train( _config( str( tmp_path / 'train.tsv' ), str( tmp_path / 'model' ) ) )
+
+    with open( tmp_path / 'model' / 'cross_validation_scores.json' ) as fp:
+        scores = json.load( fp )
+    candidates = scores[ 'candidates' ]
+    #all candidates are evaluated in the first iteration, on fewer documents than the later ones
+    assert len( [ candidate for candidate in candidates if candidate[ 'iter' ] == 0 ] ) == 5
+    assert max( candidate[ 'iter' ] for candidate in candidates ) > 0
+    assert candidates[0][ 'n_resources' ] < candidates[-1][ 'n_resources' ]
+    assert all( 0 <= candidate[ 'mean_test_f1' ] <= 1 for candidate in candidates )
+    assert scores[ 'mean_test_f1' ] > 0.5
+
+    with open( tmp_path / 'model' / 'model.p', 'rb' ) as fp:
+        model = pickle.load( fp )
+    assert ( model.predict( documents ) == [ i % 2 for i in range( len( documents ) ) ] ).mean() > 0.8
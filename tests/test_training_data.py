@@ -0,0 +1,41 @@
+'''
+Training data split over several files (shards of bootstrap, in either format) is read as one data set.
+'''
+from base64 import b64encode
+
+import pytest
+
+from training_data import read_training_data, training_data_files
+
+def _write_tsv( path, documents, labels ):
+    with open( path, 'w' ) as fp:
+        for document, label in zip( documents, labels ):
+            fp.write( f"{b64encode( document.encode() ).decode()}\t{'accepted' if label else 'rejected'}\t{label}\tcelex\n" )
+    return str( path )
+
+@pytest.fixture
+def shards( tmp_path ):
+    _write_tsv( tmp_path / 'train_data-00001.tsv', [ 'a b', 'c' ], [ 1, 0 ] )
+    _write_tsv( tmp_path / 'train_data-00002.tsv', [ 'd é' ], [ 1 ] )
+    _write_tsv( tmp_path / 'pseudo_labeled.tsv', [ 'e' ], [ 0 ] )
+    ( tmp_path / 'manifest.json' ).write_text( '{}' )
+    return tmp_path
+
+def test_directory( shards ):
+    assert read_training_data( str( shards ) ) == ( [ 'e', 'a b', 'c', 'd é' ], [ 0, 1, 0, 1 ] )
+
+def test_glob_and_list( shards ):
+    assert read_training_data( str( shards / 'train_data-*.tsv' ) ) == ( [ 'a b', 'c', 'd é' ], [ 1, 0, 1 ] )
+    paths = f"{shards / 'train_data-00002.tsv'}, {shards / 'pseudo_labeled.tsv'}"
+    assert read_training_data( paths ) == ( [ 'd é', 'e' ], [ 1, 0 ] )
+    assert read_training_data( [ str( shards / 'pseudo_labeled.tsv' ), str( shards / 'train_data-00001.tsv' ) ] ) == ( [ 'e', 'a b', 'c' ], [ 0, 1, 0 ] )
+
+def test_parquet_shards( shards ):
+    pd = pytest.importorskip( 'pandas' )
+    pytest.importorskip( 'pyarrow' )
+    pd.DataFrame( { 'text': [ 'f g' ], 'label': [ 'accepted' ], 'label_nr': [ 1 ], 'celex': [ 'celex' ] } ).to_parquet( shards / 'train_data-00003.parquet', index=False )
+    assert read_training_data( str( shards / 'train_data-*' ) ) == ( [ 'a b', 'c', 'd é', 'f g' ], [ 1, 0, 1, 1 ] )
+
+def test_no_files( tmp_path ):
+    with pytest.raises( FileNotFoundError ):
+        training_data_files( str( tmp_path / '*.tsv' ) )